@@ -11,6 +11,9 @@ set /p OldVersion=Please input old proto version(%DefaultOldVersion%):
 if "%NewVersion%"=="" set NewVersion=%DefaultNewVersion%
 if "%OldVersion%"=="" set OldVersion=%DefaultOldVersion%
 
+:: Opcodes per translator class, 0 keeps one handler class per opcode
+set Group=0
+
 if "%NewVersion%"=="%OldVersion%" (
     echo The same version, build in direct forword mode
     set Direct=1
@@ -37,49 +40,7 @@ python rename_proto_class.py %NewVersion% %OldVersion%
 cd ..\..\
 
 
-:: 3) Build proto
-
-if exist ".\src\generated" rmdir /S /Q ".\src\generated"
-
-if not exist ".\src\generated" md ".\src\generated"
-
-if defined Direct (
-    @REM .\tools\protoc\protoc.exe -I=".\proto\%NewVersion%\proto" --java_out=".\src\generated" ".\proto\%NewVersion%\proto\Birthday.proto" ".\proto\%NewVersion%\proto\ChatInfo.proto" ".\proto\%NewVersion%\proto\FriendBrief.proto" ".\proto\%NewVersion%\proto\FriendEnterHomeOption.proto" ".\proto\%NewVersion%\proto\FriendOnlineState.proto" ".\proto\%NewVersion%\proto\GetPlayerFriendListRsp.proto" ".\proto\%NewVersion%\proto\GetPlayerSocialDetailReq.proto" ".\proto\%NewVersion%\proto\GetPlayerSocialDetailRsp.proto" ".\proto\%NewVersion%\proto\GetPlayerTokenReq.proto" ".\proto\%NewVersion%\proto\GetPlayerTokenRsp.proto" ".\proto\%NewVersion%\proto\MapMarkFromType.proto" ".\proto\%NewVersion%\proto\MapMarkPoint.proto" ".\proto\%NewVersion%\proto\MapMarkPointType.proto" ".\proto\%NewVersion%\proto\MarkMapReq.proto" ".\proto\%NewVersion%\proto\MovingPlatformType.proto" ".\proto\%NewVersion%\proto\PlatformType.proto" ".\proto\%NewVersion%\proto\PrivateChatNotify.proto" ".\proto\%NewVersion%\proto\PrivateChatReq.proto" ".\proto\%NewVersion%\proto\PrivateChatRsp.proto" ".\proto\%NewVersion%\proto\ProfilePicture.proto" ".\proto\%NewVersion%\proto\ProfilePictureChangeNotify.proto" ".\proto\%NewVersion%\proto\PullPrivateChatReq.proto" ".\proto\%NewVersion%\proto\PullPrivateChatRsp.proto" ".\proto\%NewVersion%\proto\PullRecentChatRsp.proto" ".\proto\%NewVersion%\proto\ReadPrivateChatReq.proto" ".\proto\%NewVersion%\proto\SocialDetail.proto" ".\proto\%NewVersion%\proto\SocialShowAvatarInfo.proto" ".\proto\%NewVersion%\proto\StopServerInfo.proto" ".\proto\%NewVersion%\proto\Vector.proto"
-    .\tools\protoc\protoc.exe -I=".\proto\%NewVersion%\proto" --java_out=".\src\generated" ".\proto\%NewVersion%\proto\Birthday.proto"
-    .\tools\protoc\protoc.exe -I=".\proto\%NewVersion%\proto" --java_out=".\src\generated" ".\proto\%NewVersion%\proto\ChatInfo.proto"
-    .\tools\protoc\protoc.exe -I=".\proto\%NewVersion%\proto" --java_out=".\src\generated" ".\proto\%NewVersion%\proto\FriendBrief.proto"
-    .\tools\protoc\protoc.exe -I=".\proto\%NewVersion%\proto" --java_out=".\src\generated" ".\proto\%NewVersion%\proto\FriendEnterHomeOption.proto"
-    .\tools\protoc\protoc.exe -I=".\proto\%NewVersion%\proto" --java_out=".\src\generated" ".\proto\%NewVersion%\proto\FriendOnlineState.proto"
-    .\tools\protoc\protoc.exe -I=".\proto\%NewVersion%\proto" --java_out=".\src\generated" ".\proto\%NewVersion%\proto\GetPlayerFriendListRsp.proto"
-    .\tools\protoc\protoc.exe -I=".\proto\%NewVersion%\proto" --java_out=".\src\generated" ".\proto\%NewVersion%\proto\GetPlayerSocialDetailReq.proto"
-    .\tools\protoc\protoc.exe -I=".\proto\%NewVersion%\proto" --java_out=".\src\generated" ".\proto\%NewVersion%\proto\GetPlayerSocialDetailRsp.proto"
-    .\tools\protoc\protoc.exe -I=".\proto\%NewVersion%\proto" --java_out=".\src\generated" ".\proto\%NewVersion%\proto\GetPlayerTokenReq.proto"
-    .\tools\protoc\protoc.exe -I=".\proto\%NewVersion%\proto" --java_out=".\src\generated" ".\proto\%NewVersion%\proto\GetPlayerTokenRsp.proto"
-    .\tools\protoc\protoc.exe -I=".\proto\%NewVersion%\proto" --java_out=".\src\generated" ".\proto\%NewVersion%\proto\MapMarkFromType.proto"
-    .\tools\protoc\protoc.exe -I=".\proto\%NewVersion%\proto" --java_out=".\src\generated" ".\proto\%NewVersion%\proto\MapMarkPoint.proto"
-    .\tools\protoc\protoc.exe -I=".\proto\%NewVersion%\proto" --java_out=".\src\generated" ".\proto\%NewVersion%\proto\MapMarkPointType.proto"
-    .\tools\protoc\protoc.exe -I=".\proto\%NewVersion%\proto" --java_out=".\src\generated" ".\proto\%NewVersion%\proto\MarkMapReq.proto"
-    .\tools\protoc\protoc.exe -I=".\proto\%NewVersion%\proto" --java_out=".\src\generated" ".\proto\%NewVersion%\proto\MovingPlatformType.proto"
-    .\tools\protoc\protoc.exe -I=".\proto\%NewVersion%\proto" --java_out=".\src\generated" ".\proto\%NewVersion%\proto\PlatformType.proto"
-    .\tools\protoc\protoc.exe -I=".\proto\%NewVersion%\proto" --java_out=".\src\generated" ".\proto\%NewVersion%\proto\PrivateChatNotify.proto"
-    .\tools\protoc\protoc.exe -I=".\proto\%NewVersion%\proto" --java_out=".\src\generated" ".\proto\%NewVersion%\proto\PrivateChatReq.proto"
-    .\tools\protoc\protoc.exe -I=".\proto\%NewVersion%\proto" --java_out=".\src\generated" ".\proto\%NewVersion%\proto\ProfilePicture.proto"
-    .\tools\protoc\protoc.exe -I=".\proto\%NewVersion%\proto" --java_out=".\src\generated" ".\proto\%NewVersion%\proto\ProfilePictureChangeNotify.proto"
-    .\tools\protoc\protoc.exe -I=".\proto\%NewVersion%\proto" --java_out=".\src\generated" ".\proto\%NewVersion%\proto\PullPrivateChatReq.proto"
-    .\tools\protoc\protoc.exe -I=".\proto\%NewVersion%\proto" --java_out=".\src\generated" ".\proto\%NewVersion%\proto\PullPrivateChatRsp.proto"
-    .\tools\protoc\protoc.exe -I=".\proto\%NewVersion%\proto" --java_out=".\src\generated" ".\proto\%NewVersion%\proto\PullRecentChatRsp.proto"
-    .\tools\protoc\protoc.exe -I=".\proto\%NewVersion%\proto" --java_out=".\src\generated" ".\proto\%NewVersion%\proto\ReadPrivateChatReq.proto"
-    .\tools\protoc\protoc.exe -I=".\proto\%NewVersion%\proto" --java_out=".\src\generated" ".\proto\%NewVersion%\proto\SocialDetail.proto"
-    .\tools\protoc\protoc.exe -I=".\proto\%NewVersion%\proto" --java_out=".\src\generated" ".\proto\%NewVersion%\proto\SocialShowAvatarInfo.proto"
-    .\tools\protoc\protoc.exe -I=".\proto\%NewVersion%\proto" --java_out=".\src\generated" ".\proto\%NewVersion%\proto\StopServerInfo.proto"
-    .\tools\protoc\protoc.exe -I=".\proto\%NewVersion%\proto" --java_out=".\src\generated" ".\proto\%NewVersion%\proto\Vector.proto"
-) else (
-    .\tools\protoc\protoc.exe -I=".\proto\%NewVersion%\proto" --java_out=".\src\generated" ".\proto\%NewVersion%\proto\*.proto"
-    .\tools\protoc\protoc.exe -I=".\proto\%OldVersion%\proto" --java_out=".\src\generated" ".\proto\%OldVersion%\proto\*.proto"
-)
-
-
-:: 4) Translate proto to json, then java
+:: 3) Translate proto to json, then java
 
 if not defined Direct (
     cd tools\proto2json
@@ -88,7 +49,19 @@ if not defined Direct (
 )
 
 cd tools\protojson2java
-python protojson2java.py %Direct%
+:: Pairs opcodes renamed between the versions, review message_map.json before building
+if not defined Direct python messageMatch.py
+python protojson2java.py %Direct% --group %Group%
 cd ..\..\
 
+
+:: 4) Build the protos the generated and hand-written code reference
+
+if exist ".\src\generated" rmdir /S /Q ".\src\generated"
+
+cd tools\proto_closure
+python proto_closure.py %NewVersion% %OldVersion%
+cd ..\..\
+
+
 pause
\ No newline at end of file
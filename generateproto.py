@@ -0,0 +1,304 @@
+"""
+Cross-platform replacement for generateproto.bat and generateprotoex.bat.
+
+    python generateproto.py <new version> <old version> [--ex | --shadow] [--schema-diff] [--group N] [--profile FILE [--trim]] [--jmh [--jmh-top N]]
+
+The steps form a DAG with declared inputs and outputs. Independent steps run in parallel,
+and a step is skipped when its command, inputs and outputs are unchanged since its last run.
+"""
+
+import argparse
+import glob
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+TOOLS_DIR = os.path.join(ROOT_DIR, "tools")
+PROTO_DIR = os.path.join(ROOT_DIR, "proto")
+JAVA_DIR = os.path.join(ROOT_DIR, "src", "main", "java")
+NET_PACKET_DIR = os.path.join(JAVA_DIR, "emu", "protoshift", "net", "packet")
+SERVER_PACKET_DIR = os.path.join(JAVA_DIR, "emu", "protoshift", "server", "packet")
+SERVER_SHADOW_DIR = os.path.join(JAVA_DIR, "emu", "protoshift", "server", "shadow")
+PROTOJSON_DIR = os.path.join(TOOLS_DIR, "proto2json", "output")
+GENERATED_DIR = os.path.join(ROOT_DIR, "src", "generated")
+BENCH_DIR = os.path.join(ROOT_DIR, "bench")
+STATE_FILE = os.path.join(ROOT_DIR, ".generateproto.json")
+MESSAGE_MAP = os.path.join(TOOLS_DIR, "protojson2java", "message_map.json")
+
+
+class Stage:
+    def __init__(self, name, tool, command, deps=(), inputs=(), outputs=(), clean=(), mkdirs=()):
+        self.name = name
+        self.cwd = os.path.join(TOOLS_DIR, tool)
+        self.command = command
+        self.deps = list(deps)
+        # Files, directories (walked recursively) or glob patterns
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        # Directories removed, and created, before the stage runs
+        self.clean = list(clean)
+        self.mkdirs = list(mkdirs)
+
+
+def expand(paths):
+    files = []
+    for pattern in paths:
+        for path in glob.glob(pattern) if glob.has_magic(pattern) else [pattern]:
+            if os.path.isdir(path):
+                for dirpath, _, filenames in os.walk(path):
+                    files.extend(os.path.join(dirpath, filename) for filename in filenames)
+            elif os.path.exists(path):
+                files.append(path)
+    return sorted(files)
+
+
+def signature(stage):
+    digest = hashlib.sha1(json.dumps(stage.command).encode())
+    for path in expand(stage.inputs) + expand(stage.outputs):
+        st = os.stat(path)
+        digest.update(f"{path}\0{st.st_mtime_ns}\0{st.st_size}\0".encode())
+    return digest.hexdigest()
+
+
+def up_to_date(stage, state):
+    if not all(os.path.exists(path) for path in stage.outputs):
+        return False
+    return state.get(stage.name) == signature(stage)
+
+
+def find_proto2json():
+    for name in ("proto2json.exe" if os.name == "nt" else "proto2json",):
+        path = os.path.join(TOOLS_DIR, "proto2json", name)
+        if os.path.exists(path):
+            return [path]
+    # -mod=mod lets the first run resolve the parser into go.sum
+    return ["go", "run", "-mod=mod", "proto2json.go"]
+
+
+def build_stages(args):
+    python = sys.executable
+    direct = args.new_version == args.old_version
+    versions = [args.new_version] if direct else [args.new_version, args.old_version]
+    cmdid = [os.path.join(PROTO_DIR, version, name)
+             for version in versions for name in ("cmdid.csv", "cmdid.json", "packetIds.json")]
+    protos = [os.path.join(PROTO_DIR, version, "proto") for version in versions]
+    generator = "protojson2javaex" if args.ex else "protojson2java"
+
+    stages = [
+        Stage("opcode_shift", "opcode_shift",
+              [python, "opcode_shift.py", args.new_version, args.old_version],
+              inputs=cmdid + [os.path.join(TOOLS_DIR, "opcode_shift", "opcode_shift.py")],
+              outputs=[os.path.join(NET_PACKET_DIR, "PacketOpcodes.java"),
+                       os.path.join(NET_PACKET_DIR, "PacketOpcodesUtil.java")]
+              + ([] if direct else [os.path.join(TOOLS_DIR, "protojson2java", "cmdIdList.py")])),
+        Stage("rename_proto_class", "rename_proto_class",
+              [python, "rename_proto_class.py", args.new_version, args.old_version],
+              inputs=protos + [os.path.join(TOOLS_DIR, "rename_proto_class", "rename_proto_class.py")]),
+    ]
+
+    command = [python, generator + ".py"]
+    if direct:
+        command.append("1")
+    if args.group and not args.ex:
+        command += ["--group", str(args.group)]
+    if args.profile:
+        command += ["--profile", os.path.abspath(args.profile)]
+    if args.trim:
+        command.append("--trim")
+    if args.jmh:
+        command.append("--jmh")
+    if args.jmh_top:
+        command += ["--jmh-top", str(args.jmh_top)]
+    deps = ["opcode_shift"]
+    inputs = [os.path.join(TOOLS_DIR, "protojson2java", "*.py"),
+              os.path.join(TOOLS_DIR, "protojson2java", "direction_override.json")]
+    if args.profile:
+        inputs.append(args.profile)
+    if not direct:
+        # One process for both versions, the checked-in proto2json.exe only knows this form
+        stages.append(Stage("proto2json", "proto2json", find_proto2json() + [args.new_version, args.old_version],
+                            deps=["rename_proto_class"],
+                            inputs=[os.path.join(PROTO_DIR, args.new_version, "proto"),
+                                    os.path.join(PROTO_DIR, args.old_version, "proto"),
+                                    os.path.join(TOOLS_DIR, "proto2json", "proto2json.go")],
+                            outputs=[os.path.join(PROTOJSON_DIR, "new"), os.path.join(PROTOJSON_DIR, "old")]))
+        deps.append("proto2json")
+        match_deps = ["opcode_shift", "proto2json"]
+        inputs += [os.path.join(PROTOJSON_DIR, "new"), os.path.join(PROTOJSON_DIR, "old")]
+        # Proposes pairs for renamed opcodes, message_map.json is reviewed and kept between runs
+        message_map = MESSAGE_MAP
+        stages.append(Stage("message_match", "protojson2java", [python, "messageMatch.py"], deps=match_deps,
+                            inputs=[os.path.join(TOOLS_DIR, "protojson2java", "messageMatch.py"),
+                                    os.path.join(TOOLS_DIR, "protojson2java", "protoSchema.py"),
+                                    os.path.join(TOOLS_DIR, "protojson2java", "cmdIdList.py"),
+                                    os.path.join(PROTOJSON_DIR, "new"), os.path.join(PROTOJSON_DIR, "old")],
+                            outputs=[message_map]))
+        deps.append("message_match")
+        inputs.append(message_map)
+        if args.schema_diff:
+            # The translation as data, reloaded by a running proxy, see SchemaDiff
+            stages.append(Stage("schema_diff", "schema_diff",
+                                [python, "schema_diff.py", args.new_version, args.old_version],
+                                deps=["message_match"],
+                                inputs=cmdid + [os.path.join(TOOLS_DIR, "schema_diff", "schema_diff.py"),
+                                                os.path.join(TOOLS_DIR, "capture", "capture_translate.py"),
+                                                os.path.join(PROTOJSON_DIR, "new"), os.path.join(PROTOJSON_DIR, "old"),
+                                                message_map],
+                                outputs=[os.path.join(ROOT_DIR, "schema_diff.bin")]))
+    handlers = [os.path.join(SERVER_PACKET_DIR, "recv"), os.path.join(SERVER_PACKET_DIR, "send")]
+    stages.append(Stage(generator, "protojson2java", command, deps=deps, inputs=inputs,
+                        outputs=[SERVER_PACKET_DIR] + ([BENCH_DIR] if args.jmh else []),
+                        clean=handlers, mkdirs=[] if direct else handlers))
+    if args.shadow:
+        # Typed handlers next to the JSON ones, compared on live traffic by ShadowValidator
+        shadow = [python, "protojson2javaex.py", "--shadow"]
+        if args.profile:
+            shadow += ["--profile", os.path.abspath(args.profile)]
+        if args.trim:
+            shadow.append("--trim")
+        stages.append(Stage("protojson2javaex_shadow", "protojson2java", shadow, deps=deps, inputs=inputs,
+                            outputs=[SERVER_SHADOW_DIR], clean=[SERVER_SHADOW_DIR]))
+
+    # protoc reads the sources the generator wrote to pick its closure
+    closure = os.path.join(TOOLS_DIR, "proto_closure", "proto_closure.py")
+    # Classes left over from a build in the other mode
+    stale = [os.path.join(GENERATED_DIR, "emu", "protoshift", "net", package)
+             for package in (("newproto", "oldproto") if direct else ("proto",))]
+    for side, version, package in ((("new", args.new_version, "proto"),) if direct else
+                                   (("new", args.new_version, "newproto"), ("old", args.old_version, "oldproto"))):
+        stages.append(Stage("protoc_" + side, "proto_closure",
+                            [python, "proto_closure.py", args.new_version, args.old_version, "--only", side]
+                            + (["--fallback"] if args.trim and not direct else []),
+                            deps=["rename_proto_class", generator] + (["protojson2javaex_shadow"] if args.shadow else []),
+                            inputs=[JAVA_DIR, os.path.join(PROTO_DIR, version, "proto"), closure],
+                            outputs=[os.path.join(GENERATED_DIR, "emu", "protoshift", "net", package)],
+                            clean=stale))
+    return stages
+
+
+def run_stage(stage):
+    for path in stage.clean:
+        shutil.rmtree(path, ignore_errors=True)
+    for path in stage.mkdirs:
+        os.makedirs(path, exist_ok=True)
+    start = time.perf_counter()
+    result = subprocess.run(stage.command, cwd=stage.cwd, stdout=subprocess.PIPE,
+                            stderr=subprocess.STDOUT, text=True)
+    return result.returncode, result.stdout, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate opcodes, translators and proto classes.")
+    parser.add_argument("new_version", nargs="?", default="v4.0.0")
+    parser.add_argument("old_version", nargs="?", default="v4.0.0")
+    parser.add_argument("--ex", action="store_true", help="use the typed generator protojson2javaex.py")
+    parser.add_argument("--shadow", action="store_true",
+                        help="also generate the typed handlers as shadows of the JSON ones, see ShadowValidator")
+    parser.add_argument("--schema-diff", action="store_true",
+                        help="also compile the schema diff served by SchemaDiffTranslator to schema_diff.bin")
+    parser.add_argument("--group", type=int, default=0, help="opcodes per translator class")
+    parser.add_argument("--profile", help="opcode traffic profile exported by the proxy")
+    parser.add_argument("--trim", action="store_true", help="only emit translators for profiled opcodes")
+    parser.add_argument("--jmh", action="store_true", help="also emit the JMH benchmark module in bench/")
+    parser.add_argument("--jmh-top", type=int, default=0, help="only benchmark the N busiest opcodes of the profile")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(), help="stages run in parallel")
+    parser.add_argument("--force", action="store_true", help="run every stage even if up to date")
+    args = parser.parse_args()
+    if args.trim and args.profile is None:
+        parser.error("--trim needs --profile")
+    if args.jmh_top and args.profile is None:
+        parser.error("--jmh-top needs --profile")
+    if args.jmh and args.new_version == args.old_version:
+        parser.error("--jmh only benchmarks translators between two versions")
+    if args.ex and args.new_version == args.old_version:
+        parser.error("--ex only translates between two versions")
+    if args.shadow and (args.ex or args.new_version == args.old_version):
+        parser.error("--shadow compares the typed handlers with the JSON ones between two versions")
+    if args.schema_diff and args.new_version == args.old_version:
+        parser.error("--schema-diff only translates between two versions")
+
+    # Shadow handlers left over from a --shadow build would no longer match the protos
+    if not args.shadow:
+        shutil.rmtree(SERVER_SHADOW_DIR, ignore_errors=True)
+
+    stages = {stage.name: stage for stage in build_stages(args)}
+    state = {}
+    if not args.force and os.path.exists(STATE_FILE):
+        with open(STATE_FILE, "r", encoding="utf-8") as f:
+            state = json.load(f)
+
+    pending = dict(stages)
+    done, failed = set(), set()
+    timings = {}
+    total = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=max(args.jobs, 1)) as executor:
+        running = {}
+        while pending or running:
+            for name, stage in list(pending.items()):
+                if any(dep in failed for dep in stage.deps):
+                    print(f"[{name}] skipped, a dependency failed")
+                    failed.add(name)
+                    del pending[name]
+                elif all(dep in done for dep in stage.deps):
+                    del pending[name]
+                    # Outputs of dependencies are inputs here, so their reruns show in the signature
+                    if up_to_date(stage, state):
+                        print(f"[{name}] up to date")
+                        timings[name] = None
+                        done.add(name)
+                    else:
+                        print(f"[{name}] running")
+                        running[executor.submit(run_stage, stage)] = name
+            if not running:
+                continue
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                code, output, elapsed = future.result()
+                if output:
+                    print("".join(f"[{name}] {line}\n" for line in output.splitlines()), end="")
+                timings[name] = elapsed
+                if code != 0:
+                    print(f"[{name}] failed with exit code {code}")
+                    failed.add(name)
+                    state.pop(name, None)
+                else:
+                    done.add(name)
+                    state[name] = signature(stages[name])
+
+    with open(STATE_FILE, "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=2)
+
+    print()
+    for name in stages:
+        if name in timings and timings[name] is not None:
+            status = f"{timings[name]:8.2f}s" + ("  failed" if name in failed else "")
+        else:
+            status = "  skipped" if name in failed else "  up to date"
+        print(f"{name:24}{status}")
+    print(f"{'total':24}{time.perf_counter() - total:8.2f}s")
+
+    if args.new_version != args.old_version:
+        # Only accepted pairs are translated, the others wait for a reviewer
+        sys.path.insert(0, os.path.join(TOOLS_DIR, "protojson2java"))
+        from messageMatch import pending_proposals
+        proposals = pending_proposals(MESSAGE_MAP)
+        if proposals:
+            print()
+            print(f"{len(proposals)} renamed opcodes proposed in {MESSAGE_MAP} are not translated,"
+                  f" set \"reviewed\": true to accept or \"old\": null to reject them")
+            for name, entry in sorted(proposals.items()):
+                print(f"  {name} <- {entry['old']} ({entry.get('score')})")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -29,21 +29,22 @@ python rename_proto_class.py %NewVersion% %OldVersion%
 cd ..\..\
 
 
-:: 3) Build proto
-
-del /Q ".\src\generated"
-
-if not exist ".\src\generated" md ".\src\generated"
-
-.\tools\protoc\protoc.exe -I=".\proto\%NewVersion%\proto" --java_out=".\src\generated" ".\proto\%NewVersion%\proto\*.proto"
-.\tools\protoc\protoc.exe -I=".\proto\%OldVersion%\proto" --java_out=".\src\generated" ".\proto\%OldVersion%\proto\*.proto"
-
-
-:: 4) Translate proto to json, then java
+:: 3) Translate proto to json, then java
 
 cd tools\proto2json
 proto2json.exe %NewVersion% %OldVersion%
 
 cd ..\protojson2java
+:: Pairs opcodes renamed between the versions, review message_map.json before building
+python messageMatch.py
 python protojson2javaex.py
-cd ..\..\
\ No newline at end of file
+cd ..\..\
+
+
+:: 4) Build the protos the generated and hand-written code reference
+
+del /Q ".\src\generated"
+
+cd tools\proto_closure
+python proto_closure.py %NewVersion% %OldVersion%
+cd ..\..\
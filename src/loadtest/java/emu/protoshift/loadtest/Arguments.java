@@ -0,0 +1,43 @@
+package emu.protoshift.loadtest;
+
+import java.util.HashMap;
+import java.util.Map;
+
+/*
+ * "--name value" and "--flag" command line options.
+ */
+final class Arguments {
+    private final Map<String, String> values = new HashMap<>();
+
+    Arguments(String[] args) {
+        for (int i = 0; i < args.length; i++) {
+            if (!args[i].startsWith("--"))
+                throw new IllegalArgumentException("Unexpected argument " + args[i]);
+            var name = args[i].substring(2);
+            if (i + 1 < args.length && !args[i + 1].startsWith("--"))
+                values.put(name, args[++i]);
+            else
+                values.put(name, "");
+        }
+    }
+
+    boolean has(String name) {
+        return values.containsKey(name);
+    }
+
+    String get(String name, String fallback) {
+        return values.getOrDefault(name, fallback);
+    }
+
+    int getInt(String name, int fallback) {
+        return has(name) ? Integer.parseInt(values.get(name)) : fallback;
+    }
+
+    long getLong(String name, long fallback) {
+        return has(name) ? Long.parseLong(values.get(name)) : fallback;
+    }
+
+    double getDouble(String name, double fallback) {
+        return has(name) ? Double.parseDouble(values.get(name)) : fallback;
+    }
+}
@@ -0,0 +1,63 @@
+package emu.protoshift.loadtest;
+
+import java.io.IOException;
+import java.nio.ByteBuffer;
+import java.nio.ByteOrder;
+import java.nio.channels.FileChannel;
+import java.nio.charset.StandardCharsets;
+import java.nio.file.Path;
+import java.nio.file.StandardOpenOption;
+import java.util.ArrayList;
+import java.util.List;
+import java.util.Set;
+
+/*
+ * Payloads of one version from a corpus written by tools/benchmark/payload_corpus.py, held in memory.
+ */
+final class Corpus {
+    private static final String MAGIC = "PSCORPUS";
+    private static final int FORMAT = 1;
+    private static final int ENTRY_SIZE = 20;
+    private static final int FOOTER_SIZE = 24;
+
+    record Entry(int opcode, byte[] payload) {
+    }
+
+    static List<Entry> load(Path path, int version, Set<Integer> excluded) throws IOException {
+        try (var channel = FileChannel.open(path, StandardOpenOption.READ)) {
+            var header = read(channel, 0, 12);
+            var footer = read(channel, channel.size() - FOOTER_SIZE, FOOTER_SIZE);
+            if (!magic(header, 0) || !magic(footer, 16))
+                throw new IOException(path + " is not a payload corpus");
+            if (header.getInt(8) != FORMAT)
+                throw new IOException(path + " has corpus format " + header.getInt(8) + ", expected " + FORMAT);
+
+            long entries = footer.getLong(8);
+            var index = channel.map(FileChannel.MapMode.READ_ONLY, footer.getLong(0), entries * ENTRY_SIZE)
+                    .order(ByteOrder.LITTLE_ENDIAN);
+            var result = new ArrayList<Entry>();
+            for (int i = 0; i < entries; i++) {
+                int position = i * ENTRY_SIZE;
+                int opcode = index.getInt(position);
+                if (index.getInt(position + 4) == version && !excluded.contains(opcode))
+                    result.add(new Entry(opcode, read(channel, index.getLong(position + 8), index.getInt(position + 16)).array()));
+            }
+            return result;
+        }
+    }
+
+    private static ByteBuffer read(FileChannel channel, long position, int length) throws IOException {
+        var buffer = ByteBuffer.allocate(length).order(ByteOrder.LITTLE_ENDIAN);
+        while (buffer.hasRemaining()) {
+            if (channel.read(buffer, position + buffer.position()) < 0)
+                throw new IOException("Truncated payload corpus");
+        }
+        return buffer.flip();
+    }
+
+    private static boolean magic(ByteBuffer buffer, int offset) {
+        var bytes = new byte[MAGIC.length()];
+        buffer.get(offset, bytes);
+        return new String(bytes, StandardCharsets.US_ASCII).equals(MAGIC);
+    }
+}
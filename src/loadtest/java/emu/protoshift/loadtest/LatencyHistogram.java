@@ -0,0 +1,64 @@
+package emu.protoshift.loadtest;
+
+import java.util.LinkedHashMap;
+import java.util.Map;
+import java.util.concurrent.atomic.AtomicLongArray;
+
+/*
+ * Log-linear histogram of nanoseconds, 32 buckets per power of two (about 3% precision),
+ * recorded into from any thread without locking.
+ */
+final class LatencyHistogram {
+    private static final int SUB_BUCKETS = 32;
+
+    private final AtomicLongArray counts = new AtomicLongArray(60 * SUB_BUCKETS);
+
+    private static int index(long value) {
+        if (value < 2 * SUB_BUCKETS)
+            return (int) value;
+        int shift = 63 - Long.numberOfLeadingZeros(value) - 5;
+        return shift * SUB_BUCKETS + (int) (value >>> shift);
+    }
+
+    // Highest value of the bucket
+    private static long value(int index) {
+        if (index < 2 * SUB_BUCKETS)
+            return index;
+        int shift = index / SUB_BUCKETS - 1;
+        return ((long) (index % SUB_BUCKETS + SUB_BUCKETS + 1) << shift) - 1;
+    }
+
+    void record(long nanos) {
+        counts.incrementAndGet(index(Math.max(nanos, 0)));
+    }
+
+    long count() {
+        long total = 0;
+        for (int i = 0; i < counts.length(); i++)
+            total += counts.get(i);
+        return total;
+    }
+
+    long percentile(double percentile) {
+        long total = count();
+        if (total == 0)
+            return 0;
+        long target = Math.max(1, (long) Math.ceil(total * percentile / 100));
+        long seen = 0;
+        for (int i = 0; i < counts.length(); i++) {
+            seen += counts.get(i);
+            if (seen >= target)
+                return value(i);
+        }
+        return value(counts.length() - 1);
+    }
+
+    // Microseconds at the usual percentiles
+    Map<String, Double> summary() {
+        var result = new LinkedHashMap<String, Double>();
+        for (double percentile : new double[]{50, 90, 99, 99.9, 100})
+            result.put("p" + (percentile == (long) percentile ? String.valueOf((long) percentile) : String.valueOf(percentile)),
+                    percentile(percentile) / 1000.0);
+        return result;
+    }
+}
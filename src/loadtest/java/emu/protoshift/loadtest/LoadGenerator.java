@@ -0,0 +1,345 @@
+package emu.protoshift.loadtest;
+
+import com.google.gson.GsonBuilder;
+import com.google.protobuf.InvalidProtocolBufferException;
+
+import emu.protoshift.ProtoShift;
+
+import emu.protoshift.config.Configuration;
+
+import emu.protoshift.net.packet.BasePacket;
+
+import emu.protoshift.utils.Crypto;
+import emu.protoshift.utils.Utils;
+
+import io.netty.buffer.ByteBuf;
+
+import kcp.highway.KcpClient;
+import kcp.highway.KcpListener;
+import kcp.highway.Ukcp;
+
+import javax.crypto.Cipher;
+import java.io.FileWriter;
+import java.net.InetSocketAddress;
+import java.nio.ByteBuffer;
+import java.nio.file.Path;
+import java.security.KeyFactory;
+import java.security.interfaces.RSAPrivateCrtKey;
+import java.security.spec.RSAPublicKeySpec;
+import java.time.Duration;
+import java.util.ArrayList;
+import java.util.Base64;
+import java.util.LinkedHashMap;
+import java.util.List;
+import java.util.Map;
+import java.util.Set;
+import java.util.concurrent.ConcurrentHashMap;
+import java.util.concurrent.ThreadLocalRandom;
+import java.util.concurrent.atomic.AtomicInteger;
+import java.util.concurrent.atomic.AtomicLong;
+import java.util.concurrent.locks.LockSupport;
+
+/*
+ * Simulates clients against a running proxy on loopback and reports end-to-end latency,
+ * packets/s and the proxy's CPU per 1k sessions. Sessions log in through the proxy, then send
+ * payloads of the new version from the corpus at a fixed rate whether or not answers come back
+ * (open loop), so a slow proxy shows up as latency and not as a lower send rate.
+ *
+ * The 16 byte packet header carries the scheduled send time, the session and a sequence number.
+ * The proxy forwards headers untouched and the stand-in gateserver answers with the request's
+ * header, so the round trip is measured from when the packet should have been sent.
+ *
+ *   gradle loadTest --args="--sessions 1000 --rate 10 --corpus corpus.bin --gate --proxy-pid 1234"
+ *
+ *   --sessions N      simulated clients (100)
+ *   --rate R          packets a second per session (10)
+ *   --ramp S          seconds to connect all sessions over (10)
+ *   --warmup S        seconds after the ramp before measuring (5)
+ *   --duration S      seconds measured (30)
+ *   --threads N       sender threads (a quarter of the cores)
+ *   --corpus FILE     corpus from tools/benchmark/payload_corpus.py, ideally made with --profile
+ *   --proxy HOST:PORT the proxy (127.0.0.1 and the game port of config.json)
+ *   --proxy-pid PID   the proxy's process, for its CPU time
+ *   --gate            run the stand-in gateserver in this process, it takes its own options too
+ *   --output FILE     also write the report as JSON
+ *
+ * The proxy has to be generated in translation mode, both versions' messages are built by name.
+ */
+public final class LoadGenerator {
+    private static final int HEADER_SIZE = 16;
+
+    private final Arguments arguments;
+    private final int sessionCount;
+    private final double rate;
+    private final int tokenReq = Wire.opcode("GetPlayerTokenReq", true);
+    private final int tokenRsp = Wire.opcode("GetPlayerTokenRsp", true);
+    private final List<Corpus.Entry> corpus;
+
+    private final KcpClient client = new KcpClient();
+    private final Map<Ukcp, Session> sessions = new ConcurrentHashMap<>();
+    private final List<Session> started = new ArrayList<>();
+    private final AtomicInteger loggedIn = new AtomicInteger();
+    private final AtomicLong sent = new AtomicLong();
+    private final AtomicLong received = new AtomicLong();
+    private final AtomicLong failed = new AtomicLong();
+    private final LatencyHistogram latency = new LatencyHistogram();
+    private final LatencyHistogram loginLatency = new LatencyHistogram();
+
+    private volatile long measureFrom = Long.MAX_VALUE;
+    private volatile long measureUntil = Long.MAX_VALUE;
+    private volatile boolean sending = true;
+
+    private final class Session {
+        final int index;
+        final Ukcp ukcp;
+        final long connectedAt = System.nanoTime();
+        final long interval;
+        volatile byte[] key;
+        long nextSend;
+        int seq;
+
+        Session(int index, Ukcp ukcp) {
+            this.index = index;
+            this.ukcp = ukcp;
+            this.interval = (long) (1e9 / rate);
+        }
+    }
+
+    private class Listener implements KcpListener {
+        @Override
+        public void onConnected(Ukcp ukcp) {
+        }
+
+        @Override
+        public void handleReceive(ByteBuf buf, Ukcp ukcp) {
+            var session = sessions.get(ukcp);
+            if (session == null)
+                return;
+            long now = System.nanoTime();
+            byte[] data = Utils.byteBufToArray(buf);
+            if (Wire.decrypt(data, session.key) == null)
+                return;
+            for (var frame : Wire.split(data)) {
+                if (frame.opcode() == tokenRsp && session.key == null)
+                    onLogin(session, frame, now);
+                else
+                    onReceive(session, frame, now);
+            }
+        }
+
+        @Override
+        public void handleException(Throwable ex, Ukcp ukcp) {
+            ProtoShift.getLogger().error("Load generator exception", ex);
+        }
+
+        @Override
+        public void handleClose(Ukcp ukcp) {
+            if (sessions.remove(ukcp) != null && sending)
+                ProtoShift.getLogger().warn("A session was closed by the proxy");
+        }
+    }
+
+    public LoadGenerator(Arguments arguments) throws Exception {
+        this.arguments = arguments;
+        sessionCount = arguments.getInt("sessions", 100);
+        rate = arguments.getDouble("rate", 10);
+        if (!arguments.has("corpus"))
+            throw new IllegalArgumentException("--corpus is required");
+        corpus = Corpus.load(Path.of(arguments.get("corpus", "")), 1, Set.of(tokenReq, tokenRsp));
+        if (corpus.isEmpty())
+            throw new IllegalArgumentException("The corpus has no payloads of the new version");
+    }
+
+    public Map<String, Object> run() throws Exception {
+        if (arguments.has("gate"))
+            new StandInGateServer(arguments);
+
+        var proxy = arguments.get("proxy", "127.0.0.1:" + Configuration.GAME.bindPort).split(":");
+        var address = new InetSocketAddress(proxy[0], Integer.parseInt(proxy[1]));
+        var config = Wire.channelConfig();
+        client.init(config, new Listener());
+
+        long ramp = (long) (arguments.getDouble("ramp", 10) * 1e9);
+        long warmup = (long) (arguments.getDouble("warmup", 5) * 1e9);
+        long duration = (long) (arguments.getDouble("duration", 30) * 1e9);
+        long start = System.nanoTime();
+        measureFrom = start + ramp + warmup;
+        measureUntil = measureFrom + duration;
+
+        var senders = new ArrayList<Thread>();
+        int threads = arguments.getInt("threads", Math.max(1, Runtime.getRuntime().availableProcessors() / 4));
+        for (int i = 0; i < threads; i++) {
+            int shard = i;
+            var thread = new Thread(() -> sendLoop(shard, threads), "LoadGenerator-" + i);
+            thread.setDaemon(true);
+            thread.start();
+            senders.add(thread);
+        }
+
+        ProtoShift.getLogger().info("Connecting " + sessionCount + " sessions to " + address + " over " + ramp / 1_000_000_000 + "s");
+        for (int i = 0; i < sessionCount; i++) {
+            LockSupport.parkNanos(start + ramp * i / sessionCount - System.nanoTime());
+            var ukcp = client.connect(address, config);
+            var session = new Session(i, ukcp);
+            sessions.put(ukcp, session);
+            synchronized (started) {
+                started.add(session);
+            }
+            login(session);
+        }
+
+        LockSupport.parkNanos(measureFrom - System.nanoTime());
+        ProtoShift.getLogger().info(loggedIn.get() + " of " + sessionCount + " sessions logged in, measuring for " + duration / 1_000_000_000 + "s");
+        long cpuFrom = proxyCpu();
+        LockSupport.parkNanos(measureUntil - System.nanoTime());
+        long cpuUntil = proxyCpu();
+
+        // Let the answers to the last packets arrive before the sessions close
+        sending = false;
+        for (var thread : senders)
+            thread.join();
+        Thread.sleep(1000);
+        for (var session : sessions.values())
+            session.ukcp.close();
+        client.stop();
+
+        return report(duration, cpuFrom, cpuUntil);
+    }
+
+    private void login(Session session) {
+        var req = Wire.builder("GetPlayerTokenReq", true);
+        Wire.set(req, "account_type", 1);
+        Wire.set(req, "account_uid", String.valueOf(session.index));
+        Wire.set(req, "account_token", "loadtest");
+        Wire.set(req, "client_rand_key", clientRandKey());
+        byte[] data = Wire.build(tokenReq, header(session, System.nanoTime(), 0), req.build().toByteArray());
+        Wire.encrypt(data, BasePacket.EncryptType.DISPATCH_KEY, null);
+        Wire.write(session.ukcp, data);
+    }
+
+    // The key seed comes from the stand-in gateserver, client_rand_key only has to decrypt on the proxy
+    private static String clientRandKey() {
+        try {
+            var key = (RSAPrivateCrtKey) Crypto.SIGNING_KEY_FOR_CLIENT;
+            var publicKey = KeyFactory.getInstance("RSA").generatePublic(new RSAPublicKeySpec(key.getModulus(), key.getPublicExponent()));
+            var cipher = Cipher.getInstance("RSA/ECB/PKCS1Padding");
+            cipher.init(Cipher.ENCRYPT_MODE, publicKey);
+            return Base64.getEncoder().encodeToString(cipher.doFinal(ByteBuffer.allocate(8).putLong(ThreadLocalRandom.current().nextLong()).array()));
+        } catch (Exception e) {
+            return "";
+        }
+    }
+
+    private void onLogin(Session session, Wire.Frame frame, long now) {
+        try {
+            var rsp = Wire.builder("GetPlayerTokenRsp", true).mergeFrom(frame.payload()).build();
+            if (Wire.getLong(rsp, "retcode") != 0) {
+                ProtoShift.getLogger().warn("Session " + session.index + " failed to log in, retcode " + Wire.getLong(rsp, "retcode"));
+                return;
+            }
+            loginLatency.record(now - session.connectedAt);
+            synchronized (session) {
+                session.nextSend = now;
+                session.key = Crypto.generateKey(Wire.getLong(rsp, "secret_key_seed"));
+            }
+            loggedIn.incrementAndGet();
+        } catch (InvalidProtocolBufferException e) {
+            ProtoShift.getLogger().warn("Session " + session.index + " got a malformed GetPlayerTokenRsp");
+        }
+    }
+
+    private void onReceive(Session session, Wire.Frame frame, long now) {
+        if (now < measureFrom)
+            return;
+        received.incrementAndGet();
+        if (frame.header().length != HEADER_SIZE)
+            return;
+        var header = ByteBuffer.wrap(frame.header());
+        long scheduled = header.getLong();
+        if (header.getInt() == session.index && scheduled >= measureFrom && scheduled < measureUntil)
+            latency.record(now - scheduled);
+    }
+
+    // Each thread paces every threads-th session, a packet is due every interval from login on
+    private void sendLoop(int shard, int threads) {
+        var batch = new ArrayList<Session>();
+        while (sending) {
+            batch.clear();
+            synchronized (started) {
+                for (int i = shard; i < started.size(); i += threads)
+                    batch.add(started.get(i));
+            }
+            long now = System.nanoTime();
+            long next = now + 1_000_000;
+            for (var session : batch) {
+                synchronized (session) {
+                    if (session.key == null)
+                        continue;
+                    for (; session.nextSend <= now; session.nextSend += session.interval)
+                        send(session, session.nextSend);
+                    next = Math.min(next, session.nextSend);
+                }
+            }
+            LockSupport.parkNanos(next - System.nanoTime());
+        }
+    }
+
+    private void send(Session session, long scheduled) {
+        var entry = corpus.get(Math.floorMod(session.index * 31 + session.seq, corpus.size()));
+        byte[] data = Wire.build(entry.opcode(), header(session, scheduled, session.seq++), entry.payload());
+        Wire.encrypt(data, BasePacket.EncryptType.ENCRYPT_KEY, session.key);
+        boolean written = Wire.write(session.ukcp, data);
+        if (scheduled >= measureFrom && scheduled < measureUntil)
+            (written ? sent : failed).incrementAndGet();
+    }
+
+    private static byte[] header(Session session, long scheduled, int seq) {
+        return ByteBuffer.allocate(HEADER_SIZE).putLong(scheduled).putInt(session.index).putInt(seq).array();
+    }
+
+    // Total CPU time of the proxy process in nanoseconds, -1 without --proxy-pid
+    private long proxyCpu() {
+        if (!arguments.has("proxy-pid"))
+            return -1;
+        return ProcessHandle.of(arguments.getLong("proxy-pid", 0))
+                .flatMap(process -> process.info().totalCpuDuration())
+                .map(Duration::toNanos)
+                .orElse(-1L);
+    }
+
+    private Map<String, Object> report(long duration, long cpuFrom, long cpuUntil) {
+        double seconds = duration / 1e9;
+        var report = new LinkedHashMap<String, Object>();
+        report.put("sessions", sessionCount);
+        report.put("logged_in", loggedIn.get());
+        report.put("rate_per_session", rate);
+        report.put("seconds", seconds);
+        report.put("sent", sent.get());
+        report.put("send_failed", failed.get());
+        report.put("received", received.get());
+        report.put("sent_per_second", sent.get() / seconds);
+        report.put("received_per_second", received.get() / seconds);
+        report.put("latency_us", latency.summary());
+        report.put("latency_samples", latency.count());
+        report.put("login_latency_us", loginLatency.summary());
+        if (cpuFrom >= 0 && cpuUntil >= 0) {
+            double cores = (cpuUntil - cpuFrom) / (double) duration;
+            report.put("proxy_cpu_cores", cores);
+            report.put("proxy_cpu_cores_per_1k_sessions", cores * 1000 / Math.max(1, loggedIn.get()));
+        }
+        return report;
+    }
+
+    public static void main(String[] args) throws Exception {
+        var arguments = new Arguments(args);
+        var report = new LoadGenerator(arguments).run();
+        var json = new GsonBuilder().setPrettyPrinting().create().toJson(report);
+        System.out.println(json);
+        if (arguments.has("output")) {
+            try (var writer = new FileWriter(arguments.get("output", ""))) {
+                writer.write(json);
+            }
+        }
+        System.exit(0);
+    }
+}
@@ -0,0 +1,174 @@
+package emu.protoshift.loadtest;
+
+import emu.protoshift.ProtoShift;
+
+import emu.protoshift.config.Configuration;
+
+import emu.protoshift.net.packet.BasePacket;
+
+import emu.protoshift.utils.Crypto;
+import emu.protoshift.utils.Utils;
+
+import io.netty.buffer.ByteBuf;
+
+import kcp.highway.KcpListener;
+import kcp.highway.KcpServer;
+import kcp.highway.Ukcp;
+
+import java.net.InetSocketAddress;
+import java.nio.file.Path;
+import java.util.List;
+import java.util.Map;
+import java.util.Set;
+import java.util.concurrent.ConcurrentHashMap;
+import java.util.concurrent.Executors;
+import java.util.concurrent.ScheduledExecutorService;
+import java.util.concurrent.TimeUnit;
+import java.util.concurrent.atomic.AtomicInteger;
+import java.util.concurrent.atomic.AtomicLong;
+
+/*
+ * Stands in for the gateserver behind the proxy. It answers GetPlayerTokenReq with a known
+ * secret_key_seed, so the proxy and the load generator agree on the session key without RSA,
+ * then echoes, answers or swallows the traffic it is sent:
+ *
+ *   echo     the same opcode, header and payload back
+ *   respond  a payload of the old version from the corpus, carrying the request's header
+ *   sink     nothing
+ *
+ * With --push-rate, every logged in connection also gets that many corpus payloads a second
+ * with an empty header. Run it from the proxy's directory, it reads config.json for the port.
+ *
+ *   gradle standInGate --args="--mode respond --corpus corpus.bin"
+ */
+public final class StandInGateServer extends KcpServer {
+    private final long seed;
+    private final String mode;
+    private final double pushRate;
+    private final List<Corpus.Entry> corpus;
+    private final int tokenReq = Wire.opcode("GetPlayerTokenReq", false);
+    private final int tokenRsp = Wire.opcode("GetPlayerTokenRsp", false);
+
+    private final Map<Ukcp, Connection> connections = new ConcurrentHashMap<>();
+    private final AtomicInteger nextUid = new AtomicInteger(10000);
+    private final AtomicInteger nextPayload = new AtomicInteger();
+    private final AtomicLong received = new AtomicLong();
+    private final AtomicLong sent = new AtomicLong();
+    private final ScheduledExecutorService timer = Executors.newSingleThreadScheduledExecutor(runnable -> {
+        var thread = new Thread(runnable, "StandInGateServer");
+        thread.setDaemon(true);
+        return thread;
+    });
+
+    private static final class Connection {
+        volatile byte[] key;
+        double pushDebt;
+    }
+
+    public StandInGateServer(Arguments arguments) throws Exception {
+        seed = arguments.getLong("seed", 0x5eed5eedL);
+        mode = arguments.get("mode", "echo");
+        pushRate = arguments.getDouble("push-rate", 0);
+        if (!Set.of("echo", "respond", "sink").contains(mode))
+            throw new IllegalArgumentException("Unknown mode " + mode);
+        corpus = arguments.has("corpus")
+                ? Corpus.load(Path.of(arguments.get("corpus", "")), 2, Set.of(tokenReq, tokenRsp))
+                : List.of();
+        if (corpus.isEmpty() && (mode.equals("respond") || pushRate > 0))
+            throw new IllegalArgumentException("--corpus with payloads of the old version is needed to respond or push");
+
+        int port = arguments.getInt("port", Configuration.GATE_SERVER.port);
+        this.init(new Listener(), Wire.channelConfig(), new InetSocketAddress(port));
+        ProtoShift.getLogger().info("Stand-in gateserver (" + mode + ") started on port " + port);
+
+        timer.scheduleAtFixedRate(this::report, 1, 1, TimeUnit.SECONDS);
+        if (pushRate > 0)
+            timer.scheduleAtFixedRate(this::push, 10, 10, TimeUnit.MILLISECONDS);
+    }
+
+    private class Listener implements KcpListener {
+        @Override
+        public void onConnected(Ukcp ukcp) {
+            connections.put(ukcp, new Connection());
+        }
+
+        @Override
+        public void handleReceive(ByteBuf buf, Ukcp ukcp) {
+            var connection = connections.get(ukcp);
+            if (connection == null)
+                return;
+            byte[] data = Utils.byteBufToArray(buf);
+            var encryptType = Wire.decrypt(data, connection.key);
+            if (encryptType == null)
+                return;
+            for (var frame : Wire.split(data)) {
+                received.incrementAndGet();
+                if (frame.opcode() == tokenReq)
+                    login(ukcp, connection, frame, encryptType);
+                else if (connection.key != null)
+                    answer(ukcp, connection, frame, encryptType);
+            }
+        }
+
+        @Override
+        public void handleException(Throwable ex, Ukcp ukcp) {
+            ProtoShift.getLogger().error("Stand-in gateserver exception", ex);
+        }
+
+        @Override
+        public void handleClose(Ukcp ukcp) {
+            connections.remove(ukcp);
+        }
+    }
+
+    private void login(Ukcp ukcp, Connection connection, Wire.Frame frame, BasePacket.EncryptType encryptType) {
+        var rsp = Wire.builder("GetPlayerTokenRsp", false);
+        Wire.set(rsp, "retcode", 0);
+        Wire.set(rsp, "uid", nextUid.getAndIncrement());
+        Wire.set(rsp, "secret_key_seed", seed);
+        send(ukcp, tokenRsp, frame.header(), rsp.build().toByteArray(), encryptType, null);
+        connection.key = Crypto.generateKey(seed);
+    }
+
+    private void answer(Ukcp ukcp, Connection connection, Wire.Frame frame, BasePacket.EncryptType encryptType) {
+        switch (mode) {
+            case "echo" -> send(ukcp, frame.opcode(), frame.header(), frame.payload(), encryptType, connection.key);
+            case "respond" -> {
+                var entry = nextPayload();
+                send(ukcp, entry.opcode(), frame.header(), entry.payload(), encryptType, connection.key);
+            }
+        }
+    }
+
+    private void push() {
+        for (var entry : connections.entrySet()) {
+            var connection = entry.getValue();
+            if (connection.key == null)
+                continue;
+            connection.pushDebt += pushRate / 100;
+            for (; connection.pushDebt >= 1; connection.pushDebt--) {
+                var payload = nextPayload();
+                send(entry.getKey(), payload.opcode(), new byte[0], payload.payload(), BasePacket.EncryptType.ENCRYPT_KEY, connection.key);
+            }
+        }
+    }
+
+    private Corpus.Entry nextPayload() {
+        return corpus.get(Math.floorMod(nextPayload.getAndIncrement(), corpus.size()));
+    }
+
+    private void send(Ukcp ukcp, int opcode, byte[] header, byte[] payload, BasePacket.EncryptType encryptType, byte[] key) {
+        byte[] data = Wire.build(opcode, header, payload);
+        Wire.encrypt(data, encryptType, key);
+        if (Wire.write(ukcp, data))
+            sent.incrementAndGet();
+    }
+
+    private void report() {
+        ProtoShift.getLogger().info(connections.size() + " connections, " + received.getAndSet(0) + " packets/s in, " + sent.getAndSet(0) + " packets/s out");
+    }
+
+    public static void main(String[] args) throws Exception {
+        new StandInGateServer(new Arguments(args));
+    }
+}
@@ -0,0 +1,137 @@
+package emu.protoshift.loadtest;
+
+import com.google.protobuf.Descriptors;
+import com.google.protobuf.Message;
+
+import emu.protoshift.config.Configuration;
+
+import emu.protoshift.net.packet.BasePacket;
+import emu.protoshift.net.packet.PacketOpcodes;
+import emu.protoshift.utils.Crypto;
+
+import io.netty.buffer.Unpooled;
+
+import kcp.highway.ChannelConfig;
+import kcp.highway.Ukcp;
+
+import java.nio.ByteBuffer;
+import java.util.ArrayList;
+import java.util.List;
+
+/*
+ * The proxy's framing and XOR, and the few messages the load test builds itself. Messages and
+ * opcodes are looked up by name, so the kit works with whatever the generators produced.
+ */
+final class Wire {
+    record Frame(int opcode, byte[] header, byte[] payload) {
+    }
+
+    // The proxy's own KCP settings, see GameServer and GameSession
+    static ChannelConfig channelConfig() {
+        ChannelConfig channelConfig = new ChannelConfig();
+        channelConfig.nodelay(true, Configuration.GAME.kcpInterval, 2, true);
+        channelConfig.setMtu(1400);
+        channelConfig.setSndwnd(256);
+        channelConfig.setRcvwnd(256);
+        channelConfig.setTimeoutMillis(30 * 1000);//30s
+        channelConfig.setUseConvChannel(true);
+        channelConfig.setAckNoDelay(false);
+        return channelConfig;
+    }
+
+    static byte[] build(int opcode, byte[] header, byte[] payload) {
+        var packet = new BasePacket(header, new PacketOpcodes(opcode, 1), BasePacket.EncryptType.NONE);
+        packet.setData(payload);
+        return packet.build();
+    }
+
+    static boolean write(Ukcp ukcp, byte[] data) {
+        var buf = Unpooled.wrappedBuffer(data);
+        try {
+            return ukcp.write(buf);
+        } finally {
+            buf.release();
+        }
+    }
+
+    static void encrypt(byte[] data, BasePacket.EncryptType encryptType, byte[] key) {
+        switch (encryptType) {
+            case NONE -> {}
+            case DISPATCH_KEY -> Crypto.xor(data, Crypto.DISPATCH_KEY);
+            case ENCRYPT_KEY -> Crypto.xor(data, key);
+        }
+    }
+
+    // Detects and undoes the XOR as PacketHandler.handlePacket does, null while the key is unknown
+    static BasePacket.EncryptType decrypt(byte[] data, byte[] key) {
+        if (data.length < 2)
+            return null;
+        if (data[0] == 0x45 && data[1] == 0x67)
+            return BasePacket.EncryptType.NONE;
+        if (data[0] == (byte) (0x45 ^ Crypto.DISPATCH_KEY[0]) && data[1] == (byte) (0x67 ^ Crypto.DISPATCH_KEY[1])) {
+            Crypto.xor(data, Crypto.DISPATCH_KEY);
+            return BasePacket.EncryptType.DISPATCH_KEY;
+        }
+        if (key == null)
+            return null;
+        Crypto.xor(data, key);
+        return BasePacket.EncryptType.ENCRYPT_KEY;
+    }
+
+    static List<Frame> split(byte[] data) {
+        var frames = new ArrayList<Frame>(1);
+        var buffer = ByteBuffer.wrap(data);
+        while (buffer.remaining() >= 12) {
+            if ((buffer.getShort() & 0xffff) != 0x4567)
+                break;
+            int opcode = buffer.getShort() & 0xffff;
+            int headerLength = buffer.getShort() & 0xffff;
+            int payloadLength = buffer.getInt();
+            if (payloadLength < 0 || buffer.remaining() < headerLength + payloadLength + 2)
+                break;
+            var header = new byte[headerLength];
+            var payload = new byte[payloadLength];
+            buffer.get(header).get(payload);
+            if ((buffer.getShort() & 0xffff) != 0x89ab)
+                break;
+            frames.add(new Frame(opcode, header, payload));
+        }
+        return frames;
+    }
+
+    static int opcode(String name, boolean isNew) {
+        try {
+            return Class.forName("emu.protoshift.net.packet.PacketOpcodes$" + (isNew ? "newOpcodes" : "oldOpcodes"))
+                    .getField(name).getInt(null);
+        } catch (ReflectiveOperationException e) {
+            throw new IllegalStateException("No opcode " + name + ", generate the translators in translation mode first", e);
+        }
+    }
+
+    static Message.Builder builder(String name, boolean isNew) {
+        try {
+            return (Message.Builder) Class.forName("emu.protoshift.net." + (isNew ? "newproto" : "oldproto") + "." + name + "OuterClass$" + name)
+                    .getMethod("newBuilder").invoke(null);
+        } catch (ReflectiveOperationException e) {
+            throw new IllegalStateException("No message " + name + ", generate the translators in translation mode first", e);
+        }
+    }
+
+    // Sets a field if this version has it, numbers are converted to the field's type
+    static void set(Message.Builder builder, String name, Object value) {
+        var field = builder.getDescriptorForType().findFieldByName(name);
+        if (field == null)
+            return;
+        builder.setField(field, switch (field.getJavaType()) {
+            case INT -> ((Number) value).intValue();
+            case LONG -> ((Number) value).longValue();
+            case STRING -> String.valueOf(value);
+            default -> value;
+        });
+    }
+
+    static long getLong(Message message, String name) {
+        Descriptors.FieldDescriptor field = message.getDescriptorForType().findFieldByName(name);
+        return field == null ? 0 : ((Number) message.getField(field)).longValue();
+    }
+}
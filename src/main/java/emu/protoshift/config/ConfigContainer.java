@@ -11,6 +11,11 @@ public class ConfigContainer {
         public DebugMode debugMode = DebugMode.NONE;
         public Game game = new Game();
         public Console console = new Console();
+        public Profile profile = new Profile();
+        public Capture capture = new Capture();
+        public Shadow shadow = new Shadow();
+        public TranslationCache translationCache = new TranslationCache();
+        public SchemaDiff schemaDiff = new SchemaDiff();
     }
 
     public static class Remote {
@@ -41,6 +46,47 @@ public class ConfigContainer {
         public String consoleWelcomeText = "Welcome to connect ProtoShift Alpha!";
     }
 
+    public static class Profile {
+        public boolean enabled = false;
+        public String path = "./opcode_profile.json";
+        public int exportInterval = 300;
+    }
+
+    public static class Capture {
+        public boolean enabled = false;
+        public String path = "./captures";
+        public String filterPath = "./capture_filter.json";
+        public int bufferSize = 8; // MiB, a power of two
+        public int fileSize = 256; // MiB
+        public int maxFiles = 16;
+    }
+
+    public static class Shadow {
+        public boolean enabled = false;
+        public double sampleRate = 0.01;
+        public int threads = 1;
+        public int queueSize = 1024;
+        public int samplesPerOpcode = 4;
+        public String path = "./shadow_report.json";
+        public int exportInterval = 300;
+    }
+
+    public static class TranslationCache {
+        public boolean enabled = false;
+        public int size = 64; // MiB
+        public int maxPayloadSize = 4096;
+        public String[] opcodes = {}; // Trusted to only depend on the payload
+        public boolean autoDetect = true;
+        public int verifyHits = 8;
+        public int reportInterval = 60;
+    }
+
+    public static class SchemaDiff {
+        public boolean enabled = false;
+        public String path = "./schema_diff.bin";
+        public int reloadInterval = 5;
+    }
+
     public static class GateServer {
         public String ip = "127.0.0.1";
         public int port = 20041;
@@ -49,5 +95,8 @@ public class ConfigContainer {
     public static class MuipServer {
         public String address = "http://127.0.0.1:20011/api";
         public String region = "dev_gio";
+        public int connectTimeout = 3; // seconds
+        public int requestTimeout = 10; // seconds
+        public int maxConcurrentRequests = 8;
     }
 }
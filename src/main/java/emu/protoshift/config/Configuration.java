@@ -15,6 +15,16 @@ public final class Configuration extends ConfigContainer {
 
     public static final Console CONSOLE = config.server.console;
 
+    public static final Profile PROFILE = config.server.profile;
+
+    public static final Capture CAPTURE = config.server.capture;
+
+    public static final Shadow SHADOW = config.server.shadow;
+
+    public static final TranslationCache TRANSLATION_CACHE = config.server.translationCache;
+
+    public static final SchemaDiff SCHEMA_DIFF = config.server.schemaDiff;
+
     public static final GateServer GATE_SERVER = config.remote.gateserver;
 
     public static final MuipServer MUIP_SERVER = config.remote.muipserver;
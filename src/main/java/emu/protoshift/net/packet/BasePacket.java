@@ -13,6 +13,7 @@ public class BasePacket {
 
     @Getter
     private final PacketOpcodes opcode;
+    @Getter
     private byte[] header;
     @Getter
     private byte[] data;
@@ -0,0 +1,78 @@
+package emu.protoshift.net.packet;
+
+import com.google.protobuf.InvalidProtocolBufferException;
+import com.google.protobuf.Message;
+import com.google.protobuf.util.JsonFormat;
+
+import emu.protoshift.server.game.GameSession;
+
+import java.util.Map;
+import java.util.Optional;
+import java.util.concurrent.ConcurrentHashMap;
+
+/*
+ * Translates any message both versions know by reflection and a JSON round trip.
+ * Serves the opcodes left without a generated translator, e.g. trimmed away by a traffic profile.
+ */
+public final class GenericTranslator extends PacketHandler {
+    private static final Map<Integer, Optional<GenericTranslator>> newTranslators = new ConcurrentHashMap<>();
+    private static final Map<Integer, Optional<GenericTranslator>> oldTranslators = new ConcurrentHashMap<>();
+
+    private final PacketOpcodes opcode;
+    private final Message source;
+    private final Message destination;
+
+    private GenericTranslator(PacketOpcodes opcode, Message source, Message destination) {
+        this.opcode = opcode;
+        this.source = source;
+        this.destination = destination;
+    }
+
+    public static GenericTranslator get(PacketOpcodes opcode) {
+        var translators = opcode.type == 1 ? newTranslators : oldTranslators;
+        return translators.computeIfAbsent(opcode.value, value -> Optional.ofNullable(create(opcode))).orElse(null);
+    }
+
+    private static GenericTranslator create(PacketOpcodes opcode) {
+        var name = PacketOpcodesUtil.getOpcodeName(opcode);
+        if (name.equals("UNKNOWN"))
+            return null;
+
+        boolean isRecv = opcode.type == 1;
+        try {
+            // Looked up by name, the opcode classes only exist in translation mode
+            int value = Class.forName("emu.protoshift.net.packet.PacketOpcodes$" + (isRecv ? "oldOpcodes" : "newOpcodes"))
+                    .getField(name).getInt(null);
+            return new GenericTranslator(new PacketOpcodes(value, isRecv ? 2 : 1),
+                    getDefaultInstance(isRecv ? "newproto" : "oldproto", name),
+                    getDefaultInstance(isRecv ? "oldproto" : "newproto", name));
+        } catch (ReflectiveOperationException | ClassCastException e) {
+            return null;
+        }
+    }
+
+    private static Message getDefaultInstance(String proto, String name) throws ReflectiveOperationException {
+        return (Message) Class.forName("emu.protoshift.net." + proto + "." + name + "OuterClass$" + name)
+                .getMethod("getDefaultInstance").invoke(null);
+    }
+
+    private BasePacket translate(byte[] header, BasePacket.EncryptType encryptType, byte[] payload) throws InvalidProtocolBufferException {
+        // Enums go by name, their numbers may differ between versions
+        var builder = destination.newBuilderForType();
+        JsonFormat.parser().ignoringUnknownFields().merge(
+                JsonFormat.printer().print(source.getParserForType().parseFrom(payload)), builder);
+        var packet = new BasePacket(header, opcode, encryptType);
+        packet.setData(builder.build().toByteArray());
+        return packet;
+    }
+
+    @Override
+    public BasePacket handle(byte[] payload) throws Exception {
+        return translate(new byte[0], BasePacket.EncryptType.NONE, payload);
+    }
+
+    @Override
+    public void handle(GameSession session, byte[] header, byte[] payload, BasePacket.EncryptType encryptType) throws Exception {
+        session.send(translate(header, encryptType, payload));
+    }
+}
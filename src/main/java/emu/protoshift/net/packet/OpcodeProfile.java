@@ -0,0 +1,61 @@
+package emu.protoshift.net.packet;
+
+import emu.protoshift.ProtoShift;
+import emu.protoshift.config.Configuration;
+import emu.protoshift.utils.JsonUtils;
+
+import java.io.FileWriter;
+import java.util.Map;
+import java.util.TreeMap;
+import java.util.concurrent.Executors;
+import java.util.concurrent.TimeUnit;
+import java.util.concurrent.atomic.AtomicLongArray;
+
+/*
+ * Counts packets per opcode and direction, exported as
+ * {"recv": {"Name": count}, "send": {"Name": count}} for the generators' --profile option.
+ */
+public final class OpcodeProfile {
+    private static final AtomicLongArray recv = new AtomicLongArray(0x10000);
+    private static final AtomicLongArray send = new AtomicLongArray(0x10000);
+
+    public static void init() {
+        if (!Configuration.PROFILE.enabled)
+            return;
+
+        var executor = Executors.newSingleThreadScheduledExecutor(runnable -> {
+            var thread = new Thread(runnable, "OpcodeProfile");
+            thread.setDaemon(true);
+            return thread;
+        });
+        int interval = Math.max(Configuration.PROFILE.exportInterval, 1);
+        executor.scheduleAtFixedRate(OpcodeProfile::export, interval, interval, TimeUnit.SECONDS);
+        ProtoShift.getLogger().info("Opcode profile enabled, exporting to " + Configuration.PROFILE.path);
+    }
+
+    public static void record(PacketOpcodes opcode) {
+        (opcode.type == 1 ? recv : send).incrementAndGet(opcode.value & 0xffff);
+    }
+
+    private static Map<String, Long> collect(AtomicLongArray counts, int type) {
+        var result = new TreeMap<String, Long>();
+        for (int i = 0; i < counts.length(); i++) {
+            long count = counts.get(i);
+            if (count > 0)
+                result.merge(PacketOpcodesUtil.getOpcodeName(new PacketOpcodes(i, type)), count, Long::sum);
+        }
+        return result;
+    }
+
+    public static synchronized void export() {
+        if (!Configuration.PROFILE.enabled)
+            return;
+
+        var profile = Map.of("recv", collect(recv, 1), "send", collect(send, 2));
+        try (var file = new FileWriter(Configuration.PROFILE.path)) {
+            file.write(JsonUtils.encode(profile));
+        } catch (Exception e) {
+            ProtoShift.getLogger().error("Unable to export opcode profile.", e);
+        }
+    }
+}
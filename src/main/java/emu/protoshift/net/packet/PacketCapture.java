@@ -0,0 +1,361 @@
+package emu.protoshift.net.packet;
+
+import emu.protoshift.ProtoShift;
+import emu.protoshift.config.Configuration;
+import emu.protoshift.server.game.GameSession;
+import emu.protoshift.utils.JsonUtils;
+import emu.protoshift.utils.RecordRingBuffer;
+
+import java.io.IOException;
+import java.io.InputStreamReader;
+import java.nio.ByteBuffer;
+import java.nio.ByteOrder;
+import java.nio.MappedByteBuffer;
+import java.nio.channels.FileChannel;
+import java.nio.charset.StandardCharsets;
+import java.nio.file.Files;
+import java.nio.file.Path;
+import java.nio.file.StandardOpenOption;
+import java.nio.file.attribute.FileTime;
+import java.text.SimpleDateFormat;
+import java.time.Instant;
+import java.util.ArrayDeque;
+import java.util.Arrays;
+import java.util.BitSet;
+import java.util.Date;
+import java.util.List;
+import java.util.concurrent.locks.LockSupport;
+
+/*
+ * Writes the packets of chosen uids and opcodes to capture files, in the format tools/capture reads.
+ *
+ * A PACKET record holds the payload as it arrived and as it was forwarded after translation:
+ * u32 uid, u16 opcode, u16 forwarded opcode, u16 header length, u32 payload length,
+ * u32 forwarded payload length, then the header and both payloads. Packets the proxy sends on its
+ * own have no payload as it arrived and opcode 0. Network threads only copy into a ring buffer,
+ * a background thread moves the records into memory-mapped files, rotated at capture.fileSize.
+ *
+ * What is captured can change at runtime, through captureUid and captureOpcode or by editing
+ * capture.filterPath, {"uids": [10001], "opcodes": ["GetPlayerTokenReq", 112]}, which is
+ * re-read when it changes. Opcode names match either version, numbers match both.
+ */
+public final class PacketCapture {
+    private static final byte[] MAGIC = "PSCAPTUR".getBytes(StandardCharsets.US_ASCII);
+    private static final int FORMAT = 1;
+    private static final int FILE_HEADER_SIZE = 12;
+    private static final byte PACKET = 2;
+    // Record header after the u32 size: kind, direction, version, reserved, u64 timestamp, u64 session
+    private static final int RECORD_HEADER_SIZE = 20;
+    private static final int PACKET_HEADER_SIZE = 18;
+
+    private static RecordRingBuffer ring;
+    private static volatile Filter filter = new Filter(new int[0], new BitSet(), new BitSet());
+    private static final ThreadLocal<Pending> pending = ThreadLocal.withInitial(Pending::new);
+
+    // Flusher state
+    private static Thread flusher;
+    private static volatile boolean running;
+    private static final ArrayDeque<Path> files = new ArrayDeque<>();
+    private static FileChannel channel;
+    private static MappedByteBuffer file;
+    private static int fileNumber;
+    private static FileTime filterModified;
+    private static long nextFilterCheck;
+    private static long lastDropped;
+
+    private record Filter(int[] uids, BitSet newOpcodes, BitSet oldOpcodes) {
+        boolean matches(int uid, int opcode, int type) {
+            return (type == 1 ? newOpcodes : oldOpcodes).get(opcode & 0xffff) || Arrays.binarySearch(uids, uid) >= 0;
+        }
+
+        boolean isEmpty() {
+            return uids.length == 0 && newOpcodes.isEmpty() && oldOpcodes.isEmpty();
+        }
+    }
+
+    private static class FilterFile {
+        List<Integer> uids;
+        List<Object> opcodes;
+    }
+
+    // The packet being handled on this thread, until its translation is sent
+    private static class Pending {
+        GameSession session;
+        int opcode;
+        int type;
+        byte[] header;
+        byte[] payload;
+        BasePacket forwarded;
+        boolean matched;
+    }
+
+    public static void init() {
+        if (!Configuration.CAPTURE.enabled)
+            return;
+
+        try {
+            Files.createDirectories(Path.of(Configuration.CAPTURE.path));
+        } catch (IOException e) {
+            ProtoShift.getLogger().error("Unable to create the capture directory, capture disabled.", e);
+            return;
+        }
+        ring = new RecordRingBuffer(Configuration.CAPTURE.bufferSize << 20);
+        loadFilter();
+
+        running = true;
+        flusher = new Thread(PacketCapture::flush, "PacketCapture");
+        flusher.setDaemon(true);
+        flusher.start();
+        Runtime.getRuntime().addShutdownHook(new Thread(() -> {
+            running = false;
+            LockSupport.unpark(flusher);
+            try {
+                flusher.join(5000);
+            } catch (InterruptedException ignored) {
+            }
+        }));
+        ProtoShift.getLogger().info("Packet capture enabled, writing to " + Configuration.CAPTURE.path);
+    }
+
+    public static synchronized void captureUid(int uid, boolean enabled) {
+        var current = filter;
+        int[] uids = Arrays.stream(current.uids).filter(i -> i != uid).toArray();
+        if (enabled) {
+            uids = Arrays.copyOf(uids, uids.length + 1);
+            uids[uids.length - 1] = uid;
+            Arrays.sort(uids);
+        }
+        filter = new Filter(uids, current.newOpcodes, current.oldOpcodes);
+    }
+
+    public static synchronized void captureOpcode(PacketOpcodes opcode, boolean enabled) {
+        var current = filter;
+        var newOpcodes = (BitSet) current.newOpcodes.clone();
+        var oldOpcodes = (BitSet) current.oldOpcodes.clone();
+        (opcode.type == 1 ? newOpcodes : oldOpcodes).set(opcode.value & 0xffff, enabled);
+        filter = new Filter(current.uids, newOpcodes, oldOpcodes);
+    }
+
+    /*
+     * Called by PacketHandler.handle before translating. Every packet is noted, the filter may match
+     * its translation only, and end writes it along with the translation if one was sent in between.
+     */
+    public static void begin(GameSession session, PacketOpcodes opcode, byte[] header, byte[] payload) {
+        if (ring == null)
+            return;
+
+        var current = pending.get();
+        current.session = session;
+        current.opcode = opcode.value;
+        current.type = opcode.type;
+        current.header = header;
+        current.payload = payload;
+        current.forwarded = null;
+        current.matched = filter.matches(session.getUid(), opcode.value, opcode.type);
+    }
+
+    // Called by GameSession.send for every packet
+    public static void sent(GameSession session, BasePacket packet) {
+        if (ring == null)
+            return;
+
+        var current = pending.get();
+        if (current.session == session && current.forwarded == null && packet.getOpcode().type != current.type) {
+            current.forwarded = packet;
+            return;
+        }
+        // Sent by the proxy itself
+        var opcode = packet.getOpcode();
+        if (filter.matches(session.getUid(), opcode.value, opcode.type))
+            write(session, 3 - opcode.type, 0, packet.getHeader(), null, packet);
+    }
+
+    public static void end() {
+        if (ring == null)
+            return;
+
+        var current = pending.get();
+        if (current.session == null)
+            return;
+        var forwarded = current.forwarded == null ? null : current.forwarded.getOpcode();
+        if (current.matched || forwarded != null && filter.matches(current.session.getUid(), forwarded.value, forwarded.type))
+            write(current.session, current.type, current.opcode, current.header, current.payload, current.forwarded);
+        current.session = null;
+        current.header = null;
+        current.payload = null;
+        current.forwarded = null;
+    }
+
+    private static void write(GameSession session, int type, int opcode, byte[] header, byte[] payload, BasePacket forwarded) {
+        if (header == null)
+            header = new byte[0];
+        byte[] forwardedPayload = forwarded == null || forwarded.getData() == null ? new byte[0] : forwarded.getData();
+        int payloadLength = payload == null ? 0 : payload.length;
+
+        int size = RECORD_HEADER_SIZE + PACKET_HEADER_SIZE + header.length + payloadLength + forwardedPayload.length;
+        int offset = ring.claim(size);
+        if (offset < 0)
+            return;
+
+        var now = Instant.now();
+        var buffer = ring.buffer();
+        int position = offset + 4;
+        // Packets arriving from the client are in the new version, the direction and version match
+        buffer.put(position, PACKET);
+        buffer.put(position + 1, (byte) type);
+        buffer.put(position + 2, (byte) type);
+        buffer.put(position + 3, (byte) 0);
+        buffer.putLong(position + 4, now.getEpochSecond() * 1_000_000 + now.getNano() / 1000);
+        buffer.putLong(position + 12, session.getId());
+        position += RECORD_HEADER_SIZE;
+
+        buffer.putInt(position, session.getUid());
+        buffer.putShort(position + 4, (short) opcode);
+        buffer.putShort(position + 6, (short) (forwarded == null ? 0 : forwarded.getOpcode().value));
+        buffer.putShort(position + 8, (short) header.length);
+        buffer.putInt(position + 10, payloadLength);
+        buffer.putInt(position + 14, forwardedPayload.length);
+        position += PACKET_HEADER_SIZE;
+
+        buffer.put(position, header);
+        position += header.length;
+        if (payload != null)
+            buffer.put(position, payload);
+        position += payloadLength;
+        buffer.put(position, forwardedPayload);
+
+        ring.commit(offset, size);
+    }
+
+    /*
+     * Flusher thread
+     */
+
+    private static void flush() {
+        try {
+            while (running) {
+                if (ring.drain(PacketCapture::store) == 0) {
+                    if (System.currentTimeMillis() >= nextFilterCheck) {
+                        nextFilterCheck = System.currentTimeMillis() + 1000;
+                        loadFilter();
+                        reportDropped();
+                    }
+                    LockSupport.parkNanos(1_000_000);
+                }
+            }
+            ring.drain(PacketCapture::store);
+        } catch (Exception e) {
+            // Writers keep claiming, nothing matches any more
+            ProtoShift.getLogger().error("Packet capture stopped.", e);
+            synchronized (PacketCapture.class) {
+                filter = new Filter(new int[0], new BitSet(), new BitSet());
+            }
+        } finally {
+            closeFile();
+        }
+    }
+
+    private static void store(ByteBuffer buffer, int offset, int length) {
+        int fileSize = Configuration.CAPTURE.fileSize << 20;
+        if (length > fileSize - FILE_HEADER_SIZE)
+            return;
+        if (file == null || file.remaining() < length)
+            rotate(fileSize);
+        file.put(file.position(), buffer, offset, length);
+        file.position(file.position() + length);
+    }
+
+    private static void rotate(int fileSize) {
+        closeFile();
+        var path = Path.of(Configuration.CAPTURE.path,
+                "capture-" + new SimpleDateFormat("yyyyMMdd-HHmmss").format(new Date()) + "-" + fileNumber++ + ".cap");
+        try {
+            channel = FileChannel.open(path, StandardOpenOption.CREATE_NEW, StandardOpenOption.READ, StandardOpenOption.WRITE);
+            file = channel.map(FileChannel.MapMode.READ_WRITE, 0, fileSize);
+        } catch (IOException e) {
+            throw new IllegalStateException("Unable to create capture file " + path, e);
+        }
+        file.order(ByteOrder.LITTLE_ENDIAN);
+        file.put(MAGIC).putInt(FORMAT);
+
+        files.add(path);
+        while (Configuration.CAPTURE.maxFiles > 0 && files.size() > Configuration.CAPTURE.maxFiles) {
+            try {
+                Files.deleteIfExists(files.poll());
+            } catch (IOException e) {
+                ProtoShift.getLogger().warn("Unable to delete old capture file.", e);
+            }
+        }
+    }
+
+    private static void closeFile() {
+        if (file == null)
+            return;
+        try {
+            file.force();
+            // Trimming a mapped file fails on some systems, readers stop at the zeroed tail then
+            channel.truncate(file.position());
+        } catch (IOException ignored) {
+        }
+        try {
+            channel.close();
+        } catch (IOException ignored) {
+        }
+        file = null;
+        channel = null;
+    }
+
+    private static void loadFilter() {
+        var path = Path.of(Configuration.CAPTURE.filterPath);
+        try {
+            if (!Files.exists(path))
+                return;
+            var modified = Files.getLastModifiedTime(path);
+            if (modified.equals(filterModified))
+                return;
+            filterModified = modified;
+
+            FilterFile loaded;
+            try (var reader = new InputStreamReader(Files.newInputStream(path), StandardCharsets.UTF_8)) {
+                loaded = JsonUtils.loadToClass(reader, FilterFile.class);
+            }
+            int[] uids = loaded == null || loaded.uids == null ? new int[0]
+                    : loaded.uids.stream().mapToInt(Integer::intValue).sorted().toArray();
+            var newOpcodes = new BitSet();
+            var oldOpcodes = new BitSet();
+            if (loaded != null && loaded.opcodes != null) {
+                for (var opcode : loaded.opcodes) {
+                    if (opcode instanceof Number number) {
+                        newOpcodes.set(number.intValue() & 0xffff);
+                        oldOpcodes.set(number.intValue() & 0xffff);
+                    } else {
+                        int newValue = PacketOpcodesUtil.getOpcodeValue(opcode.toString(), 1);
+                        int oldValue = PacketOpcodesUtil.getOpcodeValue(opcode.toString(), 2);
+                        if (newValue > 0)
+                            newOpcodes.set(newValue);
+                        if (oldValue > 0)
+                            oldOpcodes.set(oldValue);
+                        if (newValue <= 0 && oldValue <= 0)
+                            ProtoShift.getLogger().warn("Unknown opcode in capture filter: " + opcode);
+                    }
+                }
+            }
+            synchronized (PacketCapture.class) {
+                filter = new Filter(uids, newOpcodes, oldOpcodes);
+            }
+            ProtoShift.getLogger().info("Capture filter loaded: " + uids.length + " uids, "
+                    + (newOpcodes.cardinality() + oldOpcodes.cardinality()) + " opcodes"
+                    + (filter.isEmpty() ? ", nothing is captured" : ""));
+        } catch (Exception e) {
+            ProtoShift.getLogger().error("Unable to load the capture filter.", e);
+        }
+    }
+
+    private static void reportDropped() {
+        long dropped = ring.getDropped();
+        if (dropped != lastDropped) {
+            ProtoShift.getLogger().warn("Packet capture buffer full, " + (dropped - lastDropped) + " packets dropped");
+            lastDropped = dropped;
+        }
+    }
+}
@@ -39,4 +39,12 @@ public class PacketOpcodesUtil {
         if (opcode.value <= 0) return "UNKNOWN";
         return opcode.type == 1 ? newopcodeMap.getOrDefault(opcode.value, "UNKNOWN") : oldopcodeMap.getOrDefault(opcode.value, "UNKNOWN");
     }
+
+    public static int getOpcodeValue(String name, int type) {
+        for (var entry : (type == 1 ? newopcodeMap : oldopcodeMap).entrySet()) {
+            if (entry.getValue().equals(name))
+                return entry.getKey();
+        }
+        return 0;
+    }
 }
@@ -0,0 +1,202 @@
+package emu.protoshift.net.packet;
+
+import emu.protoshift.ProtoShift;
+import emu.protoshift.config.Configuration;
+
+import java.io.IOException;
+import java.nio.BufferUnderflowException;
+import java.nio.ByteBuffer;
+import java.nio.ByteOrder;
+import java.nio.charset.StandardCharsets;
+import java.nio.file.Files;
+import java.nio.file.Path;
+import java.util.Arrays;
+import java.util.concurrent.Executors;
+import java.util.concurrent.TimeUnit;
+
+/*
+ * The translation between two versions compiled by tools/schema_diff/schema_diff.py: opcode
+ * pairs, field number remaps, enum remaps, identical types and dropped fields. Its
+ * SchemaDiffTranslators serve the opcodes it covers ahead of the generated translators. The
+ * file is watched and swapped in while running, packets in flight finish with the table they
+ * started with.
+ */
+public final class SchemaDiff {
+    private static final String MAGIC = "PSSCHDIF";
+    private static final int FORMAT = 1;
+
+    static final int COPY = 0;
+    static final int ENUM = 1;
+    static final int MESSAGE = 2;
+    static final int MAP = 3;
+
+    // Plans up to this field number look fields up by index
+    private static final int DENSE_LIMIT = 1024;
+
+    private static volatile SchemaDiff current;
+    private static long modified;
+
+    final int[][] enumFrom;
+    final int[][] enumTo;
+    final Plan[] plans;
+    private final SchemaDiffTranslator[] newTranslators = new SchemaDiffTranslator[0x10000];
+    private final SchemaDiffTranslator[] oldTranslators = new SchemaDiffTranslator[0x10000];
+
+    // Tags of the target field by wire type
+    record Field(byte[][] tags, int action, int argument) {
+    }
+
+    static final class Plan {
+        final boolean identity;
+        private final Field[] dense;
+        private final int[] numbers;
+        private final Field[] fields;
+
+        Plan(boolean identity, int[] numbers, Field[] fields) {
+            this.identity = identity;
+            int max = numbers.length == 0 ? 0 : numbers[numbers.length - 1];
+            if (max < DENSE_LIMIT) {
+                dense = new Field[max + 1];
+                for (int i = 0; i < numbers.length; i++)
+                    dense[numbers[i]] = fields[i];
+                this.numbers = null;
+                this.fields = null;
+            } else {
+                dense = null;
+                this.numbers = numbers;
+                this.fields = fields;
+            }
+        }
+
+        Field find(int number) {
+            if (dense != null)
+                return number < dense.length ? dense[number] : null;
+            int index = Arrays.binarySearch(numbers, number);
+            return index >= 0 ? fields[index] : null;
+        }
+    }
+
+    private SchemaDiff(ByteBuffer buffer) throws IOException {
+        var magic = new byte[MAGIC.length()];
+        buffer.get(magic);
+        if (!new String(magic, StandardCharsets.US_ASCII).equals(MAGIC))
+            throw new IOException("Not a schema diff");
+        int format = buffer.getInt();
+        if (format != FORMAT)
+            throw new IOException("Schema diff format " + format + ", expected " + FORMAT);
+
+        enumFrom = new int[buffer.getInt()][];
+        enumTo = new int[enumFrom.length][];
+        for (int i = 0; i < enumFrom.length; i++) {
+            enumFrom[i] = new int[buffer.getInt()];
+            enumTo[i] = new int[enumFrom[i].length];
+            for (int j = 0; j < enumFrom[i].length; j++) {
+                enumFrom[i][j] = buffer.getInt();
+                enumTo[i][j] = buffer.getInt();
+            }
+        }
+
+        plans = new Plan[buffer.getInt()];
+        for (int i = 0; i < plans.length; i++) {
+            if (buffer.get() != 0) {
+                plans[i] = new Plan(true, new int[0], new Field[0]);
+                continue;
+            }
+            var numbers = new int[buffer.getInt()];
+            var fields = new Field[numbers.length];
+            for (int j = 0; j < numbers.length; j++) {
+                numbers[j] = buffer.getInt();
+                int target = buffer.getInt();
+                int action = buffer.get();
+                int argument = buffer.getInt();
+                if (action < COPY || action > MAP || action == ENUM && argument >= enumFrom.length || action >= MESSAGE && argument >= plans.length)
+                    throw new IOException("Bad field " + numbers[j] + " in plan " + i);
+                fields[j] = new Field(tags(target), action, argument);
+            }
+            plans[i] = new Plan(false, numbers, fields);
+        }
+
+        int opcodes = buffer.getInt();
+        for (int i = 0; i < opcodes; i++) {
+            int type = buffer.get();
+            int source = buffer.getShort() & 0xffff;
+            int target = buffer.getShort() & 0xffff;
+            int plan = buffer.getInt();
+            if (type < 1 || type > 2 || plan < 0 || plan >= plans.length)
+                throw new IOException("Bad opcode " + source);
+            (type == 1 ? newTranslators : oldTranslators)[source] =
+                    new SchemaDiffTranslator(this, new PacketOpcodes(target, 3 - type), plans[plan]);
+        }
+    }
+
+    private static byte[][] tags(int number) {
+        var tags = new byte[6][];
+        for (int wireType : new int[]{0, 1, 2, 5}) {
+            int tag = number << 3 | wireType;
+            var bytes = new byte[5];
+            int size = 0;
+            for (; (tag & ~0x7f) != 0; tag >>>= 7)
+                bytes[size++] = (byte) (tag & 0x7f | 0x80);
+            bytes[size++] = (byte) tag;
+            tags[wireType] = Arrays.copyOf(bytes, size);
+        }
+        return tags;
+    }
+
+    public static SchemaDiff load(Path path) throws IOException {
+        try {
+            return new SchemaDiff(ByteBuffer.wrap(Files.readAllBytes(path)).order(ByteOrder.LITTLE_ENDIAN));
+        } catch (BufferUnderflowException | NegativeArraySizeException e) {
+            throw new IOException("Truncated schema diff", e);
+        }
+    }
+
+    public static void init() {
+        if (!Configuration.SCHEMA_DIFF.enabled)
+            return;
+
+        reload();
+        var executor = Executors.newSingleThreadScheduledExecutor(runnable -> {
+            var thread = new Thread(runnable, "SchemaDiff");
+            thread.setDaemon(true);
+            return thread;
+        });
+        int interval = Math.max(Configuration.SCHEMA_DIFF.reloadInterval, 1);
+        executor.scheduleWithFixedDelay(SchemaDiff::reload, interval, interval, TimeUnit.SECONDS);
+    }
+
+    // Swaps in the file when it changed, a file that fails to load leaves the current table in place
+    public static synchronized void reload() {
+        var path = Path.of(Configuration.SCHEMA_DIFF.path);
+        try {
+            if (!Files.exists(path)) {
+                if (modified != -1)
+                    ProtoShift.getLogger().warn("Schema diff " + path + " not found, using the generated translators");
+                modified = -1;
+                return;
+            }
+            long lastModified = Files.getLastModifiedTime(path).toMillis();
+            if (lastModified == modified)
+                return;
+            modified = lastModified;
+            long start = System.nanoTime();
+            current = load(path);
+            // The previous table's packets are never served again, only their memory is left to free
+            TranslationCache.invalidate();
+            ProtoShift.getLogger().info("Schema diff " + path + " loaded in " + (System.nanoTime() - start) / 1000000 + " ms, "
+                    + current.plans.length + " plans");
+        } catch (IOException e) {
+            ProtoShift.getLogger().error("Unable to load schema diff " + path + ", keeping the previous one.", e);
+        }
+    }
+
+    public static PacketHandler get(PacketOpcodes opcode) {
+        var diff = current;
+        return diff == null ? null : diff.translator(opcode);
+    }
+
+    // The translator of this table, also for a table loaded outside the proxy, e.g. by a benchmark
+    public PacketHandler translator(PacketOpcodes opcode) {
+        return (opcode.type == 1 ? newTranslators : oldTranslators)[opcode.value & 0xffff];
+    }
+}
@@ -0,0 +1,197 @@
+package emu.protoshift.net.packet;
+
+import com.google.protobuf.InvalidProtocolBufferException;
+
+import emu.protoshift.server.game.GameSession;
+
+import java.util.Arrays;
+
+/*
+ * Translates one opcode by the plan of a SchemaDiff, on the wire bytes: fields are renumbered,
+ * enums remapped and nested messages translated by their own plan, without parsing into
+ * messages. Fields the target doesn't know are dropped, identical messages are copied whole.
+ */
+public final class SchemaDiffTranslator extends PacketHandler {
+    private static final int VARINT = 0;
+    private static final int FIXED64 = 1;
+    private static final int DELIMITED = 2;
+    private static final int FIXED32 = 5;
+
+    // Room left for the length of a nested message, shifted back once it is known
+    private static final int LENGTH_RESERVED = 5;
+    // Buffers grown beyond this aren't kept for the next packet
+    private static final int BUFFER_RETAINED = 1 << 20;
+
+    private static final ThreadLocal<Output> outputs = ThreadLocal.withInitial(Output::new);
+
+    private final SchemaDiff diff;
+    private final PacketOpcodes target;
+    private final SchemaDiff.Plan plan;
+
+    private static final class Output {
+        byte[] buffer = new byte[4096];
+        int size;
+
+        void ensure(int length) {
+            if (size + length > buffer.length)
+                buffer = Arrays.copyOf(buffer, Math.max(buffer.length << 1, size + length));
+        }
+
+        void write(byte[] bytes) {
+            ensure(bytes.length);
+            System.arraycopy(bytes, 0, buffer, size, bytes.length);
+            size += bytes.length;
+        }
+
+        void write(byte[] bytes, int offset, int length) {
+            ensure(length);
+            System.arraycopy(bytes, offset, buffer, size, length);
+            size += length;
+        }
+
+        void writeVarint(long value) {
+            ensure(10);
+            for (; (value & ~0x7fL) != 0; value >>>= 7)
+                buffer[size++] = (byte) (value & 0x7f | 0x80);
+            buffer[size++] = (byte) value;
+        }
+    }
+
+    SchemaDiffTranslator(SchemaDiff diff, PacketOpcodes target, SchemaDiff.Plan plan) {
+        this.diff = diff;
+        this.target = target;
+        this.plan = plan;
+    }
+
+    private static int varintSize(int value) {
+        int size = 1;
+        for (; (value & ~0x7f) != 0; value >>>= 7)
+            size++;
+        return size;
+    }
+
+    private static long readVarint(byte[] data, int[] position, int end) throws InvalidProtocolBufferException {
+        long value = 0;
+        for (int shift = 0; shift < 64; shift += 7) {
+            if (position[0] >= end)
+                throw new InvalidProtocolBufferException("Truncated message");
+            byte b = data[position[0]++];
+            value |= (long) (b & 0x7f) << shift;
+            if (b >= 0)
+                return value;
+        }
+        throw new InvalidProtocolBufferException("Malformed varint");
+    }
+
+    // Enum values are int32, negative ones take ten bytes on the wire
+    private void writeEnum(Output output, int table, long value) {
+        int index = Arrays.binarySearch(diff.enumFrom[table], (int) value);
+        output.writeVarint(index >= 0 ? diff.enumTo[table][index] : (int) value);
+    }
+
+    private void translate(SchemaDiff.Plan plan, byte[] data, int offset, int end, Output output) throws InvalidProtocolBufferException {
+        if (plan.identity) {
+            output.write(data, offset, end - offset);
+            return;
+        }
+
+        var position = new int[]{offset};
+        while (position[0] < end) {
+            long tag = readVarint(data, position, end);
+            int number = (int) (tag >>> 3);
+            int wireType = (int) tag & 7;
+            if (number <= 0)
+                throw new InvalidProtocolBufferException("Invalid tag " + tag);
+            int start = position[0];
+            switch (wireType) {
+                case VARINT -> readVarint(data, position, end);
+                case FIXED64 -> position[0] += 8;
+                case FIXED32 -> position[0] += 4;
+                case DELIMITED -> {
+                    long length = readVarint(data, position, end);
+                    if (length < 0 || length > end - position[0])
+                        throw new InvalidProtocolBufferException("Truncated message");
+                    start = position[0];
+                    position[0] += (int) length;
+                }
+                default -> throw new InvalidProtocolBufferException("Invalid wire type " + wireType + " of field " + number);
+            }
+            if (position[0] > end)
+                throw new InvalidProtocolBufferException("Truncated message");
+
+            var field = plan.find(number);
+            if (field == null)
+                continue;
+            if (field.action() >= SchemaDiff.MESSAGE && wireType != DELIMITED)
+                throw new InvalidProtocolBufferException("Field " + number + " is not length delimited");
+            if (field.action() == SchemaDiff.ENUM && wireType != VARINT && wireType != DELIMITED)
+                throw new InvalidProtocolBufferException("Enum field " + number + " is neither a varint nor packed");
+            output.write(field.tags()[wireType]);
+            switch (field.action()) {
+                case SchemaDiff.COPY -> {
+                    if (wireType == DELIMITED)
+                        output.writeVarint(position[0] - start);
+                    output.write(data, start, position[0] - start);
+                }
+                case SchemaDiff.ENUM -> {
+                    if (wireType == VARINT) {
+                        writeEnum(output, field.argument(), readVarint(data, new int[]{start}, position[0]));
+                        break;
+                    }
+                    // Packed
+                    int lengthAt = output.size;
+                    output.ensure(LENGTH_RESERVED);
+                    output.size += LENGTH_RESERVED;
+                    for (var packed = new int[]{start}; packed[0] < position[0]; )
+                        writeEnum(output, field.argument(), readVarint(data, packed, position[0]));
+                    closeLength(output, lengthAt);
+                }
+                default -> {
+                    int lengthAt = output.size;
+                    output.ensure(LENGTH_RESERVED);
+                    output.size += LENGTH_RESERVED;
+                    translate(diff.plans[field.argument()], data, start, position[0], output);
+                    closeLength(output, lengthAt);
+                }
+            }
+        }
+    }
+
+    // Writes the length of what follows the room reserved at position, moving it to close the gap
+    private static void closeLength(Output output, int position) {
+        int start = position + LENGTH_RESERVED;
+        int length = output.size - start;
+        int lengthSize = varintSize(length);
+        System.arraycopy(output.buffer, start, output.buffer, position + lengthSize, length);
+        output.size = position;
+        output.writeVarint(length);
+        output.size = position + lengthSize + length;
+    }
+
+    public byte[] translate(byte[] payload) throws InvalidProtocolBufferException {
+        if (plan.identity)
+            return payload;
+
+        var output = outputs.get();
+        output.size = 0;
+        translate(plan, payload, 0, payload.length, output);
+        var result = Arrays.copyOf(output.buffer, output.size);
+        if (output.buffer.length > BUFFER_RETAINED)
+            outputs.remove();
+        return result;
+    }
+
+    @Override
+    public BasePacket handle(byte[] payload) throws Exception {
+        var packet = new BasePacket(new byte[0], target, BasePacket.EncryptType.NONE);
+        packet.setData(translate(payload));
+        return packet;
+    }
+
+    @Override
+    public void handle(GameSession session, byte[] header, byte[] payload, BasePacket.EncryptType encryptType) throws Exception {
+        var packet = new BasePacket(header, target, encryptType);
+        packet.setData(translate(payload));
+        session.send(packet);
+    }
+}
@@ -0,0 +1,246 @@
+package emu.protoshift.net.packet;
+
+import com.google.protobuf.Descriptors;
+import com.google.protobuf.Message;
+
+import emu.protoshift.ProtoShift;
+import emu.protoshift.config.Configuration;
+import emu.protoshift.utils.JsonUtils;
+
+import org.reflections.Reflections;
+
+import java.io.FileWriter;
+import java.util.ArrayList;
+import java.util.Arrays;
+import java.util.Base64;
+import java.util.HashMap;
+import java.util.List;
+import java.util.Map;
+import java.util.Objects;
+import java.util.Optional;
+import java.util.TreeMap;
+import java.util.concurrent.ArrayBlockingQueue;
+import java.util.concurrent.ConcurrentHashMap;
+import java.util.concurrent.Executors;
+import java.util.concurrent.ThreadLocalRandom;
+import java.util.concurrent.ThreadPoolExecutor;
+import java.util.concurrent.TimeUnit;
+import java.util.concurrent.atomic.AtomicLong;
+
+/*
+ * Runs a sample of the packets through the typed handlers generated by
+ * "protojson2javaex.py --shadow" as well, off the packet thread, and compares their output with
+ * the handler that served the packet. Messages are compared by field, so encoding order, map
+ * order and unknown fields don't count. Exported as
+ * {"dropped": n, "recv": {"Name": {"sampled", "matched", "mismatched", "samples": [...]}}, "send": {...}}
+ */
+public final class ShadowValidator {
+    private static final Map<Integer, PacketHandler> newShadows = new HashMap<>();
+    private static final Map<Integer, PacketHandler> oldShadows = new HashMap<>();
+    private static final Map<Integer, Stats> recv = new ConcurrentHashMap<>();
+    private static final Map<Integer, Stats> send = new ConcurrentHashMap<>();
+    private static final Map<Integer, Optional<Message>> prototypes = new ConcurrentHashMap<>();
+    private static final AtomicLong dropped = new AtomicLong();
+    private static ThreadPoolExecutor executor;
+
+    private static final class Stats {
+        final AtomicLong sampled = new AtomicLong();
+        final AtomicLong matched = new AtomicLong();
+        final AtomicLong mismatched = new AtomicLong();
+        final List<Map<String, String>> samples = new ArrayList<>();
+    }
+
+    public static void init() {
+        if (!Configuration.SHADOW.enabled)
+            return;
+
+        for (var handlerClass : new Reflections("emu.protoshift.server.shadow").getSubTypesOf(PacketHandler.class)) {
+            Opcodes opcode = handlerClass.getAnnotation(Opcodes.class);
+            if (opcode == null || opcode.value() <= 0)
+                continue;
+            try {
+                (opcode.type() == 1 ? newShadows : oldShadows).put(opcode.value(), handlerClass.getDeclaredConstructor().newInstance());
+            } catch (ReflectiveOperationException e) {
+                ProtoShift.getLogger().error("Unable to create shadow handler " + handlerClass.getName(), e);
+            }
+        }
+        if (newShadows.isEmpty() && oldShadows.isEmpty()) {
+            ProtoShift.getLogger().warn("Shadow validation enabled without shadow handlers, generate them with protojson2javaex.py --shadow");
+            Configuration.SHADOW.enabled = false;
+            return;
+        }
+
+        // A full queue drops samples rather than holding up the packet thread
+        int threads = Math.max(Configuration.SHADOW.threads, 1);
+        executor = new ThreadPoolExecutor(threads, threads, 0, TimeUnit.SECONDS,
+                new ArrayBlockingQueue<>(Math.max(Configuration.SHADOW.queueSize, 1)), runnable -> {
+            var thread = new Thread(runnable, "ShadowValidator");
+            thread.setDaemon(true);
+            thread.setPriority(Thread.MIN_PRIORITY);
+            return thread;
+        }, (runnable, pool) -> dropped.incrementAndGet());
+
+        var exporter = Executors.newSingleThreadScheduledExecutor(runnable -> {
+            var thread = new Thread(runnable, "ShadowValidatorExport");
+            thread.setDaemon(true);
+            return thread;
+        });
+        int interval = Math.max(Configuration.SHADOW.exportInterval, 1);
+        exporter.scheduleAtFixedRate(ShadowValidator::export, interval, interval, TimeUnit.SECONDS);
+        ProtoShift.getLogger().info("Shadow validation of " + (newShadows.size() + oldShadows.size()) + " handlers enabled, sampling "
+                + Configuration.SHADOW.sampleRate * 100 + "% of packets, exporting to " + Configuration.SHADOW.path);
+    }
+
+    public static void sample(PacketOpcodes opcode, PacketHandler handler, byte[] payload) {
+        if (ThreadLocalRandom.current().nextDouble() >= Configuration.SHADOW.sampleRate)
+            return;
+        var shadow = (opcode.type == 1 ? newShadows : oldShadows).get(opcode.value);
+        if (shadow == null)
+            return;
+        executor.execute(() -> compare(opcode, handler, shadow, payload));
+    }
+
+    private static void compare(PacketOpcodes opcode, PacketHandler handler, PacketHandler shadow, byte[] payload) {
+        var stats = (opcode.type == 1 ? recv : send).computeIfAbsent(opcode.value, value -> new Stats());
+        stats.sampled.incrementAndGet();
+
+        BasePacket primary = null, other = null;
+        String difference;
+        try {
+            primary = handler.handle(payload);
+            other = shadow.handle(payload);
+            difference = difference(primary, other);
+        } catch (Exception e) {
+            difference = (primary == null ? "primary" : other == null ? "shadow" : "comparison") + " failed: " + e;
+        }
+        if (difference == null) {
+            stats.matched.incrementAndGet();
+            return;
+        }
+
+        if (stats.mismatched.incrementAndGet() == 1)
+            ProtoShift.getLogger().warn("Shadow handler of " + PacketOpcodesUtil.getOpcodeName(opcode) + " disagrees: " + difference);
+        synchronized (stats.samples) {
+            if (stats.samples.size() < Configuration.SHADOW.samplesPerOpcode) {
+                var sample = new TreeMap<String, String>();
+                sample.put("difference", difference);
+                sample.put("payload", Base64.getEncoder().encodeToString(payload));
+                if (primary != null)
+                    sample.put("primary", Base64.getEncoder().encodeToString(primary.getData()));
+                if (other != null)
+                    sample.put("shadow", Base64.getEncoder().encodeToString(other.getData()));
+                stats.samples.add(sample);
+            }
+        }
+    }
+
+    private static String difference(BasePacket primary, BasePacket shadow) throws Exception {
+        if (primary.getOpcode().value != shadow.getOpcode().value || primary.getOpcode().type != shadow.getOpcode().type)
+            return "opcode " + PacketOpcodesUtil.getOpcodeName(primary.getOpcode()) + " != " + PacketOpcodesUtil.getOpcodeName(shadow.getOpcode());
+        if (Arrays.equals(primary.getData(), shadow.getData()))
+            return null;
+
+        var prototype = prototypes.computeIfAbsent(primary.getOpcode().type << 16 | primary.getOpcode().value,
+                key -> Optional.ofNullable(getDefaultInstance(primary.getOpcode()))).orElse(null);
+        if (prototype == null)
+            return "payload differs, " + PacketOpcodesUtil.getOpcodeName(primary.getOpcode()) + " has no message to compare by field";
+        var parser = prototype.getParserForType();
+        return difference(parser.parseFrom(primary.getData()), parser.parseFrom(shadow.getData()), "");
+    }
+
+    private static Message getDefaultInstance(PacketOpcodes opcode) {
+        var name = PacketOpcodesUtil.getOpcodeName(opcode);
+        try {
+            return (Message) Class.forName("emu.protoshift.net." + (opcode.type == 1 ? "newproto" : "oldproto") + "." + name + "OuterClass$" + name)
+                    .getMethod("getDefaultInstance").invoke(null);
+        } catch (ReflectiveOperationException | ClassCastException e) {
+            return null;
+        }
+    }
+
+    // Path of the first field that differs, null when the known fields are equal
+    private static String difference(Message primary, Message shadow, String path) {
+        var fields = new TreeMap<Integer, Descriptors.FieldDescriptor>();
+        for (var field : primary.getAllFields().keySet())
+            fields.put(field.getNumber(), field);
+        for (var field : shadow.getAllFields().keySet())
+            fields.put(field.getNumber(), field);
+
+        for (var field : fields.values()) {
+            var fieldPath = path + field.getName();
+            if (!field.isRepeated()) {
+                if (primary.hasField(field) != shadow.hasField(field))
+                    return fieldPath + (primary.hasField(field) ? " missing in shadow" : " only in shadow");
+                var difference = difference(field, primary.getField(field), shadow.getField(field), fieldPath);
+                if (difference != null)
+                    return difference;
+            } else if (field.isMapField()) {
+                var primaryMap = entries(primary, field);
+                var shadowMap = entries(shadow, field);
+                if (!primaryMap.keySet().equals(shadowMap.keySet()))
+                    return fieldPath + " keys differ";
+                var valueField = field.getMessageType().findFieldByNumber(2);
+                for (var entry : primaryMap.entrySet()) {
+                    var difference = difference(valueField, entry.getValue(), shadowMap.get(entry.getKey()), fieldPath + "[" + entry.getKey() + "]");
+                    if (difference != null)
+                        return difference;
+                }
+            } else {
+                int count = primary.getRepeatedFieldCount(field);
+                if (count != shadow.getRepeatedFieldCount(field))
+                    return fieldPath + " has " + count + " elements, " + shadow.getRepeatedFieldCount(field) + " in shadow";
+                for (int i = 0; i < count; i++) {
+                    var difference = difference(field, primary.getRepeatedField(field, i), shadow.getRepeatedField(field, i), fieldPath + "[" + i + "]");
+                    if (difference != null)
+                        return difference;
+                }
+            }
+        }
+        return null;
+    }
+
+    private static String difference(Descriptors.FieldDescriptor field, Object primary, Object shadow, String path) {
+        if (field.getJavaType() == Descriptors.FieldDescriptor.JavaType.MESSAGE)
+            return difference((Message) primary, (Message) shadow, path + ".");
+        return Objects.equals(primary, shadow) ? null : path + ": " + primary + " != " + shadow;
+    }
+
+    private static Map<Object, Object> entries(Message message, Descriptors.FieldDescriptor field) {
+        var result = new HashMap<>();
+        var keyField = field.getMessageType().findFieldByNumber(1);
+        var valueField = field.getMessageType().findFieldByNumber(2);
+        for (int i = 0; i < message.getRepeatedFieldCount(field); i++) {
+            var entry = (Message) message.getRepeatedField(field, i);
+            result.put(entry.getField(keyField), entry.getField(valueField));
+        }
+        return result;
+    }
+
+    private static Map<String, Object> collect(Map<Integer, Stats> stats, int type) {
+        var result = new TreeMap<String, Object>();
+        for (var entry : stats.entrySet()) {
+            var value = entry.getValue();
+            var report = new TreeMap<String, Object>();
+            report.put("sampled", value.sampled.get());
+            report.put("matched", value.matched.get());
+            report.put("mismatched", value.mismatched.get());
+            synchronized (value.samples) {
+                report.put("samples", new ArrayList<>(value.samples));
+            }
+            result.put(PacketOpcodesUtil.getOpcodeName(new PacketOpcodes(entry.getKey(), type)), report);
+        }
+        return result;
+    }
+
+    public static synchronized void export() {
+        if (!Configuration.SHADOW.enabled)
+            return;
+
+        var report = Map.of("dropped", dropped.get(), "recv", collect(recv, 1), "send", collect(send, 2));
+        try (var file = new FileWriter(Configuration.SHADOW.path)) {
+            file.write(JsonUtils.encode(report));
+        } catch (Exception e) {
+            ProtoShift.getLogger().error("Unable to export shadow validation report.", e);
+        }
+    }
+}
@@ -0,0 +1,211 @@
+package emu.protoshift.net.packet;
+
+import emu.protoshift.ProtoShift;
+import emu.protoshift.config.Configuration;
+
+import java.util.Arrays;
+import java.util.BitSet;
+import java.util.Comparator;
+import java.util.LinkedHashMap;
+import java.util.concurrent.Executors;
+import java.util.concurrent.TimeUnit;
+import java.util.concurrent.atomic.AtomicIntegerArray;
+import java.util.concurrent.atomic.AtomicLong;
+import java.util.concurrent.atomic.AtomicLongArray;
+import java.util.stream.IntStream;
+
+/*
+ * Translated payloads of recent packets, for the byte-identical payloads clients and servers
+ * repeat (empty PingReq, unchanged RTT and fight prop notifies). Keyed by opcode, direction and
+ * payload, bounded by the bytes held and evicted least recently used, in segments so packet
+ * threads rarely wait on each other.
+ *
+ * Only opcodes listed in translationCache.opcodes, or with autoDetect those whose first
+ * verifyHits hits translate to exactly the cached bytes again, are served from the cache. An
+ * opcode that ever translates differently is never cached again. PacketHandler.handle bypasses
+ * the cache while a session logs in and whenever Handle.preHandle rewrote the payload.
+ *
+ * The translator is part of the key, a packet is only served to the handler that translated it.
+ * SchemaDiff swaps in new handlers with a new table and invalidate()s what the old ones left.
+ */
+public final class TranslationCache {
+    private static final int SEGMENTS = 16;
+    // Object headers, the key, the packet and the map entry
+    private static final int ENTRY_OVERHEAD = 128;
+
+    private static final Segment[] segments = new Segment[SEGMENTS];
+    private static final BitSet trusted = new BitSet(0x20000);
+    // Hits verified per opcode, -1 once it translated differently
+    private static final AtomicIntegerArray verified = new AtomicIntegerArray(0x20000);
+    private static final AtomicLongArray hits = new AtomicLongArray(0x20000);
+    private static final AtomicLongArray misses = new AtomicLongArray(0x20000);
+    // Found in the cache but translated again to verify it, they save nothing
+    private static final AtomicLongArray probations = new AtomicLongArray(0x20000);
+    private static final AtomicLong evictions = new AtomicLong();
+
+    private record Key(int opcode, PacketHandler handler, int hash, byte[] payload) {
+        @Override
+        public boolean equals(Object other) {
+            return other instanceof Key key && key.opcode == opcode && key.handler == handler && key.hash == hash
+                    && Arrays.equals(key.payload, payload);
+        }
+
+        @Override
+        public int hashCode() {
+            return hash * 31 + opcode;
+        }
+    }
+
+    private static final class Segment extends LinkedHashMap<Key, BasePacket> {
+        private final long capacity;
+        private long bytes;
+
+        Segment(long capacity) {
+            super(256, 0.75f, true);
+            this.capacity = capacity;
+        }
+
+        synchronized BasePacket find(Key key) {
+            return get(key);
+        }
+
+        synchronized void add(Key key, BasePacket packet) {
+            var previous = put(key, packet);
+            bytes += size(key, packet) - (previous == null ? 0 : size(key, previous));
+            var iterator = entrySet().iterator();
+            while (bytes > capacity && iterator.hasNext()) {
+                var eldest = iterator.next();
+                bytes -= size(eldest.getKey(), eldest.getValue());
+                iterator.remove();
+                evictions.incrementAndGet();
+            }
+        }
+
+        synchronized void removeOpcode(int opcode) {
+            var iterator = entrySet().iterator();
+            while (iterator.hasNext()) {
+                var entry = iterator.next();
+                if (entry.getKey().opcode == opcode) {
+                    bytes -= size(entry.getKey(), entry.getValue());
+                    iterator.remove();
+                }
+            }
+        }
+
+        synchronized void removeAll() {
+            clear();
+            bytes = 0;
+        }
+
+        synchronized long bytes() {
+            return bytes;
+        }
+
+        private static long size(Key key, BasePacket packet) {
+            return key.payload.length + packet.getData().length + ENTRY_OVERHEAD;
+        }
+    }
+
+    public static void init() {
+        if (!Configuration.TRANSLATION_CACHE.enabled)
+            return;
+
+        long capacity = (long) Math.max(Configuration.TRANSLATION_CACHE.size, 1) * 1024 * 1024 / SEGMENTS;
+        for (int i = 0; i < SEGMENTS; i++)
+            segments[i] = new Segment(capacity);
+        for (var name : Configuration.TRANSLATION_CACHE.opcodes) {
+            for (int type = 1; type <= 2; type++) {
+                int value = PacketOpcodesUtil.getOpcodeValue(name, type);
+                if (value > 0)
+                    trusted.set(index(new PacketOpcodes(value, type)));
+            }
+        }
+
+        var executor = Executors.newSingleThreadScheduledExecutor(runnable -> {
+            var thread = new Thread(runnable, "TranslationCache");
+            thread.setDaemon(true);
+            return thread;
+        });
+        int interval = Math.max(Configuration.TRANSLATION_CACHE.reportInterval, 1);
+        executor.scheduleAtFixedRate(TranslationCache::report, interval, interval, TimeUnit.SECONDS);
+        ProtoShift.getLogger().info("Translation cache of " + Configuration.TRANSLATION_CACHE.size + " MiB enabled, "
+                + trusted.cardinality() + " opcodes trusted" + (Configuration.TRANSLATION_CACHE.autoDetect ? ", others verified" : ""));
+    }
+
+    private static int index(PacketOpcodes opcode) {
+        return (opcode.type - 1) << 16 | (opcode.value & 0xffff);
+    }
+
+    public static boolean isCacheable(PacketOpcodes opcode, byte[] payload) {
+        int index = index(opcode);
+        return payload.length <= Configuration.TRANSLATION_CACHE.maxPayloadSize
+                && (trusted.get(index) || Configuration.TRANSLATION_CACHE.autoDetect && verified.get(index) >= 0);
+    }
+
+    // The translated packet without header or encryption, shared and never to be modified
+    public static BasePacket translate(PacketOpcodes opcode, PacketHandler handler, byte[] payload) throws Exception {
+        int index = index(opcode);
+        var key = new Key(index, handler, Arrays.hashCode(payload), payload);
+        var segment = segments[(key.hash ^ key.hash >>> 16) & (SEGMENTS - 1)];
+
+        var cached = segment.find(key);
+        if (cached == null) {
+            misses.incrementAndGet(index);
+            var packet = handler.handle(payload);
+            segment.add(key, packet);
+            return packet;
+        }
+        if (trusted.get(index) || verified.get(index) >= Configuration.TRANSLATION_CACHE.verifyHits) {
+            hits.incrementAndGet(index);
+            return cached;
+        }
+
+        // Still on probation, translate anyway and compare
+        probations.incrementAndGet(index);
+        var packet = handler.handle(payload);
+        if (packet.getOpcode().value == cached.getOpcode().value && Arrays.equals(packet.getData(), cached.getData())) {
+            verified.incrementAndGet(index);
+        } else if (verified.getAndSet(index, -1) >= 0) {
+            ProtoShift.getLogger().warn("Translation of " + PacketOpcodesUtil.getOpcodeName(opcode) + " doesn't only depend on the payload, not caching it");
+            for (var other : segments)
+                other.removeOpcode(index);
+        }
+        return packet;
+    }
+
+    // Drops every cached translation and puts the verified opcodes back on probation
+    public static void invalidate() {
+        if (!Configuration.TRANSLATION_CACHE.enabled)
+            return;
+
+        for (var segment : segments)
+            segment.removeAll();
+        for (int i = 0; i < verified.length(); i++) {
+            int count = verified.get(i);
+            if (count > 0)
+                verified.compareAndSet(i, count, 0);
+        }
+    }
+
+    private static void report() {
+        // Only hits served from the cache count, lookups on probation were translated like misses
+        long hit = 0, lookups = 0, probation = 0, bytes = 0;
+        for (int i = 0; i < hits.length(); i++) {
+            hit += hits.get(i);
+            probation += probations.get(i);
+            lookups += hits.get(i) + misses.get(i) + probations.get(i);
+        }
+        for (var segment : segments)
+            bytes += segment.bytes();
+        if (lookups == 0)
+            return;
+
+        var top = new StringBuilder();
+        IntStream.range(0, hits.length()).filter(i -> hits.get(i) > 0)
+                .boxed().sorted(Comparator.comparingLong(hits::get).reversed()).limit(5)
+                .forEach(i -> top.append(", ").append(PacketOpcodesUtil.getOpcodeName(new PacketOpcodes(i & 0xffff, (i >>> 16) + 1)))
+                        .append(' ').append(String.format("%.1f%%", 100.0 * hits.get(i) / (hits.get(i) + misses.get(i) + probations.get(i)))));
+        ProtoShift.getLogger().info(String.format("Translation cache hit rate %.1f%% (%d of %d, %d verified), %d KB held, %d evicted",
+                100.0 * hit / lookups, hit, lookups, probation, bytes / 1024, evictions.get()) + top);
+    }
+}
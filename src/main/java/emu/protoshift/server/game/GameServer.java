@@ -4,6 +4,12 @@ import emu.protoshift.ProtoShift;
 
 import emu.protoshift.config.Configuration;
 
+import emu.protoshift.net.packet.OpcodeProfile;
+import emu.protoshift.net.packet.PacketCapture;
+import emu.protoshift.net.packet.SchemaDiff;
+import emu.protoshift.net.packet.ShadowValidator;
+import emu.protoshift.net.packet.TranslationCache;
+
 import emu.protoshift.server.packet.PacketHandler;
 import kcp.highway.ChannelConfig;
 import kcp.highway.KcpServer;
@@ -34,6 +40,11 @@ public final class GameServer extends KcpServer {
 
         // Initialize packet handlers.
         PacketHandler.init();
+        OpcodeProfile.init();
+        PacketCapture.init();
+        ShadowValidator.init();
+        TranslationCache.init();
+        SchemaDiff.init();
 
         // Initialize KCP server.
         this.init(GameSessionManager.getListener(), channelConfig, address);
@@ -48,5 +59,7 @@ public final class GameServer extends KcpServer {
         for (GameSession session : GameSessionManager.getSessions().values()) {
             session.close();
         }
+        OpcodeProfile.export();
+        ShadowValidator.export();
     }
 }
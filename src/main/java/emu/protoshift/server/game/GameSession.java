@@ -3,6 +3,7 @@ package emu.protoshift.server.game;
 import emu.protoshift.ProtoShift;
 
 import emu.protoshift.net.packet.BasePacket;
+import emu.protoshift.net.packet.PacketCapture;
 import emu.protoshift.net.packet.PacketOpcodesUtil;
 
 import emu.protoshift.config.Configuration;
@@ -22,8 +23,13 @@ import lombok.Getter;
 import lombok.Setter;
 
 import java.net.InetSocketAddress;
+import java.util.concurrent.atomic.AtomicLong;
 
 public class GameSession {
+    private static final AtomicLong nextId = new AtomicLong();
+
+    @Getter
+    private final long id = nextId.incrementAndGet();
 
     @Getter
     @Setter
@@ -138,6 +144,8 @@ public class GameSession {
         ProtoShift.getLogger().info("Send packet (" + packet.getOpcode().value + ", " + packet.getOpcode().type + "): " + PacketOpcodesUtil.getOpcodeName(packet.getOpcode()));
         if (Configuration.DEBUG_MODE_INFO == Configuration.DebugMode.ALL)
             ProtoShift.getLogger().debug(Utils.bytesToHex(packet.getData()));
+        if (Configuration.CAPTURE.enabled)
+            PacketCapture.sent(this, packet);
 
         if (tunnel != null) {
             var data = packet.build();
@@ -3,34 +3,78 @@ package emu.protoshift.server.muipserver;
 import com.google.gson.JsonObject;
 import com.google.gson.JsonParser;
 
+import emu.protoshift.ProtoShift;
 import emu.protoshift.config.Configuration;
 
-import java.io.BufferedReader;
-import java.io.InputStreamReader;
-import java.net.HttpURLConnection;
-import java.net.URL;
+import java.net.URI;
 import java.net.URLEncoder;
+import java.net.http.HttpClient;
+import java.net.http.HttpRequest;
+import java.net.http.HttpResponse;
+import java.net.http.HttpTimeoutException;
 import java.nio.charset.StandardCharsets;
+import java.time.Duration;
+import java.util.concurrent.CompletableFuture;
+import java.util.concurrent.CompletionException;
+import java.util.concurrent.Executors;
+import java.util.concurrent.Semaphore;
 
+/*
+ * Runs console commands on the muipserver without blocking the caller, usually a packet thread.
+ * Connections are kept alive and reused, every request has a timeout and at most
+ * muipserver.maxConcurrentRequests run at once, commands beyond that are turned down.
+ */
 public class Console {
-    public static String exec(int uid, String cmd) {
+    private static final Semaphore permits = new Semaphore(Math.max(Configuration.MUIP_SERVER.maxConcurrentRequests, 1));
+    private static final HttpClient client = HttpClient.newBuilder()
+            .version(HttpClient.Version.HTTP_1_1)
+            .connectTimeout(Duration.ofSeconds(Math.max(Configuration.MUIP_SERVER.connectTimeout, 1)))
+            .executor(Executors.newCachedThreadPool(runnable -> {
+                var thread = new Thread(runnable, "Console");
+                thread.setDaemon(true);
+                return thread;
+            }))
+            .build();
+
+    // Completes with the text shown to the player, also when the command failed
+    public static CompletableFuture<String> exec(int uid, String cmd) {
+        if (!permits.tryAcquire())
+            return CompletableFuture.completedFuture("Too many commands in progress, please try again later");
+
+        HttpRequest request;
         try {
-            URL url = new URL(Configuration.MUIP_SERVER.address + "?cmd=1116&uid=" + uid + "&msg=" + URLEncoder.encode(cmd, StandardCharsets.UTF_8) + "&region=" + Configuration.MUIP_SERVER.region);
-            var connection = (HttpURLConnection) url.openConnection();
-
-            if (connection.getResponseCode() == 200) {
-                var in = new BufferedReader(new InputStreamReader(connection.getInputStream(), StandardCharsets.UTF_8));
-                JsonObject jsonObject = JsonParser.parseReader(in).getAsJsonObject();
-                String response = "retcode: " + jsonObject.get("retcode").getAsString() + "\n";
-                if (jsonObject.has("data"))
-                    response += "retmsg: " + jsonObject.getAsJsonObject("data").get("retmsg").getAsString();
-                else
-                    response += "msg: " + jsonObject.get("msg").getAsString();
-                return response;
-            } else return "HTTP Error, Code: " + connection.getResponseCode();
-        } catch (Exception e) {
-            e.printStackTrace();
-            return "ERROR!!Please contact the administrator!";
+            request = HttpRequest.newBuilder(URI.create(Configuration.MUIP_SERVER.address + "?cmd=1116&uid=" + uid + "&msg=" + URLEncoder.encode(cmd, StandardCharsets.UTF_8) + "&region=" + Configuration.MUIP_SERVER.region))
+                    .timeout(Duration.ofSeconds(Math.max(Configuration.MUIP_SERVER.requestTimeout, 1)))
+                    .GET()
+                    .build();
+        } catch (IllegalArgumentException e) {
+            permits.release();
+            ProtoShift.getLogger().error("Invalid muipserver address " + Configuration.MUIP_SERVER.address, e);
+            return CompletableFuture.completedFuture("ERROR!!Please contact the administrator!");
         }
+
+        return client.sendAsync(request, HttpResponse.BodyHandlers.ofString(StandardCharsets.UTF_8))
+                .thenApply(Console::format)
+                .exceptionally(e -> {
+                    var cause = e instanceof CompletionException && e.getCause() != null ? e.getCause() : e;
+                    if (cause instanceof HttpTimeoutException)
+                        return "The muipserver didn't answer in time, please try again later";
+                    ProtoShift.getLogger().error("Console command " + cmd + " failed", cause);
+                    return "ERROR!!Please contact the administrator!";
+                })
+                .whenComplete((response, e) -> permits.release());
+    }
+
+    private static String format(HttpResponse<String> httpResponse) {
+        if (httpResponse.statusCode() != 200)
+            return "HTTP Error, Code: " + httpResponse.statusCode();
+
+        JsonObject jsonObject = JsonParser.parseString(httpResponse.body()).getAsJsonObject();
+        String response = "retcode: " + jsonObject.get("retcode").getAsString() + "\n";
+        if (jsonObject.has("data"))
+            response += "retmsg: " + jsonObject.getAsJsonObject("data").get("retmsg").getAsString();
+        else
+            response += "msg: " + jsonObject.get("msg").getAsString();
+        return response;
     }
 }
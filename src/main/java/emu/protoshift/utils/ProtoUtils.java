@@ -0,0 +1,93 @@
+package emu.protoshift.utils;
+
+import com.google.protobuf.CodedInputStream;
+import com.google.protobuf.CodedOutputStream;
+import com.google.protobuf.InvalidProtocolBufferException;
+import com.google.protobuf.MessageLite;
+import com.google.protobuf.UnknownFieldSet;
+
+import java.io.IOException;
+import java.util.Arrays;
+import java.util.List;
+
+public final class ProtoUtils {
+    /*
+     * Append every occurrence of the given top-level fields of payload to data as raw bytes.
+     * Used for packed fields whose number and type are the same in both versions.
+     */
+    public static byte[] appendFields(byte[] data, byte[] payload, int... numbers) throws InvalidProtocolBufferException {
+        return appendFields(data, payload, numbers, numbers);
+    }
+
+    /*
+     * Same as above, but the field numbers[i] of payload is written as renumbers[i].
+     * Used for unchanged nested messages whose field was renumbered.
+     */
+    public static byte[] appendFields(byte[] data, byte[] payload, int[] numbers, int[] renumbers) throws InvalidProtocolBufferException {
+        int count = 0;
+        int size = data.length;
+        int[] ranges = new int[12];
+
+        try {
+            var input = CodedInputStream.newInstance(payload);
+            while (!input.isAtEnd()) {
+                int tag = input.readTag();
+                int start = input.getTotalBytesRead();
+                input.skipField(tag);
+                for (int i = 0; i < numbers.length; i++) {
+                    if (numbers[i] == tag >>> 3) {
+                        if (count == ranges.length)
+                            ranges = Arrays.copyOf(ranges, count << 1);
+                        ranges[count++] = renumbers[i] << 3 | (tag & 7);
+                        ranges[count++] = start;
+                        ranges[count++] = input.getTotalBytesRead();
+                        size += CodedOutputStream.computeUInt32SizeNoTag(ranges[count - 3]) + input.getTotalBytesRead() - start;
+                        break;
+                    }
+                }
+            }
+            if (count == 0)
+                return data;
+
+            byte[] result = Arrays.copyOf(data, size);
+            var output = CodedOutputStream.newInstance(result, data.length, size - data.length);
+            for (int i = 0; i < count; i += 3) {
+                output.writeUInt32NoTag(ranges[i]);
+                output.writeRawBytes(payload, ranges[i + 1], ranges[i + 2] - ranges[i + 1]);
+            }
+            output.checkNoSpaceLeft();
+            return result;
+        } catch (InvalidProtocolBufferException e) {
+            throw e;
+        } catch (IOException e) {
+            throw new InvalidProtocolBufferException(e);
+        }
+    }
+
+    /*
+     * Carry a message of the other version as an unknown field of the given number.
+     * Only valid when the message is encoded identically in both versions. The value is
+     * re-serialized from the parsed message, unlike appendFields nothing is copied from the
+     * payload, it only saves converting the message field by field.
+     */
+    public static UnknownFieldSet rawField(int number, boolean present, MessageLite value) {
+        if (!present)
+            return UnknownFieldSet.getDefaultInstance();
+        return UnknownFieldSet.newBuilder()
+                .addField(number, UnknownFieldSet.Field.newBuilder()
+                        .addLengthDelimited(value.toByteString())
+                        .build())
+                .build();
+    }
+
+    public static UnknownFieldSet rawFields(int number, List<? extends MessageLite> values) {
+        if (values.isEmpty())
+            return UnknownFieldSet.getDefaultInstance();
+        var field = UnknownFieldSet.Field.newBuilder();
+        for (var value : values)
+            field.addLengthDelimited(value.toByteString());
+        return UnknownFieldSet.newBuilder()
+                .addField(number, field.build())
+                .build();
+    }
+}
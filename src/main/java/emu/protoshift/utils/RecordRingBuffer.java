@@ -0,0 +1,113 @@
+package emu.protoshift.utils;
+
+import java.lang.invoke.MethodHandles;
+import java.lang.invoke.VarHandle;
+import java.nio.ByteBuffer;
+import java.nio.ByteOrder;
+import java.util.concurrent.atomic.AtomicLong;
+
+/*
+ * A ring of length-prefixed records, written by any thread and read by one.
+ *
+ * Writers claim space with a compare-and-set on the tail, fill it in and publish it by writing the
+ * u32 length last. The reader takes published records in order and zeroes them before moving the
+ * head past, so a length of zero always means "not published yet". Writers never wait: a record
+ * that doesn't fit is dropped and counted. Records start 8 byte aligned, a record that would run
+ * over the end of the ring is placed at the start and the gap marked with a negative length.
+ */
+public final class RecordRingBuffer {
+    private static final VarHandle LENGTH = MethodHandles.byteBufferViewVarHandle(int[].class, ByteOrder.LITTLE_ENDIAN);
+    private static final int ALIGNMENT = 8;
+    private static final byte[] ZEROS = new byte[4096];
+
+    public interface RecordHandler {
+        // The record is at buffer[offset, offset + length), its u32 length included
+        void onRecord(ByteBuffer buffer, int offset, int length);
+    }
+
+    private final ByteBuffer buffer;
+    private final int capacity;
+    private final AtomicLong tail = new AtomicLong();
+    private final AtomicLong dropped = new AtomicLong();
+    private volatile long head;
+
+    public RecordRingBuffer(int capacity) {
+        if (capacity < ALIGNMENT || Integer.bitCount(capacity) != 1)
+            throw new IllegalArgumentException("Ring buffer capacity must be a power of two, got " + capacity);
+        this.capacity = capacity;
+        this.buffer = ByteBuffer.allocateDirect(capacity).order(ByteOrder.LITTLE_ENDIAN);
+    }
+
+    public ByteBuffer buffer() {
+        return buffer;
+    }
+
+    public long getDropped() {
+        return dropped.get();
+    }
+
+    private static int align(int length) {
+        return (length + ALIGNMENT - 1) & -ALIGNMENT;
+    }
+
+    /*
+     * Claims room for a record of size bytes after its u32 length. Returns the offset of the length,
+     * the record goes at offset + 4, or -1 when the ring is full.
+     */
+    public int claim(int size) {
+        int span = align(4 + size);
+        if (size < 0 || span > capacity) {
+            dropped.incrementAndGet();
+            return -1;
+        }
+        long position;
+        int offset, padding;
+        do {
+            long head = this.head;
+            position = tail.get();
+            offset = (int) (position & (capacity - 1));
+            padding = capacity - offset < span ? capacity - offset : 0;
+            if (position + padding + span - head > capacity) {
+                dropped.incrementAndGet();
+                return -1;
+            }
+        } while (!tail.compareAndSet(position, position + padding + span));
+
+        if (padding > 0) {
+            LENGTH.setRelease(buffer, offset, -padding);
+            offset = 0;
+        }
+        return offset;
+    }
+
+    // Publishes a claimed record once it's written
+    public void commit(int offset, int size) {
+        LENGTH.setRelease(buffer, offset, size);
+    }
+
+    // Hands the published records to the handler in order, returns how many there were
+    public int drain(RecordHandler handler) {
+        int count = 0;
+        long head = this.head;
+        while (true) {
+            int offset = (int) (head & (capacity - 1));
+            int length = (int) LENGTH.getAcquire(buffer, offset);
+            if (length == 0)
+                break;
+
+            int span;
+            if (length < 0) {
+                span = -length;
+            } else {
+                handler.onRecord(buffer, offset, 4 + length);
+                span = align(4 + length);
+                count++;
+            }
+            for (int i = 0; i < span; i += ZEROS.length)
+                buffer.put(offset + i, ZEROS, 0, Math.min(ZEROS.length, span - i));
+            head += span;
+            this.head = head;
+        }
+        return count;
+    }
+}
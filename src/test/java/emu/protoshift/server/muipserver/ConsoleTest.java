@@ -0,0 +1,105 @@
+package emu.protoshift.server.muipserver;
+
+import com.sun.net.httpserver.HttpExchange;
+import com.sun.net.httpserver.HttpServer;
+
+import emu.protoshift.config.Configuration;
+
+import org.junit.jupiter.api.AfterAll;
+import org.junit.jupiter.api.BeforeAll;
+import org.junit.jupiter.api.Test;
+
+import java.io.IOException;
+import java.net.InetAddress;
+import java.net.InetSocketAddress;
+import java.net.URLDecoder;
+import java.nio.charset.StandardCharsets;
+import java.util.ArrayList;
+import java.util.concurrent.CompletableFuture;
+import java.util.concurrent.CountDownLatch;
+import java.util.concurrent.ExecutorService;
+import java.util.concurrent.Executors;
+import java.util.concurrent.TimeUnit;
+
+import static org.junit.jupiter.api.Assertions.assertEquals;
+import static org.junit.jupiter.api.Assertions.assertTrue;
+
+/*
+ * Console against a stand-in muipserver that answers "slow" only once the test lets it,
+ * long after the request timeout.
+ */
+class ConsoleTest {
+    private static final int MAX_CONCURRENT_REQUESTS = 2;
+
+    private static final CountDownLatch release = new CountDownLatch(1);
+    private static HttpServer server;
+    private static ExecutorService executor;
+
+    @BeforeAll
+    static void start() throws IOException {
+        server = HttpServer.create(new InetSocketAddress(InetAddress.getLoopbackAddress(), 0), 0);
+        server.createContext("/api", ConsoleTest::handle);
+        executor = Executors.newCachedThreadPool();
+        server.setExecutor(executor);
+        server.start();
+
+        // Read when Console is first used, it is not loaded yet
+        Configuration.MUIP_SERVER.address = "http://127.0.0.1:" + server.getAddress().getPort() + "/api";
+        Configuration.MUIP_SERVER.maxConcurrentRequests = MAX_CONCURRENT_REQUESTS;
+        Configuration.MUIP_SERVER.requestTimeout = 1;
+    }
+
+    @AfterAll
+    static void stop() {
+        release.countDown();
+        server.stop(0);
+        executor.shutdownNow();
+    }
+
+    private static void handle(HttpExchange exchange) throws IOException {
+        String msg = "";
+        for (var parameter : exchange.getRequestURI().getRawQuery().split("&")) {
+            if (parameter.startsWith("msg="))
+                msg = URLDecoder.decode(parameter.substring(4), StandardCharsets.UTF_8);
+        }
+        if (msg.equals("slow")) {
+            try {
+                release.await(30, TimeUnit.SECONDS);
+            } catch (InterruptedException ignored) {
+            }
+        }
+
+        var body = ("{\"retcode\": 0, \"data\": {\"retmsg\": \"ran " + msg + "\"}}").getBytes(StandardCharsets.UTF_8);
+        try (exchange) {
+            exchange.sendResponseHeaders(200, body.length);
+            exchange.getResponseBody().write(body);
+        }
+    }
+
+    @Test
+    void reply() throws Exception {
+        assertEquals("retcode: 0\nretmsg: ran give 201 x10", Console.exec(1, "give 201 x10").get(5, TimeUnit.SECONDS));
+    }
+
+    @Test
+    void timeout() throws Exception {
+        assertEquals("The muipserver didn't answer in time, please try again later",
+                Console.exec(1, "slow").get(5, TimeUnit.SECONDS));
+    }
+
+    @Test
+    void saturation() throws Exception {
+        var pending = new ArrayList<CompletableFuture<String>>();
+        for (int i = 0; i < MAX_CONCURRENT_REQUESTS; i++)
+            pending.add(Console.exec(1, "slow"));
+
+        var rejected = Console.exec(1, "give 201 x10");
+        assertTrue(rejected.isDone());
+        assertEquals("Too many commands in progress, please try again later", rejected.get());
+
+        // The permits come back once the slow commands time out
+        for (var future : pending)
+            future.get(5, TimeUnit.SECONDS);
+        assertEquals("retcode: 0\nretmsg: ran give 201 x10", Console.exec(1, "give 201 x10").get(5, TimeUnit.SECONDS));
+    }
+}
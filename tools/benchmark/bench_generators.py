@@ -0,0 +1,182 @@
+"""
+Time and memory of each generator on synthetic schemas, per stage: load (reading the
+proto2json output), analyse (building the schema model), render (building the sources)
+and write (writing them out).
+
+    python bench_generators.py [--messages N] [--depth D] [--drift F] ... [--output report.json]
+
+The schemas are written to a scratch copy of the tools, nothing in the repository is touched.
+Each generator runs in a fresh interpreter, its report lists every stage's seconds, calls
+and peak traced bytes, plus the wall time and max RSS of the whole run.
+"""
+
+import argparse
+import builtins
+import json
+import os
+import platform
+import runpy
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import synth_schema
+
+TOOLS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+NEW_VERSION = "v2.0.0"
+OLD_VERSION = "v1.0.0"
+
+# Script, tool directory and arguments, in the order generateproto.py runs them
+SCRIPTS = [
+    ("opcode_shift", "opcode_shift", [NEW_VERSION, OLD_VERSION]),
+    ("messageMatch", "protojson2java", ["--reset"]),
+    ("protojson2java", "protojson2java", []),
+    ("protojson2javaex", "protojson2java", []),
+]
+
+
+class TimedWriter:
+    # Writes and the final flush of a generated file are charged to the write stage
+
+    def __init__(self, file, stage):
+        self.file = file
+        self.stage = stage
+
+    def write(self, data):
+        with self.stage("write"):
+            return self.file.write(data)
+
+    def writelines(self, lines):
+        with self.stage("write"):
+            return self.file.writelines(lines)
+
+    def close(self):
+        with self.stage("write"):
+            return self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __getattr__(self, name):
+        return getattr(self.file, name)
+
+
+def run_child(script, tool, arguments, memory):
+    tool_dir = os.path.join(TOOLS_DIR, tool)
+    os.chdir(tool_dir)
+    sys.path[:0] = [tool_dir, os.path.join(TOOLS_DIR, "protojson2java")]
+    import stageProfile
+
+    real_open = builtins.open
+
+    def timed_open(file, mode="r", *args, **kwargs):
+        opened = real_open(file, mode, *args, **kwargs)
+        return TimedWriter(opened, stageProfile.stage) if set(mode) & set("wax") else opened
+
+    builtins.open = timed_open
+    sys.argv = [script + ".py"] + arguments
+    stageProfile.enable(memory)
+    start = time.perf_counter()
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, "w")
+    try:
+        runpy.run_path(script + ".py", run_name="__main__")
+    except SystemExit as e:
+        if e.code:
+            raise
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+    stages = stageProfile.report()
+    builtins.open = real_open
+    print(json.dumps({"seconds": time.perf_counter() - start, "stages": stages, "max_rss": max_rss()}))
+
+
+def max_rss():
+    try:
+        import resource
+    except ImportError:
+        return None
+    # Of this process only, the parent's RUSAGE_CHILDREN is the maximum over every generator
+    # Kilobytes on Linux, bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+def prepare(root, config):
+    for tool in ("opcode_shift", "protojson2java"):
+        shutil.copytree(os.path.join(TOOLS_DIR, tool), os.path.join(root, "tools", tool),
+                        ignore=shutil.ignore_patterns("__pycache__", "cmdIdList.py", "message_map.json"))
+    shutil.copy(__file__, os.path.join(root, "tools", "benchmark", "bench_generators.py"))
+    shutil.copy(synth_schema.__file__, os.path.join(root, "tools", "benchmark", "synth_schema.py"))
+    for path in (("net", "packet"), ("server", "packet", "recv"), ("server", "packet", "send"),
+                 ("server", "packet", "injecter")):
+        os.makedirs(os.path.join(root, "src", "main", "java", "emu", "protoshift", *path), exist_ok=True)
+    return synth_schema.synthesize(root, config, NEW_VERSION, OLD_VERSION)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    synth_schema.add_arguments(parser)
+    parser.add_argument("--output", default="bench_generators.json", help="machine readable report")
+    parser.add_argument("--keep", help="synthesize into this directory and keep it")
+    parser.add_argument("--no-memory", action="store_true",
+                        help="skip memory tracing, which inflates the stage timings")
+    parser.add_argument("--run", nargs=2, metavar=("SCRIPT", "TOOL"), help=argparse.SUPPRESS)
+    args, rest = parser.parse_known_args()
+
+    if args.run:
+        run_child(args.run[0], args.run[1], rest, not args.no_memory)
+        return
+
+    config = synth_schema.config_from(args)
+    root = args.keep or tempfile.mkdtemp(prefix="protoshift-bench-")
+    os.makedirs(os.path.join(root, "tools", "benchmark"), exist_ok=True)
+    try:
+        start = time.perf_counter()
+        new, old = prepare(root, config)
+        synthesis = time.perf_counter() - start
+
+        results = {}
+        for script, tool, arguments in SCRIPTS:
+            start = time.perf_counter()
+            output = subprocess.run(
+                [sys.executable, os.path.join(root, "tools", "benchmark", "bench_generators.py"),
+                 "--run", script, tool] + (["--no-memory"] if args.no_memory else []) + arguments,
+                stdout=subprocess.PIPE, text=True, check=True).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+            result["wall"] = time.perf_counter() - start
+            results[script] = result
+    finally:
+        if not args.keep:
+            shutil.rmtree(root, ignore_errors=True)
+
+    report = {
+        "config": dict(vars(config), memory=not args.no_memory),
+        "schema": {"messages": len(new["types"]), "enums": len(new["enums"]), "opcodes": len(new["opcodes"]),
+                   "renamed": len(set(new["opcodes"]) - set(old["opcodes"])), "seconds": synthesis},
+        "platform": {"python": platform.python_version(), "implementation": platform.python_implementation(),
+                     "system": platform.platform(), "cpus": os.cpu_count()},
+        "scripts": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+
+    print(f"{report['schema']['messages']} messages, {report['schema']['opcodes']} opcodes per version, "
+          f"synthesized in {synthesis:.2f}s")
+    print(f"{'':18}{'stage':10}{'seconds':>10}{'calls':>10}{'peak MiB':>10}")
+    for script, result in results.items():
+        for name, stage in sorted(result["stages"].items()):
+            print(f"{script:18}{name:10}{stage['seconds']:10.2f}{stage['calls']:10}{stage['peak'] / 2 ** 20:10.1f}")
+        rss = f"{result['max_rss'] / 2 ** 20:10.1f}" if result["max_rss"] else f"{'':10}"
+        print(f"{script:18}{'total':10}{result['wall']:10.2f}{'':10}{rss}")
+    print("Report written to " + args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Startup cost of the translator emission modes of protojson2java.py: per-class handlers
+(--group 0) against grouped translators (--group N).
+
+    python bench_group.py <new version> <old version> [--groups 0,16,64,256] [--runs 3] [--no-start]
+
+For every group size the sources are regenerated with generateproto.py and the classes they
+declare are counted. Unless --no-start, the proxy is then built with gradle and started from
+the repository root, with its config.json, until PacketHandler.init logs the time spent
+registering handlers, the loaded classes and the Metaspace in use. The median of the runs is
+reported. The sources are left as generated for the last group size.
+"""
+
+import argparse
+import glob
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..")
+SERVER_PACKET_DIR = os.path.join(ROOT_DIR, "src", "main", "java", "emu", "protoshift", "server", "packet")
+JAR = "protoshift-bench"
+REGISTERED = re.compile(r"Handlers registered in (\d+) ms, (\d+) classes loaded, metaspace (\d+) KB")
+DECLARATION = re.compile(r"^\s*(?:(?:public|private|protected|static|final|abstract)\s+)*(?:class|interface|enum|record)\s+\w+",
+                         re.MULTILINE)
+
+
+def generated_classes():
+    # Top-level and nested classes of the translators, each is loaded on its own
+    count = 0
+    for path in glob.glob(os.path.join(SERVER_PACKET_DIR, "recv", "*.java")) + \
+            glob.glob(os.path.join(SERVER_PACKET_DIR, "send", "*.java")):
+        with open(path, encoding="utf-8") as f:
+            count += len(DECLARATION.findall(f.read()))
+    return count
+
+
+def run(command, cwd):
+    result = subprocess.run(command, cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    if result.returncode != 0:
+        print(result.stdout)
+        print(" ".join(command) + " failed")
+        exit(1)
+
+
+def start(timeout):
+    # Seconds until the handlers are registered, and the figures PacketHandler.init logs
+    begin = time.perf_counter()
+    process = subprocess.Popen(["java", "-jar", JAR + ".jar"], cwd=ROOT_DIR, stdout=subprocess.PIPE,
+                               stderr=subprocess.STDOUT, text=True)
+    try:
+        for line in process.stdout:
+            match = REGISTERED.search(line)
+            if match:
+                return time.perf_counter() - begin, [int(value) for value in match.groups()]
+            if time.perf_counter() - begin > timeout:
+                break
+        print("The proxy didn't log its handlers within " + str(timeout) + "s")
+        exit(1)
+    finally:
+        process.kill()
+        process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("new_version")
+    parser.add_argument("old_version")
+    parser.add_argument("--groups", default="0,16,64,256", help="group sizes, 0 is one class per handler")
+    parser.add_argument("--runs", type=int, default=3, help="proxy starts per group size")
+    parser.add_argument("--timeout", type=int, default=120, help="seconds to wait for the proxy")
+    parser.add_argument("--no-start", action="store_true", help="only count the generated classes")
+    parser.add_argument("--output", help="machine readable report")
+    args = parser.parse_args()
+    if args.new_version == args.old_version:
+        parser.error("--group only applies between two versions")
+
+    gradle = os.path.join(ROOT_DIR, "gradlew.bat" if os.name == "nt" else "gradlew")
+    report = []
+    print("group  classes  startup s  register ms  loaded  metaspace KB")
+    for group in [int(value) for value in args.groups.split(",")]:
+        run([sys.executable, "generateproto.py", args.new_version, args.old_version, "--group", str(group)], ROOT_DIR)
+        entry = {"group": group, "classes": generated_classes()}
+        if not args.no_start:
+            run([gradle, "jar", "-PjarFilename=" + JAR, "-q"], ROOT_DIR)
+            runs = [start(args.timeout) for _ in range(args.runs)]
+            entry["startup"] = statistics.median(seconds for seconds, figures in runs)
+            for index, name in enumerate(("register_ms", "loaded_classes", "metaspace_kb")):
+                entry[name] = statistics.median(figures[index] for seconds, figures in runs)
+        report.append(entry)
+        print("%5d  %7d" % (group, entry["classes"]) + ("" if args.no_start else "  %9.2f  %11d  %6d  %12d" % (
+            entry["startup"], entry["register_ms"], entry["loaded_classes"], entry["metaspace_kb"])))
+
+    if not args.no_start:
+        os.remove(os.path.join(ROOT_DIR, JAR + ".jar"))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
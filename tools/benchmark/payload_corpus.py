@@ -0,0 +1,331 @@
+"""
+Synthesize protobuf payloads for every opcode of both versions from the proto2json output
+the generators read, into one indexed corpus file.
+
+    python payload_corpus.py <new version> <old version> [--count N] [--output corpus.bin]
+
+Payloads are encoded and written one at a time, and the index is spooled to a temporary
+file, so the corpus can be far larger than memory. Layout, little endian:
+
+    "PSCORPUS" u32 format
+    payloads, back to back
+    index: u32 opcode, u32 version (1 new, 2 old, as in PacketOpcodes), u64 offset, u32 length
+    footer: u64 index offset, u64 entries, "PSCORPUS"
+
+The payloads of one opcode and version are contiguous. Corpus opens the file memory-mapped.
+"""
+
+import argparse
+import csv
+import json
+import mmap
+import os
+import random
+import shutil
+import struct
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "protojson2java"))
+from packetDirection import RECV, SEND, load_profile  # noqa: E402
+from protoSchema import SCALAR_TYPES, find_type, new_schema  # noqa: E402
+
+MAGIC = b"PSCORPUS"
+FORMAT = 1
+HEADER = struct.Struct("<8sI")
+ENTRY = struct.Struct("<IIQI")
+FOOTER = struct.Struct("<QQ8s")
+NEW, OLD = 1, 2
+
+PROTO_DIR = os.path.join("..", "..", "proto")
+PROTOJSON_DIR = os.path.join("..", "proto2json", "output")
+
+VARINT, FIXED64, DELIMITED, FIXED32 = 0, 1, 2, 5
+WIRE_TYPES = {"double": FIXED64, "fixed64": FIXED64, "sfixed64": FIXED64,
+              "float": FIXED32, "fixed32": FIXED32, "sfixed32": FIXED32,
+              "string": DELIMITED, "bytes": DELIMITED}
+STRING_ALPHABET = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789_ "
+
+
+def read_cmdid(version):
+    # Name -> opcode, from whichever of the files opcode_shift.py reads is present
+    path = os.path.join(PROTO_DIR, version, "")
+    if os.path.exists(path + "cmdid.csv"):
+        with open(path + "cmdid.csv", "r") as f:
+            return {line[0]: int(line[1]) for line in csv.reader(f) if len(line) > 1}
+    if os.path.exists(path + "cmdid.json"):
+        with open(path + "cmdid.json", "r") as f:
+            return {line["name"]: int(line["id"]) for line in json.load(f)}
+    if os.path.exists(path + "packetIds.json"):
+        with open(path + "packetIds.json", "r") as f:
+            return {name: int(id) for id, name in json.load(f).items()}
+    return {}
+
+
+def put_varint(out, value):
+    value &= 0xFFFFFFFFFFFFFFFF  # negative values take ten bytes, as protobuf encodes them
+    while value > 0x7F:
+        out.append(value & 0x7F | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def put_tag(out, number, wire_type):
+    put_varint(out, number << 3 | wire_type)
+
+
+def put_delimited(out, data):
+    put_varint(out, len(data))
+    out += data
+
+
+class Synthesizer:
+    def __init__(self, schema, rng, args):
+        self.schema = schema
+        self.rng = rng
+        self.presence = args.presence
+        self.repeated = args.repeated
+        self.max_repeated = args.max_repeated
+        self.string = args.string
+        self.max_string = args.max_string
+        self.depth = args.depth
+
+    def length(self, mean, limit):
+        # Geometric-ish: mostly short, with a long tail up to the limit
+        return min(int(self.rng.expovariate(1 / mean)) if mean > 0 else 0, limit)
+
+    def integer(self, bits, signed):
+        value = self.rng.getrandbits(self.rng.choice((4, 7, 14, bits)))
+        return -value if signed and self.rng.random() < 0.1 else value
+
+    def scalar(self, type):
+        # The encoded value of a non-delimited scalar or the bytes of a delimited one
+        if type == "bool":
+            return 1
+        if type in ("int32", "int64", "uint32", "uint64"):
+            return self.integer(32 if type.endswith("32") else 64, type[0] == "i")
+        if type in ("sint32", "sint64"):
+            value = self.integer(31 if type == "sint32" else 63, True)
+            return value << 1 if value >= 0 else (-value << 1) - 1
+        if type in ("fixed32", "sfixed32"):
+            return struct.pack("<I", self.rng.getrandbits(32))
+        if type in ("fixed64", "sfixed64"):
+            return struct.pack("<Q", self.rng.getrandbits(64))
+        if type == "float":
+            return struct.pack("<f", self.rng.uniform(-1e4, 1e4))
+        if type == "double":
+            return struct.pack("<d", self.rng.uniform(-1e6, 1e6))
+        size = self.length(self.string, self.max_string)
+        if type == "string":
+            return "".join(self.rng.choices(STRING_ALPHABET, k=size)).encode()
+        return self.rng.randbytes(size)
+
+    def value(self, type, depth):
+        # (wire type, encoded value) of one value of the type, None if it can't be built
+        if type in SCALAR_TYPES:
+            value = self.scalar(type)
+            return WIRE_TYPES.get(type, VARINT), value
+        kind, found = find_type(self.schema, type)
+        if kind == "enum":
+            values = list(found.values())
+            return (VARINT, self.rng.choice(values)) if values else None
+        if kind == "message" and depth < self.depth:
+            return DELIMITED, self.message(found, depth + 1)
+        return None
+
+    def put_field(self, out, number, type, depth):
+        value = self.value(type, depth)
+        if value is None:
+            return
+        wire_type, value = value
+        put_tag(out, number, wire_type)
+        if wire_type == VARINT:
+            put_varint(out, value)
+        elif wire_type == DELIMITED:
+            put_delimited(out, value)
+        else:
+            out += value
+
+    def put_repeated(self, out, number, type, depth):
+        count = self.length(self.repeated, self.max_repeated)
+        if not count:
+            return
+        kind = "scalar" if type in SCALAR_TYPES else find_type(self.schema, type)[0]
+        if (kind == "scalar" and WIRE_TYPES.get(type) != DELIMITED) or kind == "enum":
+            # proto3 packs repeated numbers
+            packed = bytearray()
+            for _ in range(count):
+                value = self.value(type, depth)
+                if value is None:
+                    return
+                if value[0] == VARINT:
+                    put_varint(packed, value[1])
+                else:
+                    packed += value[1]
+            put_tag(out, number, DELIMITED)
+            put_delimited(out, packed)
+            return
+        for _ in range(count):
+            self.put_field(out, number, type, depth)
+
+    def message(self, message, depth=0):
+        out = bytearray()
+        oneofs = {}
+        for key in message.fields:
+            if key.label == "oneof":
+                oneofs.setdefault(key.oneof, []).append(key)
+            elif key.label == "repeated":
+                self.put_repeated(out, key.number, key.type, depth)
+            elif key.label == "map":
+                for _ in range(self.length(self.repeated, self.max_repeated)):
+                    entry = bytearray()
+                    self.put_field(entry, 1, key.key, depth)
+                    self.put_field(entry, 2, key.type, depth)
+                    put_tag(out, key.number, DELIMITED)
+                    put_delimited(out, entry)
+            elif self.rng.random() < self.presence:
+                self.put_field(out, key.number, key.type, depth)
+        for group in oneofs.values():
+            if self.rng.random() < self.presence:
+                key = self.rng.choice(group)
+                self.put_field(out, key.number, key.type, depth)
+        return bytes(out)
+
+
+class CorpusWriter:
+    def __init__(self, path):
+        self.file = open(path, "wb")
+        self.file.write(HEADER.pack(MAGIC, FORMAT))
+        self.offset = HEADER.size
+        self.index = tempfile.TemporaryFile(dir=os.path.dirname(os.path.abspath(path)))
+        self.entries = 0
+
+    def add(self, opcode, version, payload):
+        self.file.write(payload)
+        self.index.write(ENTRY.pack(opcode, version, self.offset, len(payload)))
+        self.offset += len(payload)
+        self.entries += 1
+
+    def close(self):
+        self.index.seek(0)
+        shutil.copyfileobj(self.index, self.file)
+        self.index.close()
+        self.file.write(FOOTER.pack(self.offset, self.entries, MAGIC))
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class Corpus:
+    # Read side, entries are (opcode, version, offset, length) and payloads are views of the map
+
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, format = HEADER.unpack_from(self.map, 0)
+        index, self.entries, footer = FOOTER.unpack_from(self.map, len(self.map) - FOOTER.size)
+        if magic != MAGIC or footer != MAGIC:
+            raise ValueError(path + " is not a payload corpus")
+        if format != FORMAT:
+            raise ValueError(path + " has corpus format " + str(format) + ", expected " + str(FORMAT))
+        self.view = memoryview(self.map)
+        self.index = index
+
+    def __len__(self):
+        return self.entries
+
+    def __getitem__(self, i):
+        if not 0 <= i < self.entries:
+            raise IndexError(i)
+        return ENTRY.unpack_from(self.map, self.index + i * ENTRY.size)
+
+    def __iter__(self):
+        return (self[i] for i in range(self.entries))
+
+    def payload(self, i):
+        opcode, version, offset, length = self[i]
+        return self.view[offset:offset + length]
+
+    def close(self):
+        self.view.release()
+        self.map.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def plan(cmdid, schema, count, traffic):
+    # Opcode -> (message, payloads to write), busier opcodes get more with a traffic profile
+    total = sum(traffic.values())
+    planned = {}
+    for name, opcode in sorted(cmdid.items(), key=lambda item: item[1]):
+        if traffic:
+            if not traffic.get(name):
+                continue
+            n = max(1, round(count * len(traffic) * traffic[name] / total))
+        else:
+            n = count
+        kind, message = find_type(schema, name)
+        if kind == "message":
+            planned[opcode] = (message, n)
+    return planned
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("new_version")
+    parser.add_argument("old_version")
+    parser.add_argument("--output", default="corpus.bin")
+    parser.add_argument("--count", type=int, default=16,
+                        help="payloads per opcode, or on average with a profile")
+    parser.add_argument("--profile", help="traffic profile, opcodes without traffic are skipped")
+    parser.add_argument("--max-bytes", type=int, help="stop once the payloads reach this size")
+    parser.add_argument("--presence", type=float, default=0.8, help="chance a singular field is set")
+    parser.add_argument("--repeated", type=float, default=4, help="mean length of repeated fields and maps")
+    parser.add_argument("--max-repeated", type=int, default=256)
+    parser.add_argument("--string", type=float, default=16, help="mean length of strings and bytes")
+    parser.add_argument("--max-string", type=int, default=4096)
+    parser.add_argument("--depth", type=int, default=4, help="deepest nested message")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    # Clients send in the new encoding and the server answers in the old one, the profile
+    # counts recv by new name and send by old name
+    profile = load_profile(args.profile)
+    versions = [(NEW, args.new_version, "new", profile[RECV])]
+    if args.new_version != args.old_version:
+        versions.append((OLD, args.old_version, "old", profile[SEND]))
+
+    def full():
+        return args.max_bytes is not None and writer.offset - HEADER.size >= args.max_bytes
+
+    with CorpusWriter(args.output) as writer:
+        for version, name, side, traffic in versions:
+            cmdid = read_cmdid(name)
+            if not cmdid:
+                print("cmdid.csv, cmdid.json or packetIds.json not found for " + name)
+                exit(1)
+            schema = new_schema(os.path.join(PROTOJSON_DIR, side, ""))
+            planned = plan(cmdid, schema, args.count, traffic if args.profile else {})
+            written = writer.entries
+            for opcode, (message, n) in planned.items():
+                # Seeded per opcode, a payload doesn't change when other opcodes come and go
+                synthesizer = Synthesizer(schema, random.Random(f"{args.seed}:{version}:{opcode}"), args)
+                for _ in range(n):
+                    if full():
+                        break
+                    writer.add(opcode, version, synthesizer.message(message))
+            print(str(writer.entries - written) + " payloads for " + str(len(planned)) + " opcodes of " + name)
+    print(str(writer.entries) + " payloads, " + str(writer.offset - HEADER.size) + " bytes in " + args.output)
+
+
+if __name__ == "__main__":
+    main()
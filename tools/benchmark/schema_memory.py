@@ -0,0 +1,126 @@
+"""
+Peak and retained memory of the typed generator's schema model against the dict model it
+replaced, loading a proto2json output directory.
+
+    python schema_memory.py [proto2json output dir]
+
+Each model is loaded in a fresh interpreter so neither sees the other's allocations.
+"""
+
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "protojson2java"))
+from schemaModel import load_dir  # noqa: E402
+
+SCALAR_TYPES = ['double', 'float', 'int32', 'int64', 'uint32', 'uint64', 'sint32', 'sint64',
+                'fixed32', 'fixed64', 'sfixed32', 'sfixed64', 'bool', 'string', 'bytes']
+
+
+# The dict model, as protojson2javaex.py built it before schemaModel.py
+
+def legacy_camel(name):
+    result = name.capitalize()
+    result = re.sub(r'[0-9]([a-z])', lambda x: x.group()[0] + x.group()[1].upper(), result)
+    result = re.sub(r'(_[0-9])', lambda x: x.group()[1], result)
+    result = re.sub(r'(_[a-z])', lambda x: x.group()[1].upper(), result)
+    return result
+
+
+def legacy_field(json, name_key, type, scalar):
+    return {'Name': legacy_camel(json[name_key]), 'Type': type, 'Field': json[name_key],
+            'Number': int(json['FieldNumber']), 'Scalar': scalar}
+
+
+def legacy_analysis_field(name, json, map, enums, enum_list):
+    if 'MessageName' in json:
+        map[json['MessageName']] = {
+            'dir': (map[name]['dir'] if name != 'root' else 'root') + '.' + json['MessageName'],
+            'classic': [], 'repeated': [], 'map': [], 'oneof': []
+        }
+        for key in json['MessageBody'] or []:
+            legacy_analysis_field(json['MessageName'], key, map, enums, enum_list)
+        return
+    if 'EnumName' in json:
+        enum_list.append(json['EnumName'])
+        enums[json['EnumName']] = {value['Ident']: int(value['Number'])
+                                   for value in json['EnumBody'] or [] if 'Ident' in value}
+        return
+    if 'OneofName' in json:
+        map[name + '.' + json['OneofName']] = {'oneof': json['OneofName'], 'classic': [], 'repeated': [], 'map': []}
+        map[name]['oneof'].append(name + '.' + json['OneofName'])
+        for key in json['OneofFields'] or []:
+            legacy_analysis_field(name + '.' + json['OneofName'], key, map, enums, enum_list)
+        return
+    if 'Type' in json:
+        scalar = json['Type'] if json['Type'] in SCALAR_TYPES else None
+        type = 'classic' if scalar else json['Type']
+        if json.get('IsRepeated'):
+            map[name]['repeated'].append(legacy_field(json, 'FieldName', type, scalar))
+        elif 'FieldName' in json:
+            map[name]['classic'].append(legacy_field(json, 'FieldName', type, scalar))
+        elif 'MapName' in json:
+            map[name]['map'].append(legacy_field(json, 'MapName', type, scalar))
+
+
+def load_legacy(dir, files):
+    map, enums, enum_list = {}, {}, []
+    for file in files:
+        tree = json.load(open(os.path.join(dir, file), 'r', encoding='utf-8'))
+        for item in tree['ProtoBody']:
+            legacy_analysis_field('root', item, map, enums, enum_list)
+    return map, enums, enum_list
+
+
+def load_compact(dir, files):
+    map, enums, enum_list = {}, {}, []
+    load_dir(os.path.join(dir, ''), files, map, enums, enum_list)
+    return map, enums, enum_list
+
+
+def measure(model, dir):
+    files = sorted(os.listdir(dir))
+    load = load_legacy if model == 'legacy' else load_compact
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = load(dir, files)
+    elapsed = time.perf_counter() - start
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(json.dumps({'files': len(files), 'types': len(result[0]) + len(result[1]),
+                      'peak': peak, 'retained': retained, 'seconds': elapsed}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('dir', nargs='?', default=os.path.join('..', 'proto2json', 'output', 'new'))
+    parser.add_argument('--model', choices=['legacy', 'compact'], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.model:
+        measure(args.model, args.dir)
+        return
+
+    results = {}
+    for model in ('legacy', 'compact'):
+        output = subprocess.run([sys.executable, __file__, args.dir, '--model', model],
+                                stdout=subprocess.PIPE, text=True, check=True).stdout
+        results[model] = json.loads(output)
+
+    legacy, compact = results['legacy'], results['compact']
+    print(f"{legacy['files']} files, {legacy['types']} messages, oneofs and enums")
+    print(f"{'':10}{'peak MiB':>12}{'retained MiB':>14}{'seconds':>10}")
+    for model, result in results.items():
+        print(f"{model:10}{result['peak'] / 2 ** 20:12.1f}{result['retained'] / 2 ** 20:14.1f}{result['seconds']:10.2f}")
+    print(f"{'ratio':10}{compact['peak'] / legacy['peak']:12.2f}{compact['retained'] / legacy['retained']:14.2f}"
+          f"{compact['seconds'] / legacy['seconds']:10.2f}")
+
+
+if __name__ == '__main__':
+    main()
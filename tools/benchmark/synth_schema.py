@@ -0,0 +1,238 @@
+"""
+Synthesize two versions of a proto dump the way the generators see it: proto2json output
+and cmdid.csv, laid out as in the repository under the given root.
+
+    python synth_schema.py <root> [--messages N] [--depth D] [--drift F] ...
+
+The same arguments and seed always give the same schemas.
+"""
+
+import argparse
+import copy
+import json
+import os
+import random
+
+SCALARS = ["uint32", "int32", "uint64", "int64", "bool", "string", "bytes", "float", "double", "fixed32", "sint32"]
+CATEGORIES = ["Req", "Rsp", "Notify"]
+
+
+class Config:
+    def __init__(self, messages=2000, depth=2, fields=(3, 20), repeated=0.15, maps=0.05, oneofs=0.05,
+                 enums=0.1, references=0.2, drift=0.1, renames=0.01, seed=0):
+        self.messages = messages  # opcode messages, plus a quarter as many shared data types
+        self.depth = depth  # levels of nested message declarations
+        self.fields = fields  # field count range of a message
+        self.repeated = repeated  # share of fields that are repeated
+        self.maps = maps  # share of fields that are maps
+        self.oneofs = oneofs  # share of fields starting a oneof of 2 to 4 fields
+        self.enums = enums  # share of fields that are enums
+        self.references = references  # share of fields that are messages
+        self.drift = drift  # share of types changed in the new version
+        self.renames = renames  # share of opcode messages renamed in the new version
+        self.seed = seed
+
+
+def new_message(rng, config, name, data_types, enum_names, depth):
+    message = {"name": name, "fields": [], "nested": []}
+    if depth > 0 and rng.random() < 0.3:
+        for k in range(rng.randint(1, 2)):
+            message["nested"].append(new_message(rng, config, name + "Inner" + str(k), data_types, enum_names, depth - 1))
+
+    number = 0
+    count = rng.randint(*config.fields)
+    while len(message["fields"]) < count:
+        oneof = None
+        size = 1
+        if rng.random() < config.oneofs:
+            oneof = "choice_" + str(len(message["fields"]))
+            size = rng.randint(2, 4)
+        for _ in range(size):
+            number += rng.randint(1, 3)
+            roll = rng.random()
+            if roll < config.references and (data_types or message["nested"]):
+                type = rng.choice([nested["name"] for nested in message["nested"]] + data_types)
+            elif roll < config.references + config.enums and enum_names:
+                type = rng.choice(enum_names)
+            else:
+                type = rng.choice(SCALARS)
+            label = "oneof" if oneof else "optional"
+            key = None
+            if not oneof:
+                roll = rng.random()
+                if roll < config.maps:
+                    label, key = "map", rng.choice(["uint32", "string"])
+                elif roll < config.maps + config.repeated:
+                    label = "repeated"
+            message["fields"].append({"name": "field_" + str(number), "type": type, "number": number,
+                                      "label": label, "oneof": oneof, "key": key})
+    return message
+
+
+def drift_message(rng, message):
+    fields = message["fields"]
+    roll = rng.random()
+    if roll < 0.4 and len(fields) > 1:
+        # Renumbered, the names stay
+        a, b = rng.sample(range(len(fields)), 2)
+        fields[a]["number"], fields[b]["number"] = fields[b]["number"], fields[a]["number"]
+    elif roll < 0.7:
+        number = max([field["number"] for field in fields] + [0]) + 1
+        fields.append({"name": "field_" + str(number), "type": rng.choice(SCALARS), "number": number,
+                       "label": "optional", "oneof": None, "key": None})
+    elif fields:
+        fields.pop(rng.randrange(len(fields)))
+
+
+def synthesize_versions(config):
+    rng = random.Random(config.seed)
+    enum_names = ["SynthEnum" + str(i) for i in range(max(1, config.messages // 20))]
+    enums = {name: [(name.upper() + "_V" + str(j), j) for j in range(rng.randint(3, 10))] for name in enum_names}
+
+    # Shared data types only reference later ones, so there are no cycles
+    data_count = max(1, config.messages // 4)
+    data_names = ["SynthData" + str(i) for i in range(data_count)]
+    types = {}
+    for i in reversed(range(data_count)):
+        types[data_names[i]] = new_message(rng, config, data_names[i], data_names[i + 1:i + 8], enum_names, config.depth)
+    opcodes = []
+    for i in range(config.messages):
+        name = "Synth" + str(i) + CATEGORIES[i % len(CATEGORIES)]
+        types[name] = new_message(rng, config, name, data_names, enum_names, config.depth)
+        opcodes.append(name)
+
+    types["UnionCmd"] = {"name": "UnionCmd", "nested": [], "fields": [
+        {"name": "body", "type": "bytes", "number": 1, "label": "optional", "oneof": None, "key": None},
+        {"name": "message_id", "type": "uint32", "number": 2, "label": "optional", "oneof": None, "key": None}]}
+    types["UnionCmdNotify"] = {"name": "UnionCmdNotify", "nested": [], "fields": [
+        {"name": "cmd_list", "type": "UnionCmd", "number": 1, "label": "repeated", "oneof": None, "key": None}]}
+    opcodes.append("UnionCmdNotify")
+
+    old = {"types": types, "enums": enums, "opcodes": {name: 1000 + i for i, name in enumerate(opcodes)}}
+    new = copy.deepcopy(old)
+    for name in rng.sample(sorted(new["types"]), int(len(new["types"]) * config.drift)):
+        if name not in ("UnionCmd", "UnionCmdNotify"):
+            drift_message(rng, new["types"][name])
+    for name in rng.sample(enum_names, int(len(enum_names) * config.drift)):
+        values = new["enums"][name]
+        if len(values) > 1:
+            a, b = rng.sample(range(len(values)), 2)
+            (ident_a, number_a), (ident_b, number_b) = values[a], values[b]
+            values[a], values[b] = (ident_a, number_b), (ident_b, number_a)
+
+    # Renamed opcodes keep their suffix, as in the real dumps
+    for name in rng.sample(opcodes[:-1], int(config.messages * config.renames)):
+        renamed = name.replace("Synth", "SynthRenamed", 1)
+        message = new["types"].pop(name)
+        message["name"] = renamed
+        new["types"][renamed] = message
+        new["opcodes"][renamed] = new["opcodes"].pop(name)
+    ids = list(new["opcodes"].values())
+    rng.shuffle(ids)
+    new["opcodes"] = dict(zip(new["opcodes"], ids))
+    return new, old
+
+
+META = {"Pos": {"Filename": "", "Offset": 0, "Line": 0, "Column": 0},
+        "LastPos": {"Filename": "", "Offset": 0, "Line": 0, "Column": 0}}
+
+
+def render_field(field):
+    if field["label"] == "map":
+        return {"KeyType": field["key"], "Type": field["type"], "MapName": field["name"],
+                "FieldNumber": str(field["number"]), "FieldOptions": None, "Comments": None,
+                "InlineComment": None, "Meta": META}
+    item = {"Type": field["type"], "FieldName": field["name"], "FieldNumber": str(field["number"]),
+            "FieldOptions": None, "Comments": None, "InlineComment": None, "Meta": META}
+    if field["label"] == "oneof":
+        return item
+    return dict({"IsRepeated": field["label"] == "repeated", "IsRequired": False, "IsOptional": False}, **item)
+
+
+def render_message(message):
+    body = []
+    oneofs = {}
+    for field in message["fields"]:
+        if field["label"] != "oneof":
+            body.append(render_field(field))
+        elif field["oneof"] in oneofs:
+            oneofs[field["oneof"]]["OneofFields"].append(render_field(field))
+        else:
+            oneofs[field["oneof"]] = {"OneofFields": [render_field(field)], "OneofName": field["oneof"],
+                                      "Options": None, "Comments": None, "InlineComment": None, "Meta": META}
+            body.append(oneofs[field["oneof"]])
+    body += [render_message(nested) for nested in message["nested"]]
+    return {"MessageName": message["name"], "MessageBody": body, "Comments": None, "InlineComment": None,
+            "InlineCommentBehindLeftCurly": None, "Meta": META}
+
+
+def references(message, found):
+    for field in message["fields"]:
+        found.add(field["type"])
+    for nested in message["nested"]:
+        references(nested, found)
+    return found
+
+
+def write_version(version, proto_dir, json_dir):
+    os.makedirs(proto_dir, exist_ok=True)
+    os.makedirs(json_dir, exist_ok=True)
+    with open(os.path.join(proto_dir, "cmdid.csv"), "w", encoding="utf-8") as f:
+        f.writelines(name + "," + str(id) + "\n" for name, id in version["opcodes"].items())
+
+    header = [{"ProtocolSpec": "\"proto3\""}]
+    for name, message in version["types"].items():
+        imports = sorted(type for type in references(message, set())
+                         if type in version["types"] or type in version["enums"])
+        body = [{"Location": "\"" + type + ".proto\"", "Modifier": 0, "Comments": None,
+                 "InlineComment": None, "Meta": META} for type in imports]
+        body.append({"OptionName": "java_package", "Constant": "\"emu.protoshift.net.proto\""})
+        body.append(render_message(message))
+        with open(os.path.join(json_dir, name + ".json"), "w", encoding="utf-8") as f:
+            json.dump({"Syntax": header[0], "ProtoBody": body}, f, indent=2)
+    for name, values in version["enums"].items():
+        body = [{"OptionName": "java_package", "Constant": "\"emu.protoshift.net.proto\""},
+                {"EnumName": name, "EnumBody": [{"Ident": ident, "Number": str(number), "Options": None,
+                                                 "Comments": None, "InlineComment": None, "Meta": META}
+                                                for ident, number in values],
+                 "Comments": None, "InlineComment": None, "Meta": META}]
+        with open(os.path.join(json_dir, name + ".json"), "w", encoding="utf-8") as f:
+            json.dump({"Syntax": header[0], "ProtoBody": body}, f, indent=2)
+
+
+def synthesize(root, config, new_version="v2.0.0", old_version="v1.0.0"):
+    new, old = synthesize_versions(config)
+    output = os.path.join(root, "tools", "proto2json", "output")
+    write_version(new, os.path.join(root, "proto", new_version), os.path.join(output, "new"))
+    write_version(old, os.path.join(root, "proto", old_version), os.path.join(output, "old"))
+    return new, old
+
+
+def add_arguments(parser):
+    defaults = Config()
+    parser.add_argument("--messages", type=int, default=defaults.messages)
+    parser.add_argument("--depth", type=int, default=defaults.depth)
+    parser.add_argument("--min-fields", type=int, default=defaults.fields[0])
+    parser.add_argument("--max-fields", type=int, default=defaults.fields[1])
+    parser.add_argument("--repeated", type=float, default=defaults.repeated)
+    parser.add_argument("--maps", type=float, default=defaults.maps)
+    parser.add_argument("--oneofs", type=float, default=defaults.oneofs)
+    parser.add_argument("--enums", type=float, default=defaults.enums)
+    parser.add_argument("--references", type=float, default=defaults.references)
+    parser.add_argument("--drift", type=float, default=defaults.drift)
+    parser.add_argument("--renames", type=float, default=defaults.renames)
+    parser.add_argument("--seed", type=int, default=defaults.seed)
+
+
+def config_from(args):
+    return Config(args.messages, args.depth, (args.min_fields, args.max_fields), args.repeated, args.maps,
+                  args.oneofs, args.enums, args.references, args.drift, args.renames, args.seed)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("root")
+    add_arguments(parser)
+    args = parser.parse_args()
+    new, old = synthesize(args.root, config_from(args))
+    print(str(len(new["types"])) + " messages and " + str(len(new["enums"])) + " enums per version in " + args.root)
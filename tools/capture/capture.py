@@ -0,0 +1,220 @@
+"""
+Capture files and the proxy's packet framing, shared by the capture tools.
+
+A capture starts with "PSCAPTUR" and a u32 format, then holds records, little endian:
+
+    u32 size of the rest of the record
+    u8  kind, DATAGRAM: a KCP payload as PacketHandler.handlePacket receives it, XOR included,
+        PACKET: a packet as PacketCapture in the proxy writes it, see PACKET_HEADER
+    u8  direction, 1 client -> server, 2 server -> client
+    u8  version of the bytes, 1 new, 2 old, as in PacketOpcodes
+    u8  reserved
+    u64 timestamp, microseconds since the epoch
+    u64 session
+    body
+
+The proxy writes into preallocated files and trims them when it closes them, a file it didn't
+get to trim ends in zeros.
+"""
+
+import mmap
+import re
+import struct
+
+MAGIC = b"PSCAPTUR"
+FORMAT = 1
+FILE_HEADER = struct.Struct("<8sI")
+RECORD = struct.Struct("<IBBBxQQ")
+RECORD_SIZE = struct.Struct("<I")
+
+DATAGRAM, PACKET = 1, 2
+CLIENT, SERVER = 1, 2
+NEW, OLD = 1, 2
+
+# uid, opcode, forwarded opcode, header length, payload length, forwarded payload length, followed by
+# the header, the payload as it arrived and as it was forwarded in the other version. Packets the
+# proxy sent on its own have opcode 0 and no payload as it arrived, untranslated ones forwarded opcode 0
+PACKET_HEADER = struct.Struct("<IHHHII")
+
+# 0x4567 opcode header-length payload-length header payload 0x89ab, big endian
+FRAME = struct.Struct(">HhHI")
+FRAME_START = 0x4567
+FRAME_END = 0x89AB
+
+NONE, DISPATCH_KEY, ENCRYPT_KEY = "none", "dispatch", "session"
+
+# Logged by HandleLogin at debug level
+SEED_LOG = re.compile(r"Session key seed of uid (\d+): (-?\d+)")
+
+MASK64 = 0xFFFFFFFFFFFFFFFF
+
+
+class MersenneTwister64:
+    # MT19937-64 as emu.protoshift.utils.MersenneTwister64 implements it, Java longs kept to 64 bits
+
+    N = 312
+    M = 156
+    MATRIX_A = 0xB5026F5AA96619E9
+    UPPER_MASK = 0xFFFFFFFF80000000
+    LOWER_MASK = 0x7FFFFFFF
+
+    def __init__(self):
+        self.mt = [0] * self.N
+        self.mti = self.N + 1
+
+    def set_seed(self, seed):
+        mt = self.mt
+        mt[0] = seed & MASK64
+        for i in range(1, self.N):
+            mt[i] = (0x5851F42D4C957F2D * (mt[i - 1] ^ (mt[i - 1] >> 62)) + i) & MASK64
+        self.mti = self.N
+
+    def next_long(self):
+        mt, n, m = self.mt, self.N, self.M
+        if self.mti >= n:
+            if self.mti == n + 1:
+                self.set_seed(5489)
+            for i in range(n):
+                x = (mt[i] & self.UPPER_MASK) | (mt[(i + 1) % n] & self.LOWER_MASK)
+                mt[i] = mt[(i + m) % n] ^ (x >> 1) ^ (self.MATRIX_A if x & 1 else 0)
+            self.mti = 0
+
+        x = mt[self.mti]
+        self.mti += 1
+        x ^= (x >> 29) & 0x5555555555555555
+        x ^= (x << 17) & 0x71D67FFFEDA60000
+        x ^= (x << 37) & 0xFFF7EEE000000000
+        x ^= x >> 43
+        return x & MASK64
+
+
+def generate_key(seed):
+    # Crypto.generateKey
+    mt = MersenneTwister64()
+    mt.set_seed(seed)
+    mt.set_seed(mt.next_long())
+    mt.next_long()
+    return b"".join(mt.next_long().to_bytes(8, "big") for _ in range(4096 >> 3))
+
+
+def xor(data, key):
+    # Crypto.xor, the key repeats from the first byte of the datagram
+    size = len(data)
+    stream = key * (size // len(key) + 1)
+    return (int.from_bytes(data, "big") ^ int.from_bytes(stream[:size], "big")).to_bytes(size, "big")
+
+
+def detect(data, dispatch_key):
+    # The XOR mode PacketHandler.handlePacket picks from the first two bytes
+    if data[0] == 0x45 and data[1] == 0x67:
+        return NONE
+    if data[0] == 0x45 ^ dispatch_key[0] and data[1] == 0x67 ^ dispatch_key[1]:
+        return DISPATCH_KEY
+    return ENCRYPT_KEY
+
+
+def split_frames(data):
+    # (opcode, header, payload) of each frame of a decrypted datagram, and the bytes left unparsed
+    frames = []
+    view = memoryview(data)
+    offset = 0
+    while len(data) - offset >= 12:
+        start, opcode, header_size, payload_size = FRAME.unpack_from(data, offset)
+        end = offset + FRAME.size + header_size + payload_size
+        if start != FRAME_START or end + 2 > len(data) or int.from_bytes(data[end:end + 2], "big") != FRAME_END:
+            break
+        header = view[offset + FRAME.size:offset + FRAME.size + header_size]
+        frames.append((opcode, header, view[end - payload_size:end]))
+        offset = end + 2
+    return frames, len(data) - offset
+
+
+def build_frame(opcode, header, payload):
+    # BasePacket.build
+    return (FRAME.pack(FRAME_START, opcode, len(header), len(payload)) + bytes(header) + bytes(payload)
+            + FRAME_END.to_bytes(2, "big"))
+
+
+def split_packet(body):
+    # (uid, opcode, forwarded opcode, header, payload, forwarded payload) of a PACKET record
+    uid, opcode, forwarded, header_size, payload_size, forwarded_size = PACKET_HEADER.unpack_from(body)
+    offset = PACKET_HEADER.size
+    header = body[offset:offset + header_size]
+    offset += header_size
+    payload = body[offset:offset + payload_size]
+    offset += payload_size
+    return uid, opcode, forwarded, header, payload, body[offset:offset + forwarded_size]
+
+
+def load_seeds(paths):
+    # uid -> session key seed, from proxy logs
+    seeds = {}
+    for path in paths or []:
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            for line in f:
+                match = SEED_LOG.search(line)
+                if match:
+                    seeds[int(match.group(1))] = int(match.group(2))
+    return seeds
+
+
+class Capture:
+    # Memory-mapped read side, records are walked without copying their bodies
+
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, format = FILE_HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC:
+            raise ValueError(path + " is not a capture")
+        if format != FORMAT:
+            raise ValueError(path + " has capture format " + str(format) + ", expected " + str(FORMAT))
+        self.view = memoryview(self.map)
+
+    def records(self):
+        # (kind, direction, version, timestamp, session, body)
+        offset = FILE_HEADER.size
+        end = len(self.map)
+        while offset + RECORD.size <= end:
+            size, kind, direction, version, timestamp, session = RECORD.unpack_from(self.map, offset)
+            if size == 0:
+                break  # the untrimmed end of a file the proxy was writing
+            next = offset + RECORD_SIZE.size + size
+            if next > end:
+                break  # the writer was cut off mid-record
+            yield kind, direction, version, timestamp, session, self.view[offset + RECORD.size:next]
+            offset = next
+
+    def close(self):
+        try:
+            self.view.release()
+            self.map.close()
+        except BufferError:
+            pass  # bodies handed out are still referenced, the map is unmapped along with them
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class CaptureWriter:
+    def __init__(self, path):
+        self.file = open(path, "wb")
+        self.file.write(FILE_HEADER.pack(MAGIC, FORMAT))
+
+    def write(self, kind, direction, version, timestamp, session, body):
+        self.file.write(RECORD.pack(RECORD.size - RECORD_SIZE.size + len(body), kind, direction, version,
+                                    timestamp, session))
+        self.file.write(body)
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
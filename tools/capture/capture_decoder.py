@@ -0,0 +1,383 @@
+"""
+Decode captured KCP payloads offline: undo the XOR the way PacketHandler.handlePacket does,
+split the datagrams into frames and count packets and payload sizes per opcode. Packets the
+proxy captured itself are already decrypted, both the payload that arrived and its translation
+are counted and decoded.
+
+    python capture_decoder.py <new version> <old version> <capture>... [--seeds proxy.log] [--decode out.jsonl]
+
+Session keys come from the GetPlayerTokenRsp of the session, its secret_key_seed or, when
+the seed was exchanged encrypted, the seed HandleLogin logged for the uid. Sessions are
+spread over a process pool, each worker maps the captures and decodes its share.
+"""
+
+import argparse
+import base64
+import json
+import os
+import struct
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+from capture import (CLIENT, DATAGRAM, DISPATCH_KEY, ENCRYPT_KEY, NEW, NONE, OLD, PACKET, Capture, detect,
+                     generate_key, load_seeds, split_frames, split_packet, xor)
+
+sys.path.insert(0, os.path.join("..", "protojson2java"))
+from protoSchema import ProtoField, field_number, find_type, new_schema  # noqa: E402
+
+PROTO_DIR = os.path.join("..", "..", "proto")
+PROTOJSON_DIR = os.path.join("..", "proto2json", "output")
+DISPATCH_KEY_FILE = os.path.join("..", "..", "src", "main", "resources", "keys", "dispatchKey.bin")
+
+FIXED = {"fixed32": "<I", "sfixed32": "<i", "float": "<f", "fixed64": "<Q", "sfixed64": "<q", "double": "<d"}
+VARINT_TYPES = {"int32", "int64", "uint32", "uint64", "sint32", "sint64", "bool"}
+
+
+def read_cmdid(version):
+    # Opcode -> name, from whichever of the files opcode_shift.py reads is present
+    path = os.path.join(PROTO_DIR, version, "")
+    if os.path.exists(path + "cmdid.csv"):
+        with open(path + "cmdid.csv", "r") as f:
+            return {int(line.split(",")[1]): line.split(",")[0] for line in f if "," in line}
+    if os.path.exists(path + "cmdid.json"):
+        with open(path + "cmdid.json", "r") as f:
+            return {int(line["id"]): line["name"] for line in json.load(f)}
+    if os.path.exists(path + "packetIds.json"):
+        with open(path + "packetIds.json", "r") as f:
+            return {int(id): name for id, name in json.load(f).items()}
+    return {}
+
+
+def read_varint(data, offset):
+    value = shift = 0
+    while True:
+        if offset >= len(data):
+            raise ValueError("truncated varint")
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, offset
+        shift += 7
+
+
+def signed(value, bits):
+    value &= (1 << bits) - 1
+    return value - (1 << bits) if value >> (bits - 1) else value
+
+
+class Decoder:
+    # Protobuf wire format to JSON-ready values, driven by the proto2json schema
+
+    def __init__(self, schema):
+        self.schema = schema
+        self.map_entries = {}
+
+    def scalar(self, type, wire_type, value):
+        if type in FIXED:
+            return struct.unpack(FIXED[type], value)[0]
+        if type in ("int32", "int64"):
+            return signed(value, 64 if type == "int64" else 32)
+        if type in ("sint32", "sint64"):
+            return (value >> 1) ^ -(value & 1)
+        if type == "bool":
+            return bool(value)
+        if type == "string":
+            return bytes(value).decode("utf-8", "replace")
+        if type == "bytes":
+            return base64.b64encode(value).decode()
+        return value
+
+    def value(self, type, wire_type, value):
+        if type in VARINT_TYPES or type in FIXED or type in ("string", "bytes"):
+            return self.scalar(type, wire_type, value)
+        kind, found = find_type(self.schema, type)
+        if kind == "enum":
+            for ident, number in found.items():
+                if number == signed(value, 32):
+                    return ident
+            return signed(value, 32)
+        if kind == "message":
+            return self.message(found, value)
+        return raw(wire_type, value)
+
+    def packed(self, type, data):
+        values = []
+        offset = 0
+        if type in FIXED:
+            size = struct.calcsize(FIXED[type])
+            for offset in range(0, len(data) - size + 1, size):
+                values.append(self.scalar(type, None, data[offset:offset + size]))
+            return values
+        while offset < len(data):
+            value, offset = read_varint(data, offset)
+            values.append(self.value(type, 0, value))
+        return values
+
+    def map_entry(self, key):
+        # The fields of the entry message a map is encoded as
+        if key not in self.map_entries:
+            self.map_entries[key] = [ProtoField("key", 1, key.key, "optional"),
+                                     ProtoField("value", 2, key.type, "optional")]
+        return self.map_entries[key]
+
+    def message(self, message, data, fields=None):
+        fields = {key.number: key for key in (fields or message.fields)}
+        result = {}
+        offset = 0
+        while offset < len(data):
+            tag, offset = read_varint(data, offset)
+            number, wire_type = tag >> 3, tag & 7
+            if wire_type == 0:
+                value, offset = read_varint(data, offset)
+            elif wire_type in (1, 5):
+                size = 8 if wire_type == 1 else 4
+                value, offset = data[offset:offset + size], offset + size
+            elif wire_type == 2:
+                size, offset = read_varint(data, offset)
+                value, offset = data[offset:offset + size], offset + size
+            else:
+                raise ValueError("unsupported wire type " + str(wire_type))
+            if offset > len(data):
+                raise ValueError("truncated field " + str(number))
+
+            key = fields.get(number)
+            if key is None:
+                result.setdefault(str(number), []).append(raw(wire_type, value))
+            elif key.label == "map":
+                entry = self.message(None, value, self.map_entry(key))
+                result.setdefault(key.name, {})[str(entry.get("key", ""))] = entry.get("value")
+            elif key.label == "repeated":
+                if wire_type == 2 and (key.type in VARINT_TYPES or key.type in FIXED
+                                       or find_type(self.schema, key.type)[0] == "enum"):
+                    result.setdefault(key.name, []).extend(self.packed(key.type, value))
+                else:
+                    result.setdefault(key.name, []).append(self.value(key.type, wire_type, value))
+            else:
+                result[key.name] = self.value(key.type, wire_type, value)
+        return result
+
+
+def raw(wire_type, value):
+    return value if wire_type == 0 else base64.b64encode(value).decode()
+
+
+class Version:
+    # Names, schema and login fields of one side of the proxy
+
+    def __init__(self, version, side):
+        self.names = read_cmdid(version)
+        self.schema = new_schema(os.path.join(PROTOJSON_DIR, side, ""))
+        self.decoder = Decoder(self.schema)
+        ids = {name: id for id, name in self.names.items()}
+        self.token_rsp = ids.get("GetPlayerTokenRsp")
+        self.retcode = field_number(self.schema, "GetPlayerTokenRsp", "retcode", None)
+        self.uid = field_number(self.schema, "GetPlayerTokenRsp", "uid", None)
+        self.secret_key_seed = field_number(self.schema, "GetPlayerTokenRsp", "secret_key_seed", None)
+
+    def login(self, payload):
+        # (retcode, uid, secret_key_seed) of a GetPlayerTokenRsp
+        values = {}
+        offset = 0
+        while offset < len(payload):
+            tag, offset = read_varint(payload, offset)
+            if tag & 7 == 0:
+                values[tag >> 3], offset = read_varint(payload, offset)
+            elif tag & 7 == 2:
+                size, offset = read_varint(payload, offset)
+                offset += size
+            else:
+                offset += 8 if tag & 7 == 1 else 4
+        return values.get(self.retcode, 0), values.get(self.uid, 0), values.get(self.secret_key_seed, 0)
+
+
+class SessionKeys:
+    # XOR keys and uids of the sessions, learnt from their GetPlayerTokenRsp
+
+    def __init__(self, dispatch_key, seeds):
+        self.dispatch_key = dispatch_key
+        self.seeds = seeds
+        self.keys = {}
+        self.uids = {}
+
+    def decrypt(self, session, body):
+        # (mode, data), data is None while the session key is unknown
+        mode = detect(body, self.dispatch_key)
+        if mode == DISPATCH_KEY:
+            return mode, xor(body, self.dispatch_key)
+        if mode == ENCRYPT_KEY:
+            key = self.keys.get(session)
+            return mode, None if key is None else xor(body, key)
+        return mode, bytes(body)
+
+    def learn(self, session, side, opcode, payload):
+        if opcode != side.token_rsp or session in self.keys:
+            return
+        retcode, uid, seed = side.login(payload)
+        seed = seed or self.seeds.get(uid)
+        if retcode == 0 and seed is not None:
+            self.keys[session] = generate_key(seed)
+            self.uids[session] = uid
+
+
+class Stats:
+    def __init__(self):
+        self.counters = {"datagrams": 0, "frames": 0, "multi_frame": 0, "trailing_bytes": 0,
+                         "undecryptable": 0, "malformed": 0, "undecoded": 0, "sessions": 0,
+                         "packets": 0}
+        self.modes = {NONE: 0, DISPATCH_KEY: 0, ENCRYPT_KEY: 0}
+        self.opcodes = {}  # (version, opcode) -> [count, bytes, min, max, {size bucket: count}]
+
+    def add(self, version, opcode, size):
+        entry = self.opcodes.get((version, opcode))
+        if entry is None:
+            entry = self.opcodes[(version, opcode)] = [0, 0, size, size, {}]
+        entry[0] += 1
+        entry[1] += size
+        entry[2] = min(entry[2], size)
+        entry[3] = max(entry[3], size)
+        bucket = 1 << max(size - 1, 0).bit_length()  # sizes up to the next power of two
+        entry[4][bucket] = entry[4].get(bucket, 0) + 1
+
+    def merge(self, other):
+        for name, count in other.counters.items():
+            self.counters[name] += count
+        for mode, count in other.modes.items():
+            self.modes[mode] += count
+        for key, (count, total, low, high, buckets) in other.opcodes.items():
+            entry = self.opcodes.setdefault(key, [0, 0, low, high, {}])
+            entry[0] += count
+            entry[1] += total
+            entry[2] = min(entry[2], low)
+            entry[3] = max(entry[3], high)
+            for bucket, n in buckets.items():
+                entry[4][bucket] = entry[4].get(bucket, 0) + n
+
+
+def decode_shard(paths, shard, shards, new_version, old_version, seeds, dispatch_key, decode):
+    versions = {NEW: Version(new_version, "new")}
+    versions[OLD] = versions[NEW] if new_version == old_version else Version(old_version, "old")
+    stats = Stats()
+    keys = SessionKeys(dispatch_key, seeds)
+    sessions = set()
+    output = open(decode + "." + str(shard), "w", encoding="utf-8") if decode else None
+
+    def emit(timestamp, session, direction, version, opcode, payload, **extra):
+        if output is None:
+            return
+        side = versions[version]
+        name = side.names.get(opcode)
+        kind, message = find_type(side.schema, name) if name else (None, None)
+        if kind != "message":
+            stats.counters["undecoded"] += 1
+            return
+        try:
+            decoded = side.decoder.message(message, payload)
+        except (ValueError, struct.error):
+            stats.counters["malformed"] += 1
+            return
+        output.write(json.dumps(dict({"timestamp": timestamp, "session": session,
+                                      "direction": "c2s" if direction == CLIENT else "s2c",
+                                      "version": version, "opcode": opcode, "name": name}, **extra,
+                                     message=decoded)) + "\n")
+
+    try:
+        for path in paths:
+            with Capture(path) as capture:
+                for kind, direction, version, timestamp, session, body in capture.records():
+                    if session % shards != shard:
+                        continue
+                    if session not in sessions:
+                        sessions.add(session)
+                        stats.counters["sessions"] += 1
+                    if kind == PACKET:
+                        stats.counters["packets"] += 1
+                        uid, opcode, forwarded, header, payload, translated = split_packet(body)
+                        if opcode:
+                            stats.add(version, opcode, len(payload))
+                            emit(timestamp, session, direction, version, opcode, payload, uid=uid)
+                        if forwarded:
+                            stats.add(3 - version, forwarded, len(translated))
+                            emit(timestamp, session, direction, 3 - version, forwarded, translated, uid=uid,
+                                 translated_from=opcode)
+                        continue
+                    if kind != DATAGRAM or len(body) < 2:
+                        continue
+                    stats.counters["datagrams"] += 1
+
+                    mode, data = keys.decrypt(session, body)
+                    stats.modes[mode] += 1
+                    if data is None:
+                        stats.counters["undecryptable"] += 1
+                        continue
+
+                    frames, trailing = split_frames(data)
+                    stats.counters["frames"] += len(frames)
+                    stats.counters["multi_frame"] += len(frames) > 1
+                    stats.counters["trailing_bytes"] += trailing
+                    side = versions[version]
+                    for opcode, header, payload in frames:
+                        stats.add(version, opcode, len(payload))
+                        keys.learn(session, side, opcode, payload)
+                        emit(timestamp, session, direction, version, opcode, payload)
+    finally:
+        if output is not None:
+            output.close()
+    return stats
+
+
+def report(stats, versions):
+    opcodes = []
+    for (version, opcode), (count, total, low, high, buckets) in stats.opcodes.items():
+        opcodes.append({"version": version, "opcode": opcode, "name": versions[version].get(opcode, "UNKNOWN"),
+                        "count": count, "bytes": total, "min": low, "max": high,
+                        "mean": round(total / count, 1), "sizes": {str(k): v for k, v in sorted(buckets.items())}})
+    opcodes.sort(key=lambda entry: -entry["count"])
+    return dict(stats.counters, modes=stats.modes, opcodes=opcodes)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("new_version")
+    parser.add_argument("old_version")
+    parser.add_argument("captures", nargs="+")
+    parser.add_argument("--seeds", nargs="*", help="proxy logs with the session key seeds HandleLogin logged")
+    parser.add_argument("--dispatch-key", default=DISPATCH_KEY_FILE)
+    parser.add_argument("--decode", help="also write every decoded packet, as json lines per worker to FILE.<n>")
+    parser.add_argument("--report", default="capture_report.json")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count())
+    parser.add_argument("--top", type=int, default=20, help="opcodes printed")
+    args = parser.parse_args()
+
+    with open(args.dispatch_key, "rb") as f:
+        dispatch_key = f.read()
+    seeds = load_seeds(args.seeds)
+    shards = max(args.jobs, 1)
+
+    stats = Stats()
+    arguments = (args.new_version, args.old_version, seeds, dispatch_key, args.decode)
+    if shards == 1:
+        stats.merge(decode_shard(args.captures, 0, 1, *arguments))
+    else:
+        with ProcessPoolExecutor(shards) as executor:
+            futures = [executor.submit(decode_shard, args.captures, shard, shards, *arguments)
+                       for shard in range(shards)]
+            for future in futures:
+                stats.merge(future.result())
+
+    names = {NEW: read_cmdid(args.new_version), OLD: read_cmdid(args.old_version)}
+    result = report(stats, names)
+    with open(args.report, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2)
+
+    print(f"{result['sessions']} sessions, {result['datagrams']} datagrams, {result['frames']} packets, "
+          f"{result['undecryptable']} datagrams without a session key, {result['packets']} proxy captured packets")
+    print(f"{'version':>8}{'opcode':>8}  {'name':40}{'count':>10}{'mean':>10}{'max':>10}")
+    for entry in result["opcodes"][:args.top]:
+        print(f"{entry['version']:>8}{entry['opcode']:>8}  {entry['name']:40}{entry['count']:>10}"
+              f"{entry['mean']:>10}{entry['max']:>10}")
+    print("Report written to " + args.report)
+
+
+if __name__ == "__main__":
+    main()
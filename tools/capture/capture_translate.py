@@ -0,0 +1,375 @@
+"""
+Translate recorded sessions to the other protocol version offline, at the wire level: opcodes,
+field numbers and enum values are rewritten the way the generated translators pair them, without
+building messages.
+
+    python capture_translate.py <new version> <old version> <capture>... --to old|new [--output out.cap]
+
+Every packet of the captures comes out as a PACKET record in the target version, decrypted,
+with the uid of its session when the login was seen. Datagrams are decrypted and split the way
+capture_decoder.py does. Fields are paired by name and type as protojson2javaex.py pairs them,
+opcodes by name and the reviewed renames of message_map.json. Types encoded identically in
+both versions are copied as they are, whole payloads included.
+
+Sessions are spread over a process pool, each worker streams the captures and writes its
+sessions to a part of the output, the parts are joined at the end. Packets keep their order
+within a session.
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from capture import (DATAGRAM, FILE_HEADER, FORMAT, MAGIC, NEW, OLD, PACKET, PACKET_HEADER, Capture, CaptureWriter,
+                     load_seeds, split_frames, split_packet)
+from capture_decoder import DISPATCH_KEY_FILE, SessionKeys, Version, read_cmdid
+
+sys.path.insert(0, os.path.join("..", "protojson2java"))
+from messageMatch import load_message_map  # noqa: E402
+from protoSchema import SCALAR_TYPES, enum_table, find_message, find_type, same_fields, same_wire, short_name  # noqa: E402
+
+MESSAGE_MAP = os.path.join("..", "protojson2java", "message_map.json")
+
+VARINT, FIXED64, DELIMITED, FIXED32 = 0, 1, 2, 5
+
+# Field actions
+COPY, ENUM, MESSAGE, MAP = range(4)
+IDENTITY = "identity"
+
+
+def put_varint(out, value):
+    while value > 0x7F:
+        out.append(value & 0x7F | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def varint(value):
+    out = bytearray()
+    put_varint(out, value)
+    return bytes(out)
+
+
+def read_varint(data, offset):
+    value = 0
+    shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, offset
+        shift += 7
+
+
+def remap_enum(table, value):
+    # Enum values are int32, negative ones take ten bytes on the wire
+    if value >= 1 << 63:
+        value -= 1 << 64
+    return table.get(value, value) & 0xFFFFFFFFFFFFFFFF
+
+
+class Translator:
+    # Field plans from one schema to the other, built on first use and cached per message pair
+
+    def __init__(self, src, dst):
+        self.src = src
+        self.dst = dst
+        self.plans = {}
+        self.wire_memo = {}
+
+    def plan(self, src_name, dst_name):
+        # IDENTITY when both encode the message alike, else {source number: action}, None if a side lacks it
+        key = (src_name, dst_name)
+        if key in self.plans:
+            return self.plans[key]
+        src = find_message(self.src, src_name)
+        dst = find_message(self.dst, dst_name)
+        if src is None or dst is None:
+            self.plans[key] = None
+            return None
+        if src_name == dst_name:
+            same = same_wire(src_name, self.src, self.dst, self.wire_memo)
+        else:
+            same = same_fields(src, dst, self.src, self.dst, self.wire_memo)
+        if same:
+            self.plans[key] = IDENTITY
+            return IDENTITY
+
+        plan = self.plans[key] = {}  # filled after, recursive types find it
+        for field in src.fields:
+            other = self.pair(field, dst.fields)
+            if other is not None:
+                action = self.action(field, other)
+                if action is not None:
+                    plan[field.number] = action
+        return plan
+
+    @staticmethod
+    def pair(field, fields):
+        # Same name, type and kind of field, as the generated translators pair them
+        single = field.label in ("optional", "oneof")
+        for other in fields:
+            if other.name == field.name and short_name(other.type) == short_name(field.type) \
+                    and (other.label in ("optional", "oneof") if single else other.label == field.label) \
+                    and other.key == field.key:
+                return other
+        return None
+
+    def tags(self, number):
+        return {wire_type: varint(number << 3 | wire_type) for wire_type in (VARINT, FIXED64, DELIMITED, FIXED32)}
+
+    def value_action(self, type):
+        # (action, argument) for a value of the type, None if it can't be carried over
+        if type in SCALAR_TYPES:
+            return COPY, None
+        name = short_name(type)
+        kind, src = find_type(self.src, name)
+        dst_kind, dst = find_type(self.dst, name)
+        if kind is None or kind != dst_kind:
+            return None
+        if kind == "enum":
+            table = enum_table(src, dst)
+            return (COPY, None) if table is None else (ENUM, table)
+        plan = self.plan(name, name)
+        if plan is None:
+            return None
+        return (COPY, None) if plan is IDENTITY else (MESSAGE, (name, name))
+
+    def action(self, field, other):
+        # (action, tags by wire type, argument)
+        tags = self.tags(other.number)
+        if field.label == "map":
+            value = self.value_action(field.type)
+            if value is None:
+                return None
+            if value[0] == COPY:
+                return COPY, tags, None
+            return MAP, tags, self.entry_plan(value)
+        value = self.value_action(field.type)
+        if value is None:
+            return None
+        return value[0], tags, value[1]
+
+    def translate(self, plan, data):
+        if plan is IDENTITY:
+            return data
+        out = bytearray()
+        offset = 0
+        size = len(data)
+        while offset < size:
+            tag = data[offset]
+            offset += 1
+            if tag > 0x7F:
+                tag, offset = read_varint(data, offset - 1)
+            wire_type = tag & 7
+            start = offset
+            if wire_type == VARINT:
+                while data[offset] > 0x7F:
+                    offset += 1
+                offset += 1
+            elif wire_type == DELIMITED:
+                length = data[offset]
+                offset += 1
+                if length > 0x7F:
+                    length, offset = read_varint(data, offset - 1)
+                start = offset
+                offset += length
+            elif wire_type == FIXED64:
+                offset += 8
+            elif wire_type == FIXED32:
+                offset += 4
+            else:
+                raise ValueError("wire type " + str(wire_type))
+            if offset > size:
+                raise ValueError("truncated field")
+
+            action = plan.get(tag >> 3)
+            if action is None:
+                continue
+            kind, tags, argument = action
+            if kind >= MESSAGE and wire_type != DELIMITED:
+                raise ValueError("field " + str(tag >> 3) + " is not length delimited")
+            if kind == ENUM and wire_type != VARINT and wire_type != DELIMITED:
+                raise ValueError("enum field " + str(tag >> 3) + " is neither a varint nor packed")
+            out += tags[wire_type]
+            if kind == COPY:
+                if wire_type == DELIMITED:
+                    put_varint(out, offset - start)
+                out += data[start:offset]
+            elif kind == ENUM:
+                if wire_type == VARINT:
+                    put_varint(out, remap_enum(argument, read_varint(data, start)[0]))
+                else:
+                    # packed
+                    packed = bytearray()
+                    position = start
+                    while position < offset:
+                        value, position = read_varint(data, position)
+                        put_varint(packed, remap_enum(argument, value))
+                    put_varint(out, len(packed))
+                    out += packed
+            elif kind == MESSAGE:
+                value = self.translate(self.plans[argument], data[start:offset])
+                put_varint(out, len(value))
+                out += value
+            else:
+                value = self.translate(argument, data[start:offset])
+                put_varint(out, len(value))
+                out += value
+        return bytes(out)
+
+    def entry_plan(self, value):
+        # Map entries keep the key in 1 and translate the value in 2
+        return {1: (COPY, self.tags(1), None), 2: (value[0], self.tags(2), value[1])}
+
+
+class Opcodes:
+    # Source opcode -> (target opcode, plan) of one direction of translation
+
+    def __init__(self, src, dst, renames):
+        self.src = src
+        self.dst = dst
+        self.translator = Translator(src.schema, dst.schema)
+        self.renames = renames  # source name -> target name
+        self.targets = {name: opcode for opcode, name in dst.names.items()}
+        self.cache = {}
+
+    def get(self, opcode):
+        entry = self.cache.get(opcode)
+        if entry is None:
+            entry = self.cache[opcode] = self.resolve(opcode)
+        return entry
+
+    def resolve(self, opcode):
+        name = self.src.names.get(opcode)
+        if name is None:
+            return None
+        target = self.renames.get(name, name)
+        if target not in self.targets:
+            return None
+        plan = self.translator.plan(name, target)
+        return None if plan is None else (self.targets[target], plan)
+
+
+def translate_shard(paths, output, shard, shards, new_version, old_version, target, renames, seeds, dispatch_key):
+    versions = {NEW: Version(new_version, "new")}
+    versions[OLD] = versions[NEW] if new_version == old_version else Version(old_version, "old")
+    source = OLD if target == NEW else NEW
+    opcodes = Opcodes(versions[source], versions[target], renames)
+    keys = SessionKeys(dispatch_key, seeds)
+    counters = {"packets": 0, "translated": 0, "copied": 0, "passed": 0, "unmatched": 0, "malformed": 0,
+                "undecryptable": 0, "bytes_in": 0, "bytes_out": 0}
+
+    def packet(writer, direction, version, timestamp, session, uid, opcode, header, payload):
+        counters["packets"] += 1
+        counters["bytes_in"] += len(payload)
+        if version == target:
+            counters["passed"] += 1
+        else:
+            entry = opcodes.get(opcode)
+            if entry is None:
+                counters["unmatched"] += 1
+                return
+            opcode, plan = entry
+            try:
+                payload = opcodes.translator.translate(plan, payload)
+            except (ValueError, IndexError):
+                counters["malformed"] += 1
+                return
+            counters["copied" if plan is IDENTITY else "translated"] += 1
+        counters["bytes_out"] += len(payload)
+        writer.write(PACKET, direction, target, timestamp, session,
+                     PACKET_HEADER.pack(uid, opcode, 0, len(header), len(payload), 0) + header + payload)
+
+    with CaptureWriter(output + "." + str(shard)) as writer:
+        for path in paths:
+            with Capture(path) as capture:
+                for kind, direction, version, timestamp, session, body in capture.records():
+                    if session % shards != shard:
+                        continue
+                    if kind == PACKET:
+                        uid, opcode, forwarded, header, payload, translated = split_packet(body)
+                        if opcode:
+                            packet(writer, direction, version, timestamp, session, uid, opcode, bytes(header),
+                                   bytes(payload))
+                        else:
+                            # Sent by the proxy itself, only in the forwarded version
+                            packet(writer, direction, 3 - version, timestamp, session, uid, forwarded,
+                                   bytes(header), bytes(translated))
+                        continue
+                    if kind != DATAGRAM or len(body) < 2:
+                        continue
+                    data = keys.decrypt(session, body)[1]
+                    if data is None:
+                        counters["undecryptable"] += 1
+                        continue
+                    for opcode, header, payload in split_frames(data)[0]:
+                        payload = bytes(payload)
+                        keys.learn(session, versions[version], opcode, payload)
+                        packet(writer, direction, version, timestamp, session, keys.uids.get(session, 0), opcode,
+                               bytes(header), payload)
+    return counters
+
+
+def join_parts(output, shards):
+    # The parts' records follow one file header
+    with open(output, "wb") as out:
+        out.write(FILE_HEADER.pack(MAGIC, FORMAT))
+        for shard in range(shards):
+            part = output + "." + str(shard)
+            with open(part, "rb") as f:
+                f.seek(FILE_HEADER.size)
+                shutil.copyfileobj(f, out, 1 << 20)
+            os.remove(part)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("new_version")
+    parser.add_argument("old_version")
+    parser.add_argument("captures", nargs="+")
+    parser.add_argument("--to", choices=("new", "old"), required=True, help="version to translate to")
+    parser.add_argument("--output", default="translated.cap")
+    parser.add_argument("--message-map", default=MESSAGE_MAP, help="reviewed renames, written by messageMatch.py")
+    parser.add_argument("--seeds", nargs="*", help="proxy logs with the session key seeds HandleLogin logged")
+    parser.add_argument("--dispatch-key", default=DISPATCH_KEY_FILE)
+    parser.add_argument("--jobs", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    with open(args.dispatch_key, "rb") as f:
+        dispatch_key = f.read()
+    seeds = load_seeds(args.seeds)
+
+    new_names = read_cmdid(args.new_version)
+    old_names = read_cmdid(args.old_version)
+    renames = load_message_map(args.message_map, new_names.values(), old_names.values())
+    target = NEW if args.to == "new" else OLD
+    if target == NEW:
+        renames = {old: new for new, old in renames.items()}
+
+    start = time.perf_counter()
+    shards = max(args.jobs, 1)
+    arguments = (args.new_version, args.old_version, target, renames, seeds, dispatch_key)
+    if shards == 1:
+        results = [translate_shard(args.captures, args.output, 0, 1, *arguments)]
+    else:
+        with ProcessPoolExecutor(shards) as executor:
+            futures = [executor.submit(translate_shard, args.captures, args.output, shard, shards, *arguments)
+                       for shard in range(shards)]
+            results = [future.result() for future in futures]
+    join_parts(args.output, shards)
+    seconds = time.perf_counter() - start
+
+    counters = {name: sum(result[name] for result in results) for name in results[0]}
+    print(json.dumps(counters))
+    print(f"{counters['packets']} packets in {seconds:.1f}s, {counters['packets'] / seconds * 60:,.0f} per minute, "
+          f"{counters['unmatched']} without a counterpart in {args.to}, written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
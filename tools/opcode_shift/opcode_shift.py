@@ -3,6 +3,8 @@ import json
 from os import path
 import sys
 
+PACKET_DIR = path.join("..", "..", "src", "main", "java", "emu", "protoshift", "net", "packet")
+
 
 def readCmdidCsv(csvpath):
     if not path.exists(csvpath):
@@ -53,7 +55,7 @@ def generatePython(cmdid):
 
 
 if sys.argv[1] == sys.argv[2]:
-    protopath = f"..\\..\\proto\\{sys.argv[1]}\\"
+    protopath = path.join("..", "..", "proto", sys.argv[1], "")
 
     cmdid1 = readCmdidCsv(f"{protopath}cmdid.csv")
     cmdid2 = readCmdidJson(f"{protopath}cmdid.json")
@@ -66,8 +68,8 @@ if sys.argv[1] == sys.argv[2]:
         print("cmdid.csv, cmdid.json or packetIds.json not found")
         exit(1)
 else:
-    oldpath = f"..\\..\\proto\\{sys.argv[1]}\\"
-    newpath = f"..\\..\\proto\\{sys.argv[2]}\\"
+    oldpath = path.join("..", "..", "proto", sys.argv[1], "")
+    newpath = path.join("..", "..", "proto", sys.argv[2], "")
 
     newcmdid1, oldcmdid1 = readCmdidCsv(f"{oldpath}cmdid.csv"), readCmdidCsv(
         f"{newpath}cmdid.csv"
@@ -91,7 +93,7 @@ else:
 
 
 with open(
-    "..\\..\\src\\main\\java\\emu\\protoshift\\net\\packet\\PacketOpcodes.java",
+    path.join(PACKET_DIR, "PacketOpcodes.java"),
     "w",
     encoding="utf-8",
 ) as file:
@@ -138,7 +140,7 @@ public class PacketOpcodes {
     )
 
 with open(
-    "..\\..\\src\\main\\java\\emu\\protoshift\\net\\packet\\PacketOpcodesUtil.java",
+    path.join(PACKET_DIR, "PacketOpcodesUtil.java"),
     "w",
     encoding="utf-8",
 ) as file:
@@ -174,6 +176,14 @@ public class PacketOpcodesUtil {
     public static String getOpcodeName(PacketOpcodes opcode) {
         if (opcode.value <= 0) return "UNKNOWN";
         return opcodeMap.getOrDefault(opcode.value, "UNKNOWN");
+    }
+
+    public static int getOpcodeValue(String name, int type) {
+        for (var entry : opcodeMap.entrySet()) {
+            if (entry.getValue().equals(name))
+                return entry.getKey();
+        }
+        return 0;
     }"""
             if sys.argv[1] == sys.argv[2]
             else """
@@ -188,6 +198,14 @@ public class PacketOpcodesUtil {
     public static String getOpcodeName(PacketOpcodes opcode) {
         if (opcode.value <= 0) return "UNKNOWN";
         return opcode.type == 1 ? newopcodeMap.getOrDefault(opcode.value, "UNKNOWN") : oldopcodeMap.getOrDefault(opcode.value, "UNKNOWN");
+    }
+
+    public static int getOpcodeValue(String name, int type) {
+        for (var entry : (type == 1 ? newopcodeMap : oldopcodeMap).entrySet()) {
+            if (entry.getValue().equals(name))
+                return entry.getKey();
+        }
+        return 0;
     }"""
         )
         + """
@@ -196,7 +214,7 @@ public class PacketOpcodesUtil {
     )
 
 if sys.argv[1] != sys.argv[2]:
-    with open("..\\protojson2java\\cmdIdList.py", "w") as file:
+    with open(path.join("..", "protojson2java", "cmdIdList.py"), "w") as file:
         file.write(
             "newcmdList=["
             + generatePython(newcmdid)
@@ -0,0 +1,5 @@
+module emu.protoshift/proto2json
+
+go 1.18
+
+require github.com/yoheimuta/go-protoparser/v4 v4.9.0
@@ -10,91 +10,65 @@ import (
 	protoparser "github.com/yoheimuta/go-protoparser/v4"
 )
 
-const (
-	PROTO_DIR  = "..\\..\\proto\\"
-	OUTPUT_DIR = ".\\output\\"
+var (
+	PROTO_DIR  = filepath.Join("..", "..", "proto")
+	OUTPUT_DIR = filepath.Join(".", "output")
 )
 
-func main() {
+// Parse every proto of a version into OUTPUT_DIR/side
+func convert(version string, side string) {
+	output := filepath.Join(OUTPUT_DIR, side)
 
-	err4 := os.RemoveAll(OUTPUT_DIR)
-	if err4 != nil {
+	err := os.RemoveAll(output)
+	if err != nil {
 		return
 	}
 
-	os.Mkdir(OUTPUT_DIR, 0777)
-	os.Mkdir(OUTPUT_DIR+"new\\", 0777)
-	os.Mkdir(OUTPUT_DIR+"old\\", 0777)
+	os.MkdirAll(output, 0777)
 
-	{
-		var files []string
+	var files []string
 
-		err := filepath.Walk(PROTO_DIR+os.Args[1]+"\\proto\\", func(path string, info os.FileInfo, err error) error {
-			if info.IsDir() {
-				return nil
-			}
-			files = append(files, path)
+	err = filepath.Walk(filepath.Join(PROTO_DIR, version, "proto"), func(path string, info os.FileInfo, err error) error {
+		if info.IsDir() {
 			return nil
-		})
+		}
+		files = append(files, path)
+		return nil
+	})
+	if err != nil {
+		panic(err)
+	}
+	for _, file := range files {
+		reader, err := os.Open(file)
 		if err != nil {
-			panic(err)
+			fmt.Fprintf(os.Stderr, "failed to open %s, err %v\n", file, err)
+			return
 		}
-		for _, file := range files {
-			reader, err := os.Open(file)
-			if err != nil {
-				fmt.Fprintf(os.Stderr, "failed to open %s, err %v\n", file, err)
-				return
-			}
-			defer reader.Close()
-
-			got, err := protoparser.Parse(reader)
-			if err != nil {
-				fmt.Fprintf(os.Stderr, "failed to parse %s, err %v\n", file, err)
-				return
-			}
+		defer reader.Close()
 
-			gotJSON, err := json.MarshalIndent(got, "", "  ")
-			if err != nil {
-				fmt.Fprintf(os.Stderr, "failed to marshal, err %v\n", err)
-			}
-			var filenameWithSuffix = filepath.Base(file)
-			os.WriteFile(OUTPUT_DIR+"new\\"+strings.TrimSuffix(filenameWithSuffix, filepath.Ext(filenameWithSuffix))+".json", gotJSON, 0644)
+		got, err := protoparser.Parse(reader)
+		if err != nil {
+			fmt.Fprintf(os.Stderr, "failed to parse %s, err %v\n", file, err)
+			return
 		}
-	}
 
-	{
-		var files []string
-
-		err := filepath.Walk(PROTO_DIR+os.Args[2]+"\\proto\\", func(path string, info os.FileInfo, err error) error {
-			if info.IsDir() {
-				return nil
-			}
-			files = append(files, path)
-			return nil
-		})
+		gotJSON, err := json.MarshalIndent(got, "", "  ")
 		if err != nil {
-			panic(err)
+			fmt.Fprintf(os.Stderr, "failed to marshal, err %v\n", err)
 		}
-		for _, file := range files {
-			reader, err := os.Open(file)
-			if err != nil {
-				fmt.Fprintf(os.Stderr, "failed to open %s, err %v\n", file, err)
-				return
-			}
-			defer reader.Close()
-
-			got, err := protoparser.Parse(reader)
-			if err != nil {
-				fmt.Fprintf(os.Stderr, "failed to parse, err %v\n", err)
-				return
-			}
+		var filenameWithSuffix = filepath.Base(file)
+		os.WriteFile(filepath.Join(output, strings.TrimSuffix(filenameWithSuffix, filepath.Ext(filenameWithSuffix))+".json"), gotJSON, 0644)
+	}
+}
 
-			gotJSON, err := json.MarshalIndent(got, "", "  ")
-			if err != nil {
-				fmt.Fprintf(os.Stderr, "failed to marshal, err %v\n", err)
-			}
-			var filenameWithSuffix = filepath.Base(file)
-			os.WriteFile(OUTPUT_DIR+"old\\"+strings.TrimSuffix(filenameWithSuffix, filepath.Ext(filenameWithSuffix))+".json", gotJSON, 0644)
-		}
+// proto2json <new version> <old version>
+// proto2json <version> new|old, to parse the two versions in separate processes
+func main() {
+	if os.Args[2] == "new" || os.Args[2] == "old" {
+		convert(os.Args[1], os.Args[2])
+		return
 	}
+
+	convert(os.Args[1], "new")
+	convert(os.Args[2], "old")
 }
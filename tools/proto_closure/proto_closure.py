@@ -0,0 +1,126 @@
+import argparse
+import os
+import re
+import shutil
+import subprocess
+import time
+
+ROOT_DIR = os.path.join("..", "..")
+PROTO_DIR = os.path.join(ROOT_DIR, "proto")
+JAVA_DIR = os.path.join(ROOT_DIR, "src", "main", "java")
+OUTPUT_DIR = os.path.join(ROOT_DIR, "src", "generated")
+CMDID_LIST = os.path.join("..", "protojson2java", "cmdIdList.py")
+
+# Every generated or hand-written reference to a proto class goes through its outer class,
+# named after the .proto file it is generated from
+OUTER_CLASS = re.compile(r"emu\.protoshift\.net\.(proto|newproto|oldproto)\.(\w+)OuterClass")
+IMPORT = re.compile(r'^\s*import\s+(?:public\s+|weak\s+)?"([^"]+)"\s*;', re.M)
+
+
+def find_roots(java_dir):
+    roots = {"proto": set(), "newproto": set(), "oldproto": set()}
+    for dirpath, _, filenames in os.walk(java_dir):
+        for filename in filenames:
+            if not filename.endswith(".java"):
+                continue
+            with open(os.path.join(dirpath, filename), "r", encoding="utf-8") as f:
+                for package, name in OUTER_CLASS.findall(f.read()):
+                    roots[package].add(name + ".proto")
+    return roots
+
+
+def load_fallback(path):
+    # Messages known to both versions, translated at runtime when their handler was trimmed
+    if not os.path.exists(path):
+        return set()
+    lists = {}
+    with open(path, "r") as f:
+        exec(f.read(), lists)
+    return set(lists["newcmdList"]) & set(lists["oldcmdList"])
+
+
+def closure(proto_dir, roots):
+    # Types can only be referenced through imports, so the import closure covers them too
+    files, missing = set(), set()
+    pending = list(roots)
+    while pending:
+        name = pending.pop()
+        if name in files or name in missing:
+            continue
+        path = os.path.join(proto_dir, name)
+        if not os.path.exists(path):
+            missing.add(name)
+            continue
+        files.add(name)
+        with open(path, "r", encoding="utf-8") as f:
+            pending.extend(IMPORT.findall(f.read()))
+    return files, missing
+
+
+def find_protoc():
+    for path in (os.path.join("..", "protoc", "protoc.exe"), os.path.join("..", "protoc", "protoc")):
+        if os.path.exists(path):
+            return path
+    return shutil.which("protoc")
+
+
+def compile_protos(protoc, version, proto_dir, files):
+    # One protoc run per version, the file list goes through a response file to stay
+    # clear of the command line length limit
+    argfile = os.path.join(OUTPUT_DIR, f".{version}.protoc_args")
+    with open(argfile, "w", encoding="utf-8") as f:
+        f.write(f"-I={proto_dir}\n--java_out={OUTPUT_DIR}\n")
+        for name in sorted(files):
+            f.write(os.path.join(proto_dir, name) + "\n")
+    try:
+        return subprocess.run([protoc, "@" + argfile]).returncode
+    finally:
+        os.remove(argfile)
+
+
+parser = argparse.ArgumentParser(description="Compile only the protos the proxy references.")
+parser.add_argument("new_version")
+parser.add_argument("old_version")
+parser.add_argument("--only", choices=["new", "old"],
+                    help="compile a single version, to run the two in parallel")
+parser.add_argument("--fallback", action="store_true",
+                    help="also compile every shared message, for the handlers --trim left to the generic translator")
+args = parser.parse_args()
+
+protoc = find_protoc()
+if protoc is None:
+    print("protoc not found")
+    exit(1)
+
+os.makedirs(OUTPUT_DIR, exist_ok=True)
+
+roots = find_roots(JAVA_DIR)
+fallback = set()
+if args.new_version == args.old_version:
+    versions = [("proto", args.new_version, roots["proto"] | roots["newproto"])]
+else:
+    if args.fallback:
+        fallback = {name + ".proto" for name in load_fallback(CMDID_LIST)}
+    versions = [
+        ("newproto", args.new_version, roots["newproto"] | fallback),
+        ("oldproto", args.old_version, roots["oldproto"] | fallback),
+    ]
+    if args.only is not None:
+        versions = [versions[0 if args.only == "new" else 1]]
+
+for package, version, version_roots in versions:
+    proto_dir = os.path.join(PROTO_DIR, version, "proto")
+    # Drop classes of protos no longer referenced
+    shutil.rmtree(os.path.join(OUTPUT_DIR, "emu", "protoshift", "net", package), ignore_errors=True)
+    start = time.perf_counter()
+    files, missing = closure(proto_dir, version_roots)
+    total = len([name for name in os.listdir(proto_dir) if name.endswith(".proto")])
+    for name in sorted(missing - fallback):
+        print(f"WARNING: {version}: {name} not found")
+    if not files:
+        print(f"{version}: nothing to compile")
+        continue
+    if compile_protos(protoc, version, proto_dir, files) != 0:
+        print(f"{version}: protoc failed")
+        exit(1)
+    print(f"{version}: compiled {len(files)} of {total} protos in {time.perf_counter() - start:.2f}s")
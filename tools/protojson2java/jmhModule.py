@@ -0,0 +1,259 @@
+import shutil
+from os import makedirs
+from os.path import exists, join
+
+from packetDirection import RECV, SEND, traffic
+
+BENCH_DIR = join("..", "..", "bench", "")
+BENCH_SOURCE_DIR = join(BENCH_DIR, "src", "jmh", "java", "emu", "protoshift", "bench", "")
+
+
+def select_benchmarks(recv_list, send_list, old_name, profile, top):
+    # "recv:Name" and "send:Name[:OldName]", the busiest first when there is traffic
+    entries = [(traffic(profile, RECV, i), RECV + ":" + i) for i in recv_list]
+    entries += [
+        (
+            traffic(profile, SEND, i, old_name(i)),
+            SEND + ":" + i + ("" if old_name(i) == i else ":" + old_name(i)),
+        )
+        for i in send_list
+    ]
+    entries.sort(key=lambda entry: -entry[0])
+    if top:
+        entries = entries[:top]
+    return [key for count, key in entries]
+
+
+def write_jmh_module(class_name, description, benchmarks):
+    # A gradle subproject settings.gradle picks up when present, rewritten on every run
+    if exists(BENCH_DIR):
+        shutil.rmtree(BENCH_DIR)
+    makedirs(BENCH_SOURCE_DIR)
+
+    with open(BENCH_DIR + "build.gradle", "w", encoding="utf-8") as file:
+        file.write(
+            """// Generated by tools/protojson2java, run with: gradlew :bench:jmh
+// Payloads come from tools/benchmark/payload_corpus.py, written to tools/benchmark/corpus.bin
+
+plugins {
+    id 'java'
+    id 'me.champeau.jmh' version '0.7.2'
+}
+
+compileJmhJava.options.encoding = "UTF-8"
+
+repositories {
+    mavenCentral()
+}
+
+dependencies {
+    jmh rootProject
+    jmh fileTree(dir: '../lib', include: ['*.jar'])
+    jmh group: 'com.google.protobuf', name: 'protobuf-java', version: '3.22.2'
+}
+
+jmh {
+    benchmarkMode = ['thrpt']
+    timeUnit = 's'
+    // gc.alloc.rate.norm is the bytes allocated per translation
+    profilers = ['gc']
+    fork = 1
+    warmupIterations = 3
+    iterations = 5
+    resultFormat = 'JSON'
+    jvmArgsAppend = ['-Dprotoshift.corpus=' + rootProject.file('tools/benchmark/corpus.bin'),
+                     '-Dprotoshift.schemaDiff=' + rootProject.file('schema_diff.bin')]
+}
+"""
+        )
+
+    with open(BENCH_SOURCE_DIR + "PayloadCorpus.java", "w", encoding="utf-8") as file:
+        file.write(
+            """package emu.protoshift.bench;
+
+import java.io.IOException;
+import java.nio.ByteBuffer;
+import java.nio.ByteOrder;
+import java.nio.channels.FileChannel;
+import java.nio.charset.StandardCharsets;
+import java.nio.file.Path;
+import java.nio.file.StandardOpenOption;
+import java.util.ArrayList;
+import java.util.List;
+
+/*
+ * Reads the corpus written by tools/benchmark/payload_corpus.py. Only the index is mapped,
+ * payloads are read where they lie, so corpora over 2 GB work too.
+ */
+public final class PayloadCorpus {
+    private static final String MAGIC = "PSCORPUS";
+    private static final int FORMAT = 1;
+    private static final int ENTRY_SIZE = 20;
+    private static final int FOOTER_SIZE = 24;
+
+    public static List<byte[]> payloads(Path path, int opcode, int version) throws IOException {
+        try (var channel = FileChannel.open(path, StandardOpenOption.READ)) {
+            var header = read(channel, 0, 12);
+            var footer = read(channel, channel.size() - FOOTER_SIZE, FOOTER_SIZE);
+            if (!magic(header, 0) || !magic(footer, 16))
+                throw new IOException(path + " is not a payload corpus");
+            if (header.getInt(8) != FORMAT)
+                throw new IOException(path + " has corpus format " + header.getInt(8) + ", expected " + FORMAT);
+
+            long indexOffset = footer.getLong(0);
+            long entries = footer.getLong(8);
+            var index = channel.map(FileChannel.MapMode.READ_ONLY, indexOffset, entries * ENTRY_SIZE)
+                    .order(ByteOrder.LITTLE_ENDIAN);
+            var result = new ArrayList<byte[]>();
+            for (int i = 0; i < entries; i++) {
+                int position = i * ENTRY_SIZE;
+                if (index.getInt(position) == opcode && index.getInt(position + 4) == version)
+                    result.add(read(channel, index.getLong(position + 8), index.getInt(position + 16)).array());
+            }
+            return result;
+        }
+    }
+
+    private static ByteBuffer read(FileChannel channel, long position, int length) throws IOException {
+        var buffer = ByteBuffer.allocate(length).order(ByteOrder.LITTLE_ENDIAN);
+        while (buffer.hasRemaining()) {
+            if (channel.read(buffer, position + buffer.position()) < 0)
+                throw new IOException("Truncated payload corpus");
+        }
+        return buffer.flip();
+    }
+
+    private static boolean magic(ByteBuffer buffer, int offset) {
+        var bytes = new byte[MAGIC.length()];
+        buffer.get(offset, bytes);
+        return new String(bytes, StandardCharsets.US_ASCII).equals(MAGIC);
+    }
+}
+"""
+        )
+
+    write_benchmark(
+        class_name,
+        description
+        + """, one run per opcode and direction.
+ * Generated with the translators, --jmh-top limits it to the busiest opcodes of the traffic profile.""",
+        benchmarks,
+        ["GenericTranslator"],
+        """import java.util.HashMap;
+import java.util.Map;
+""",
+        """
+    private static PacketHandler findHandler(boolean isRecv, String name, int value) throws Exception {
+        // A class per handler, or the grouped translators, or the generic one for trimmed opcodes
+        try {
+            return (PacketHandler) Class.forName("emu.protoshift.server.packet." + (isRecv ? "recv" : "send") + ".Handler" + name)
+                    .getDeclaredConstructor().newInstance();
+        } catch (ClassNotFoundException ignored) {
+        }
+        try {
+            Map<Integer, PacketHandler> newHandlers = new HashMap<>(), oldHandlers = new HashMap<>();
+            Class.forName("emu.protoshift.server.packet.Translators")
+                    .getMethod("register", Map.class, Map.class).invoke(null, newHandlers, oldHandlers);
+            var handler = (isRecv ? newHandlers : oldHandlers).get(value);
+            if (handler != null)
+                return handler;
+        } catch (ClassNotFoundException ignored) {
+        }
+        return GenericTranslator.get(new PacketOpcodes(value, isRecv ? 1 : 2));
+    }
+""",
+    )
+    # The same opcodes through schema_diff.bin, to compare with the generated translators above
+    write_benchmark(
+        "SchemaDiffTranslatorBenchmark",
+        """Wire level translation by the plans of schema_diff.bin, as SchemaDiffTranslator serves them,
+ * for the opcodes of """
+        + class_name
+        + """. Build with generateproto.py --schema-diff to write the file.""",
+        benchmarks,
+        ["SchemaDiff"],
+        "",
+        """
+    private static PacketHandler findHandler(boolean isRecv, String name, int value) throws Exception {
+        var diff = SchemaDiff.load(Path.of(System.getProperty("protoshift.schemaDiff", "schema_diff.bin")));
+        return diff.translator(new PacketOpcodes(value, isRecv ? 1 : 2));
+    }
+""",
+    )
+    print(
+        "JMH module with "
+        + str(len(benchmarks))
+        + " benchmarks for the generated translators and SchemaDiffTranslator written to "
+        + BENCH_DIR
+        + ", run it with gradlew :bench:jmh"
+    )
+
+
+def write_benchmark(class_name, description, benchmarks, imports, util_imports, find_handler):
+    with open(BENCH_SOURCE_DIR + class_name + ".java", "w", encoding="utf-8") as file:
+        file.write(
+            """package emu.protoshift.bench;
+
+"""
+            + "".join("import emu.protoshift.net.packet." + name + ";\n"
+                      for name in sorted(imports + ["PacketHandler", "PacketOpcodes"]))
+            + """
+import org.openjdk.jmh.annotations.*;
+
+import java.nio.file.Path;
+"""
+            + util_imports
+            + """import java.util.concurrent.TimeUnit;
+
+/*
+ * """
+            + description
+            + """
+ */
+@State(Scope.Thread)
+@BenchmarkMode(Mode.Throughput)
+@OutputTimeUnit(TimeUnit.SECONDS)
+public class """
+            + class_name
+            + """ {
+    // "recv:Name" or "send:Name[:OldName]", Name is the handler's
+    @Param({"""
+            + ",".join('\n            "' + key + '"' for key in benchmarks)
+            + """
+    })
+    public String opcode;
+
+    private PacketHandler handler;
+    private byte[][] payloads;
+    private int next;
+
+    @Setup(Level.Trial)
+    public void setup() throws Exception {
+        var key = opcode.split(":");
+        boolean isRecv = key[0].equals("recv");
+        String name = key[1];
+        int value = (isRecv ? PacketOpcodes.newOpcodes.class : PacketOpcodes.oldOpcodes.class)
+                .getField(key.length > 2 ? key[2] : name).getInt(null);
+
+        handler = findHandler(isRecv, name, value);
+        if (handler == null)
+            throw new IllegalStateException("No translator for " + opcode);
+
+        var corpus = Path.of(System.getProperty("protoshift.corpus", "corpus.bin"));
+        payloads = PayloadCorpus.payloads(corpus, value, isRecv ? 1 : 2).toArray(new byte[0][]);
+        if (payloads.length == 0)
+            throw new IllegalStateException("No payloads for " + opcode + " in " + corpus
+                    + ", write them with tools/benchmark/payload_corpus.py");
+    }
+"""
+            + find_handler
+            + """
+    @Benchmark
+    public byte[] translate() throws Exception {
+        var payload = payloads[next];
+        next = next + 1 == payloads.length ? 0 : next + 1;
+        return handler.handle(payload).getData();
+    }
+}
+"""
+        )
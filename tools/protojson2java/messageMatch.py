@@ -0,0 +1,190 @@
+import argparse
+import json
+from os import listdir
+from os.path import exists, join, splitext
+
+from protoSchema import SCALAR_TYPES, new_schema, find_type
+
+PROTOJSON_NEW_DIR = join("..", "proto2json", "output", "new", "")
+PROTOJSON_OLD_DIR = join("..", "proto2json", "output", "old", "")
+MESSAGE_MAP = "message_map.json"
+
+# Field names decide what survives the JSON translation, so they weigh as much as the shape
+SHAPE_WEIGHT = 1.0
+NUMBER_WEIGHT = 0.5
+NAME_WEIGHT = 1.0
+
+# Features carried by more than this share of the candidates don't propose pairs on their own
+COMMON_FEATURE = 0.2
+
+
+def category(name):
+    for suffix in ("Req", "Rsp", "Notify"):
+        if name.endswith(suffix):
+            return suffix
+    return ""
+
+
+def type_kind(schema, type, depth):
+    if type in SCALAR_TYPES:
+        return type
+    kind, value = find_type(schema, type)
+    if kind == "enum":
+        return "enum"
+    if kind != "message":
+        return "?"
+    if depth == 0:
+        return "message"
+    # Nested messages are described by their own shape, their names may have changed too
+    return "message(" + ",".join(
+        sorted(key.label + " " + type_kind(schema, key.type, depth - 1) for key in value.fields)
+    ) + ")"
+
+
+def fingerprint(schema, name):
+    kind, message = find_type(schema, name)
+    if kind != "message":
+        return None
+    features = {}
+    seen = {}
+    for key in message.fields:
+        shape = (key.label, key.key, type_kind(schema, key.type, 1))
+        seen[shape] = seen.get(shape, 0) + 1
+        features[("shape",) + shape + (seen[shape],)] = SHAPE_WEIGHT
+        features[("number", key.number) + shape] = NUMBER_WEIGHT
+        features[("name", key.name)] = NAME_WEIGHT
+    return features
+
+
+def similarity(a, b):
+    shared = sum(weight for feature, weight in a.items() if feature in b)
+    total = sum(a.values()) + sum(b.values()) - shared
+    return shared / total if total else 1.0
+
+
+def match(newnames, oldnames, newschema, oldschema, min_score):
+    # Old messages are indexed by feature, a new message is only scored against
+    # the old ones sharing one of its rarer features
+    old_prints = {}
+    index = {}
+    for name in oldnames:
+        features = fingerprint(oldschema, name)
+        if features is None:
+            continue
+        old_prints[name] = features
+        for feature in features:
+            index.setdefault(feature, []).append(name)
+    common = max(COMMON_FEATURE * len(old_prints), 50)
+
+    proposals = []
+    for name in newnames:
+        features = fingerprint(newschema, name)
+        if features is None:
+            continue
+        candidates = set()
+        for feature in features:
+            postings = index.get(feature, ())
+            if len(postings) <= common:
+                candidates.update(postings)
+        for other in candidates:
+            if category(other) != category(name):
+                continue
+            score = similarity(features, old_prints[other])
+            if score >= min_score:
+                proposals.append((score, name, other))
+
+    # Best pairs first, each message is paired at most once
+    result = {}
+    paired = set()
+    for score, name, other in sorted(proposals, key=lambda item: (-item[0], item[1], item[2])):
+        if name in result or other in paired:
+            continue
+        result[name] = {"old": other, "score": round(score, 3), "reviewed": False}
+        paired.add(other)
+    return result
+
+
+def read_message_map(path):
+    if path is None or not exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def pending_proposals(path):
+    # Proposals nobody accepted or rejected yet, they translate nothing until then
+    return {
+        name: entry
+        for name, entry in read_message_map(path).items()
+        if entry.get("old") is not None and entry.get("reviewed") is not True
+    }
+
+
+def load_message_map(path, newcmdList, oldcmdList):
+    # New name -> old name of the pairs accepted with "reviewed": true, entries set to null are
+    # rejected and proposals still to be reviewed are left out
+    entries = read_message_map(path)
+    newcmdList, oldcmdList = set(newcmdList), set(oldcmdList)
+    return {
+        name: entry["old"]
+        for name, entry in entries.items()
+        if entry.get("old") is not None
+        and entry.get("reviewed") is True
+        and name in newcmdList
+        and name not in oldcmdList
+        and entry["old"] in oldcmdList
+        and entry["old"] not in newcmdList
+    }
+
+
+if __name__ == "__main__":
+    from cmdIdList import oldcmdList, newcmdList
+
+    parser = argparse.ArgumentParser(
+        description="Propose old <-> new pairs for opcodes renamed between versions."
+    )
+    parser.add_argument("--output", default=MESSAGE_MAP)
+    parser.add_argument("--min-score", type=float, default=0.6)
+    parser.add_argument(
+        "--reset", action="store_true", help="drop the entries of the existing map, reviewed or not"
+    )
+    args = parser.parse_args()
+
+    # Entries already in the map, reviewed or still pending, are kept as they are
+    entries = {} if args.reset else read_message_map(args.output)
+
+    newcmds, oldcmds = set(newcmdList), set(oldcmdList)
+    newjson_list = {splitext(i)[0] for i in listdir(PROTOJSON_NEW_DIR)}
+    oldjson_list = {splitext(i)[0] for i in listdir(PROTOJSON_OLD_DIR)}
+    taken = {entry.get("old") for entry in entries.values()}
+    newnames = [
+        i for i in newcmdList
+        if i not in oldcmds and i in newjson_list and i not in entries
+    ]
+    oldnames = [
+        i for i in oldcmdList
+        if i not in newcmds and i in oldjson_list and i not in taken
+    ]
+
+    proposals = match(
+        newnames,
+        oldnames,
+        new_schema(PROTOJSON_NEW_DIR),
+        new_schema(PROTOJSON_OLD_DIR),
+        args.min_score,
+    )
+    for name, entry in sorted(proposals.items()):
+        print(name + " <- " + entry["old"] + " (" + str(entry["score"]) + ")")
+    print(
+        str(len(proposals))
+        + " of "
+        + str(len(newnames))
+        + " unmatched opcodes paired, set \"reviewed\": true in "
+        + args.output
+        + " to translate them"
+    )
+
+    if proposals or not exists(args.output):
+        entries.update(proposals)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(dict(sorted(entries.items())), f, indent=2)
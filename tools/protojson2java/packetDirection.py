@@ -0,0 +1,51 @@
+import json
+from os.path import exists
+
+# recv: client -> server, send: server -> client
+RECV = "recv"
+SEND = "send"
+
+
+def infer_direction(name):
+    # Requests only come from the client and responses only from the server,
+    # notifies and anything else may go either way
+    if name.endswith("Req"):
+        return {RECV}
+    if name.endswith("Rsp"):
+        return {SEND}
+    return {RECV, SEND}
+
+
+def load_override(path):
+    # {"SomeReq": "send", "SomeNotify": "both"}
+    if path is None or not exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        override = json.load(f)
+    return {
+        name: {RECV, SEND} if value == "both" else {value}
+        for name, value in override.items()
+    }
+
+
+def load_profile(path):
+    # {"recv": {"SomeReq": count}, "send": {"SomeRsp": count}}, exported by the proxy
+    if path is None or not exists(path):
+        return {RECV: {}, SEND: {}}
+    with open(path, "r", encoding="utf-8") as f:
+        profile = json.load(f)
+    return {RECV: profile.get(RECV, {}), SEND: profile.get(SEND, {})}
+
+
+def traffic(profile, direction, name, oldname=None):
+    # The proxy counts recv packets under the new version's name and send packets under the old one's
+    return profile[direction].get(name if direction == RECV or oldname is None else oldname, 0)
+
+
+def get_direction(name, override, profile, oldname=None):
+    if name in override:
+        return override[name]
+    # Traffic seen in a direction outweighs the naming convention
+    return infer_direction(name) | {
+        direction for direction in (RECV, SEND) if traffic(profile, direction, name, oldname)
+    }
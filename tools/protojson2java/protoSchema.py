@@ -0,0 +1,252 @@
+import json
+from os.path import exists, join
+from sys import intern
+
+from stageProfile import stage
+
+SCALAR_TYPES = [
+    "double",
+    "float",
+    "int32",
+    "int64",
+    "uint32",
+    "uint64",
+    "sint32",
+    "sint64",
+    "fixed32",
+    "fixed64",
+    "sfixed32",
+    "sfixed64",
+    "bool",
+    "string",
+    "bytes",
+]
+
+
+class ProtoField:
+    __slots__ = ("name", "number", "type", "label", "oneof", "key")
+
+    def __init__(self, name, number, type, label, oneof=None, key=None):
+        self.name = name
+        self.number = number
+        self.type = type
+        self.label = label  # "optional", "repeated", "map" or "oneof"
+        self.oneof = oneof
+        self.key = key  # key type of a map
+
+
+class ProtoMessage:
+    __slots__ = ("name", "fields")
+
+    def __init__(self, name):
+        self.name = name
+        self.fields = []
+
+
+def new_schema(dir):
+    # Files are analysed lazily, messages and enums are keyed by short name
+    return {"dir": dir, "files": set(), "message": {}, "enum": {}}
+
+
+def analysis_item(schema, item):
+    if "MessageName" in item:
+        message = ProtoMessage(intern(item["MessageName"]))
+        schema["message"][message.name] = message
+        for key in item["MessageBody"] or []:
+            if "OneofName" in key:
+                oneof = intern(key["OneofName"])
+                for field in key["OneofFields"] or []:
+                    message.fields.append(
+                        ProtoField(
+                            intern(field["FieldName"]),
+                            int(field["FieldNumber"]),
+                            intern(field["Type"]),
+                            "oneof",
+                            oneof=oneof,
+                        )
+                    )
+            elif "MapName" in key:
+                message.fields.append(
+                    ProtoField(
+                        intern(key["MapName"]),
+                        int(key["FieldNumber"]),
+                        intern(key["Type"]),
+                        "map",
+                        key=intern(key["KeyType"]),
+                    )
+                )
+            elif "FieldName" in key:
+                message.fields.append(
+                    ProtoField(
+                        intern(key["FieldName"]),
+                        int(key["FieldNumber"]),
+                        intern(key["Type"]),
+                        "repeated" if key.get("IsRepeated") else "optional",
+                    )
+                )
+            else:
+                analysis_item(schema, key)
+    elif "EnumName" in item:
+        schema["enum"][intern(item["EnumName"])] = {
+            intern(value["Ident"]): int(value["Number"])
+            for value in item["EnumBody"] or []
+            if "Ident" in value
+        }
+
+
+def load_file(schema, name):
+    if name in schema["files"]:
+        return
+    schema["files"].add(name)
+    path = join(schema["dir"], name + ".json")
+    if not exists(path):
+        return
+    with stage("load"), open(path, "r", encoding="utf-8") as f:
+        body = json.load(f)["ProtoBody"]
+    with stage("analyse"):
+        for item in body:
+            analysis_item(schema, item)
+
+
+def short_name(type):
+    return type.strip(".").split(".")[-1]
+
+
+def find_type(schema, type):
+    # "Item.Extra" lives in Item.json, ".Vector" in Vector.json
+    node = type.strip(".").split(".")
+    if node[-1] not in schema["message"] and node[-1] not in schema["enum"]:
+        load_file(schema, node[0])
+    if node[-1] in schema["message"]:
+        return "message", schema["message"][node[-1]]
+    if node[-1] in schema["enum"]:
+        return "enum", schema["enum"][node[-1]]
+    return None, None
+
+
+def find_message(schema, name):
+    kind, value = find_type(schema, name)
+    return value if kind == "message" else None
+
+
+def field_number(schema, message, field, default):
+    message = find_message(schema, message)
+    if message is not None:
+        for key in message.fields:
+            if key.name == field:
+                return key.number
+    return default
+
+
+def fold_reachable(name, memo, visit, absorbing):
+    # Result for the type where one reachable type with the absorbing result makes it absorbing.
+    # visit(name) gives (own result, referenced names). Types of one cycle share their result,
+    # only finished cycles are memoized so no provisional assumption leaks into another query.
+    if name in memo:
+        return memo[name]
+    index = {}
+    low = {}
+    value = {}
+    stack = []
+
+    def connect(current):
+        index[current] = low[current] = len(index)
+        stack.append(current)
+        value[current], refs = visit(current)
+        for ref in refs:
+            if value[current] == absorbing:
+                break
+            if ref not in memo:
+                if ref not in index:
+                    connect(ref)
+                    low[current] = min(low[current], low[ref])
+                else:
+                    # Still on the stack, part of the same cycle
+                    low[current] = min(low[current], index[ref])
+            if memo.get(ref) == absorbing:
+                value[current] = absorbing
+        if low[current] == index[current]:
+            members = []
+            while True:
+                member = stack.pop()
+                members.append(member)
+                if member == current:
+                    break
+            result = absorbing if any(value[member] == absorbing for member in members) else not absorbing
+            for member in members:
+                memo[member] = result
+
+    connect(name)
+    return memo[name]
+
+
+def same_wire(name, oldschema, newschema, memo=None):
+    # True if both versions encode the type identically and the values mean the same
+    def visit(name):
+        oldkind, old = find_type(oldschema, name)
+        newkind, new = find_type(newschema, name)
+        if old is None or new is None or oldkind != newkind:
+            return False, ()
+        if oldkind == "enum":
+            return old == new, ()
+        return match_fields(old, new)
+
+    return fold_reachable(name, {} if memo is None else memo, visit, False)
+
+
+def same_wire_renamed(newname, oldname, oldschema, newschema, memo=None):
+    # Same as same_wire for a message whose name changed between the versions
+    if newname == oldname:
+        return same_wire(newname, oldschema, newschema, memo)
+    old = find_message(oldschema, oldname)
+    new = find_message(newschema, newname)
+    if old is None or new is None:
+        return False
+    return same_fields(old, new, oldschema, newschema, {} if memo is None else memo)
+
+
+def match_fields(old, new):
+    # (True if the fields match by number, label and type name, the message and enum types they use)
+    newfields = {key.number: key for key in new.fields}
+    if len(old.fields) != len(newfields):
+        return False, ()
+    refs = []
+    for key in old.fields:
+        other = newfields.get(key.number)
+        if (
+            other is None
+            or key.label != other.label
+            or key.key != other.key
+            or short_name(key.type) != short_name(other.type)
+        ):
+            return False, ()
+        if key.type not in SCALAR_TYPES:
+            refs.append(short_name(key.type))
+    return True, refs
+
+
+def same_fields(old, new, oldschema, newschema, memo):
+    same, refs = match_fields(old, new)
+    return same and all(same_wire(ref, oldschema, newschema, memo) for ref in refs)
+
+
+def enum_table(src, dst):
+    # Source value -> destination value, matched by value name
+    # None when every name both versions share keeps its value
+    if all(dst[ident] == number for ident, number in src.items() if ident in dst):
+        return None
+    return {number: dst.get(ident, number) for ident, number in src.items()}
+
+
+def enum_changed(name, oldschema, newschema, memo=None):
+    # True if an enum reachable from the type renumbers one of its values
+    def visit(name):
+        oldkind, old = find_type(oldschema, name)
+        newkind, new = find_type(newschema, name)
+        if old is None or new is None or oldkind != newkind:
+            return False, ()
+        if oldkind == "enum":
+            return enum_table(new, old) is not None, ()
+        return False, [short_name(key.type) for key in old.fields if key.type not in SCALAR_TYPES]
+
+    return fold_reachable(name, {} if memo is None else memo, visit, True)
@@ -1,20 +1,71 @@
-import sys
+import argparse
 
-from os import listdir, mkdir
-from os.path import exists, splitext
+from os import listdir, mkdir, remove
+from os.path import exists, join, splitext
 import shutil
 
 from packetList import AbilityInvokeMap, CombatTypeMap
 
-OUTPUT_PACKET_DIR = "..\\..\\src\\main\\java\\emu\\protoshift\\server\\packet\\"
-
-OUTPUT_INJECTER_DIR = OUTPUT_PACKET_DIR + "injecter\\"
+OUTPUT_PACKET_DIR = join("..", "..", "src", "main", "java", "emu", "protoshift", "server", "packet", "")
+
+OUTPUT_INJECTER_DIR = join(OUTPUT_PACKET_DIR, "injecter", "")
+
+parser = argparse.ArgumentParser()
+parser.add_argument(
+    "direct", nargs="?", default="", help="1 to forward packets without translation"
+)
+parser.add_argument(
+    "--group",
+    type=int,
+    default=0,
+    help="merge the translators of N opcodes into one class, 0 emits a class per handler",
+)
+parser.add_argument(
+    "--direction-override",
+    default="direction_override.json",
+    help='json of {"Name": "recv" | "send" | "both"} overriding the inferred directions',
+)
+parser.add_argument(
+    "--message-map",
+    default="message_map.json",
+    help="reviewed pairs of opcodes renamed between versions, written by messageMatch.py",
+)
+parser.add_argument(
+    "--profile", help="opcode traffic profile exported by the proxy"
+)
+parser.add_argument(
+    "--trim",
+    action="store_true",
+    help="only emit translators for opcodes seen in the profile, the rest use GenericTranslator",
+)
+parser.add_argument(
+    "--jmh",
+    action="store_true",
+    help="also emit a JMH module in bench/ benchmarking every translator",
+)
+parser.add_argument(
+    "--jmh-top",
+    type=int,
+    default=0,
+    help="only benchmark the N opcodes with the most traffic in the profile",
+)
+args = parser.parse_args()
+if args.trim and args.profile is None:
+    parser.error("--trim needs --profile")
+if args.jmh_top and args.profile is None:
+    parser.error("--jmh-top needs --profile")
+if args.jmh and args.direct == "1":
+    parser.error("--jmh needs translation mode")
 
 if exists(OUTPUT_INJECTER_DIR):
     shutil.rmtree(OUTPUT_INJECTER_DIR)
 mkdir(OUTPUT_INJECTER_DIR)
 
-if len(sys.argv) > 1 and sys.argv[1] == "1":
+# Only written by the grouped translation mode
+if exists(OUTPUT_PACKET_DIR + "Translators.java"):
+    remove(OUTPUT_PACKET_DIR + "Translators.java")
+
+if args.direct == "1":
     with open(OUTPUT_PACKET_DIR + "PacketHandler.java", "w", encoding="utf-8") as file:
         file.write(
             """package emu.protoshift.server.packet;
@@ -87,6 +138,10 @@ public final class PacketHandler {
         if (Configuration.DEBUG_MODE_INFO == Configuration.DebugMode.ALL) {
             ProtoShift.getLogger().debug(Utils.bytesToHex(payload));
         }
+        if (Configuration.PROFILE.enabled)
+            OpcodeProfile.record(opcode);
+        if (Configuration.CAPTURE.enabled)
+            PacketCapture.begin(session, opcode, header, payload);
 
         try {
             var new_payload = Handle.preHandle(session, opcode, payload);
@@ -98,6 +153,9 @@ public final class PacketHandler {
         } catch (IllegalStateException ignored) {
             ProtoShift.getLogger()
                     .error("Unhandled packet (" + opcode.value + ", " + opcode.type + "): " + PacketOpcodesUtil.getOpcodeName(opcode) + ", server is inactive!");
+        } finally {
+            if (Configuration.CAPTURE.enabled)
+                PacketCapture.end();
         }
     }
 }
@@ -180,6 +238,7 @@ import emu.protoshift.server.game.GameSession;
 import emu.protoshift.server.muipserver.Console;
 
 import java.util.Date;
+import java.util.concurrent.CompletableFuture;
 
 public class HandleChat {
     public static void onPrivateChatReq(GameSession session, byte[] payload) {
@@ -189,7 +248,7 @@ public class HandleChat {
             if (req.getTargetUid() == Configuration.CONSOLE.consoleUid) {
                 session.setOnHandleConsoleCmd(true);
 
-                String response = "";
+                CompletableFuture<String> response = CompletableFuture.completedFuture("");
 
                 var packet = new BasePacket(new byte[0], new PacketOpcodes(PacketOpcodes.Opcodes.PrivateChatNotify, 1), BasePacket.EncryptType.ENCRYPT_KEY);
                 switch (req.getContentCase()) {
@@ -217,27 +276,33 @@ public class HandleChat {
                         response = switch (req.getIcon()) {
                             case 1 -> Console.exec(session.getUid(), "point 3 all");
                             case 2 -> Console.exec(session.getUid(), "point 5 all");
-                            default -> "This icon don't have any command";
+                            default -> CompletableFuture.completedFuture("This icon don't have any command");
                         };
                     }
                 }
                 session.send(packet);
 
-                packet.setData(PrivateChatNotifyOuterClass.PrivateChatNotify.newBuilder()
-                        .setChatInfo(ChatInfoOuterClass.ChatInfo.newBuilder()
-                                .setTime((int) new Date().getTime())
-                                .setToUid(session.getUid())
-                                .setUid(Configuration.CONSOLE.consoleUid)
-                                .setText(response)
-                                .build())
-                        .build());
-                session.send(packet);
+                // Answered once the muipserver responds, the packet thread doesn't wait for it
+                response.thenAccept(text -> reply(session, text));
             }
         } catch (Exception e) {
             e.printStackTrace();
         }
     }
 
+    private static void reply(GameSession session, String text) {
+        var packet = new BasePacket(new byte[0], new PacketOpcodes(PacketOpcodes.Opcodes.PrivateChatNotify, 1), BasePacket.EncryptType.ENCRYPT_KEY);
+        packet.setData(PrivateChatNotifyOuterClass.PrivateChatNotify.newBuilder()
+                .setChatInfo(ChatInfoOuterClass.ChatInfo.newBuilder()
+                        .setTime((int) new Date().getTime())
+                        .setToUid(session.getUid())
+                        .setUid(Configuration.CONSOLE.consoleUid)
+                        .setText(text)
+                        .build())
+                .build());
+        session.send(packet);
+    }
+
     public static void onPullPrivateChatReq(GameSession session, byte[] payload) {
         ProtoShift.getLogger().debug("PullPrivateChatReq injected");
         try {
@@ -428,6 +493,8 @@ public class HandleLogin {
                     encrypt_seed = ByteBuffer.wrap(cipher.doFinal(seed_bytes_encrypted)).getLong() ^ session.getClientSeed();
                 }
 
+                // Read by tools/capture to decrypt captures of the session
+                ProtoShift.getLogger().debug("Session key seed of uid " + rsp.getUid() + ": " + encrypt_seed);
                 byte[] encrypt_key = Crypto.generateKey(encrypt_seed);
 
                 session.setUid(rsp.getUid());
@@ -478,11 +545,15 @@ public class HandleMap {
 
 else:
     from cmdIdList import oldcmdList, newcmdList
+    from protoSchema import new_schema, field_number, same_wire, enum_changed
+    from packetDirection import RECV, SEND, load_override, load_profile, get_direction, traffic
+    from messageMatch import load_message_map
+    from jmhModule import select_benchmarks, write_jmh_module
 
-    PROTOJSON_NEW_DIR = "..\\proto2json\\output\\new\\"
-    PROTOJSON_OLD_DIR = "..\\proto2json\\output\\old\\"
-    OUTPUT_RECV_DIR = "..\\..\\src\\main\\java\\emu\\protoshift\\server\\packet\\recv\\"
-    OUTPUT_SEND_DIR = "..\\..\\src\\main\\java\\emu\\protoshift\\server\\packet\\send\\"
+    PROTOJSON_NEW_DIR = join("..", "proto2json", "output", "new", "")
+    PROTOJSON_OLD_DIR = join("..", "proto2json", "output", "old", "")
+    OUTPUT_RECV_DIR = join(OUTPUT_PACKET_DIR, "recv", "")
+    OUTPUT_SEND_DIR = join(OUTPUT_PACKET_DIR, "send", "")
 
     oldjson_list = []
     newjson_list = []
@@ -493,11 +564,79 @@ else:
     for i in listdir(PROTOJSON_OLD_DIR):
         oldjson_list.append(splitext(i)[0])
 
-    for i in oldcmdList:
-        if i in newcmdList:
-            if i not in newjson_list or i not in oldjson_list:
-                continue
+    newschema = new_schema(PROTOJSON_NEW_DIR)
+    oldschema = new_schema(PROTOJSON_OLD_DIR)
+
+    union_cmd_list = field_number(newschema, "UnionCmdNotify", "cmd_list", 1)
+    union_message_id = field_number(newschema, "UnionCmd", "message_id", 2)
+    union_body = field_number(newschema, "UnionCmd", "body", 1)
+
+    enum_memo = {}
 
+    def old_name(name):
+        return renamed.get(name, name)
+
+    def generate_printer(name):
+        # Enums renumbered between versions are matched by value name instead,
+        # renamed messages are not compared and always go by name
+        if name in renamed or enum_changed(name, oldschema, newschema, enum_memo):
+            return "JsonFormat.printer()"
+        return "JsonFormat.printer().printingEnumsAsInts()"
+
+    def generate_passthrough_list():
+        s = ""
+        memo = {}
+        for i in oldcmdList:
+            if i in newcmdList and same_wire(i, oldschema, newschema, memo):
+                s += (
+                    "\n        passthrough(PacketOpcodes.newOpcodes."
+                    + i
+                    + ", PacketOpcodes.oldOpcodes."
+                    + i
+                    + ");"
+                )
+        return s
+
+    override = load_override(args.direction_override)
+    profile = load_profile(args.profile)
+
+    # Opcodes renamed between the versions, paired by messageMatch.py and reviewed
+    renamed = load_message_map(args.message_map, newcmdList, oldcmdList)
+    if renamed:
+        print("Translating " + str(len(renamed)) + " renamed opcodes from " + args.message_map)
+
+    recv_list = []
+    send_list = []
+
+    for i in [i for i in oldcmdList if i in newcmdList] + list(renamed):
+        if i not in newjson_list or old_name(i) not in oldjson_list:
+            continue
+
+        # Only the directions the message can travel in get a handler
+        direction = get_direction(i, override, profile, old_name(i))
+        if RECV in direction and (not args.trim or traffic(profile, RECV, i)):
+            recv_list.append(i)
+        if SEND in direction and (not args.trim or traffic(profile, SEND, i, old_name(i))):
+            send_list.append(i)
+
+    if args.trim:
+        print(
+            "Trimmed to "
+            + str(len(recv_list))
+            + " recv and "
+            + str(len(send_list))
+            + " send translators, the rest use GenericTranslator"
+        )
+
+    if args.jmh:
+        write_jmh_module(
+            "JsonTranslatorBenchmark",
+            "Translation through JSON, as protojson2java.py generates it",
+            select_benchmarks(recv_list, send_list, old_name, profile, args.jmh_top),
+        )
+
+    if args.group == 0:
+        for i in recv_list:
             with open(
                 OUTPUT_RECV_DIR + "Handler" + i + ".java", "w", encoding="utf-8"
             ) as file:
@@ -523,16 +662,18 @@ else:
         public static class Packet extends BasePacket {
             public Packet(byte[] header, EncryptType encryptType, byte[] payload) {
                 super(header, new PacketOpcodes(PacketOpcodes.oldOpcodes."""
-                    + i
+                    + old_name(i)
                     + """, 2), encryptType);
                 var q = emu.protoshift.net.oldproto."""
-                    + i
+                    + old_name(i)
                     + """OuterClass."""
-                    + i
+                    + old_name(i)
                     + """.newBuilder();
                 try{
                     JsonFormat.parser().ignoringUnknownFields().merge(
-                            JsonFormat.printer().printingEnumsAsInts().print(
+                            """
+                    + generate_printer(i)
+                    + """.print(
                                 emu.protoshift.net.newproto."""
                     + i
                     + """OuterClass."""
@@ -558,6 +699,8 @@ else:
     }
     """
                 )
+
+        for i in send_list:
             with open(
                 OUTPUT_SEND_DIR + "Handler" + i + ".java", "w", encoding="utf-8"
             ) as file:
@@ -575,7 +718,7 @@ else:
     import emu.protoshift.server.game.GameSession;
 
     @Opcodes(value = PacketOpcodes.oldOpcodes."""
-                    + i
+                    + old_name(i)
                     + """, type = 2)
     public class Handler"""
                     + i
@@ -592,11 +735,13 @@ else:
                     + """.newBuilder();
                 try{
                     JsonFormat.parser().ignoringUnknownFields().merge(
-                            JsonFormat.printer().printingEnumsAsInts().print(
+                            """
+                    + generate_printer(i)
+                    + """.print(
                                     emu.protoshift.net.oldproto."""
-                    + i
+                    + old_name(i)
                     + """OuterClass."""
-                    + i
+                    + old_name(i)
                     + """.parseFrom(payload)
                             ), p);
                 } catch (InvalidProtocolBufferException e) {
@@ -620,6 +765,224 @@ else:
     """
                 )
 
+    def generate_translator(i, isrecv):
+        src = "newproto" if isrecv else "oldproto"
+        dst = "oldproto" if isrecv else "newproto"
+        srcname = i if isrecv else old_name(i)
+        dstname = old_name(i) if isrecv else i
+        return (
+            """
+    private static BasePacket """
+            + i
+            + """(byte[] header, BasePacket.EncryptType encryptType, byte[] payload) throws InvalidProtocolBufferException {
+        var builder = emu.protoshift.net."""
+            + dst
+            + "."
+            + dstname
+            + "OuterClass."
+            + dstname
+            + """.newBuilder();
+        JsonFormat.parser().ignoringUnknownFields().merge(
+                """
+            + generate_printer(i)
+            + """.print(
+                        emu.protoshift.net."""
+            + src
+            + "."
+            + srcname
+            + "OuterClass."
+            + srcname
+            + """.parseFrom(payload)
+                ), builder);
+        var packet = new BasePacket(header, new PacketOpcodes(PacketOpcodes."""
+            + ("oldOpcodes." if isrecv else "newOpcodes.")
+            + dstname
+            + (", 2" if isrecv else ", 1")
+            + """), encryptType);
+        packet.setData(builder.build());
+        return packet;
+    }
+"""
+        )
+
+    def generate_translator_group(group, names, isrecv):
+        # Translators are static methods reached through a switch, so a group costs one class
+        direction = "Recv" if isrecv else "Send"
+        return (
+            """package emu.protoshift.server.packet."""
+            + direction.lower()
+            + """;
+
+import com.google.protobuf.InvalidProtocolBufferException;
+import com.google.protobuf.util.JsonFormat;
+
+import emu.protoshift.net.packet.BasePacket;
+import emu.protoshift.net.packet.PacketOpcodes;
+
+import emu.protoshift.server.packet.Translators;
+
+import java.util.Map;
+
+public final class """
+            + direction
+            + "Translator"
+            + str(group)
+            + """ {
+    public static void register(Map<Integer, emu.protoshift.net.packet.PacketHandler> handlers) {"""
+            + "".join(
+                """
+        handlers.put(PacketOpcodes."""
+                + ("newOpcodes." if isrecv else "oldOpcodes.")
+                + (i if isrecv else old_name(i))
+                + ", new Translators.Handler("
+                + ("true" if isrecv else "false")
+                + ", "
+                + str(group)
+                + ", "
+                + str(index)
+                + "));"
+                for index, i in enumerate(names)
+            )
+            + """
+    }
+
+    public static BasePacket translate(int index, byte[] header, BasePacket.EncryptType encryptType, byte[] payload) throws InvalidProtocolBufferException {
+        return switch (index) {"""
+            + "".join(
+                """
+            case """
+                + str(index)
+                + " -> "
+                + i
+                + "(header, encryptType, payload);"
+                for index, i in enumerate(names)
+            )
+            + """
+            default -> throw new IllegalArgumentException("Unknown translator " + index);
+        };
+    }
+"""
+            + "".join(generate_translator(i, isrecv) for i in names)
+            + """}
+"""
+        )
+
+    def generate_translator_dispatch(groups, isrecv):
+        direction = "Recv" if isrecv else "Send"
+        return "".join(
+            """
+            case """
+            + str(group)
+            + " -> emu.protoshift.server.packet."
+            + direction.lower()
+            + "."
+            + direction
+            + "Translator"
+            + str(group)
+            + ".translate(index, header, encryptType, payload);"
+            for group in range(groups)
+        )
+
+    if args.group > 0:
+        recv_groups = [
+            recv_list[index : index + args.group]
+            for index in range(0, len(recv_list), args.group)
+        ]
+        send_groups = [
+            send_list[index : index + args.group]
+            for index in range(0, len(send_list), args.group)
+        ]
+        for group, names in enumerate(recv_groups):
+            with open(
+                OUTPUT_RECV_DIR + "RecvTranslator" + str(group) + ".java",
+                "w",
+                encoding="utf-8",
+            ) as file:
+                file.write(generate_translator_group(group, names, True))
+        for group, names in enumerate(send_groups):
+            with open(
+                OUTPUT_SEND_DIR + "SendTranslator" + str(group) + ".java",
+                "w",
+                encoding="utf-8",
+            ) as file:
+                file.write(generate_translator_group(group, names, False))
+
+        with open(OUTPUT_PACKET_DIR + "Translators.java", "w", encoding="utf-8") as file:
+            file.write(
+                """package emu.protoshift.server.packet;
+
+import emu.protoshift.net.packet.BasePacket;
+import emu.protoshift.server.game.GameSession;
+
+import java.util.Map;
+
+public final class Translators {
+    // One instance per opcode, all sharing this class
+    public static final class Handler extends emu.protoshift.net.packet.PacketHandler {
+        private final boolean isRecv;
+        private final int group;
+        private final int index;
+
+        public Handler(boolean isRecv, int group, int index) {
+            this.isRecv = isRecv;
+            this.group = group;
+            this.index = index;
+        }
+
+        private BasePacket translate(byte[] header, BasePacket.EncryptType encryptType, byte[] payload) throws Exception {
+            return isRecv ? translateRecv(group, index, header, encryptType, payload)
+                    : translateSend(group, index, header, encryptType, payload);
+        }
+
+        @Override
+        public BasePacket handle(byte[] payload) throws Exception {
+            return translate(new byte[0], BasePacket.EncryptType.NONE, payload);
+        }
+
+        @Override
+        public void handle(GameSession session, byte[] header, byte[] payload, BasePacket.EncryptType encryptType) throws Exception {
+            session.send(translate(header, encryptType, payload));
+        }
+    }
+
+    public static void register(Map<Integer, emu.protoshift.net.packet.PacketHandler> newHandlers,
+                                Map<Integer, emu.protoshift.net.packet.PacketHandler> oldHandlers) {"""
+                + "".join(
+                    """
+        emu.protoshift.server.packet.recv.RecvTranslator"""
+                    + str(group)
+                    + ".register(newHandlers);"
+                    for group in range(len(recv_groups))
+                )
+                + "".join(
+                    """
+        emu.protoshift.server.packet.send.SendTranslator"""
+                    + str(group)
+                    + ".register(oldHandlers);"
+                    for group in range(len(send_groups))
+                )
+                + """
+    }
+
+    private static BasePacket translateRecv(int group, int index, byte[] header, BasePacket.EncryptType encryptType, byte[] payload) throws Exception {
+        return switch (group) {"""
+                + generate_translator_dispatch(len(recv_groups), True)
+                + """
+            default -> throw new IllegalArgumentException("Unknown translator group " + group);
+        };
+    }
+
+    private static BasePacket translateSend(int group, int index, byte[] header, BasePacket.EncryptType encryptType, byte[] payload) throws Exception {
+        return switch (group) {"""
+                + generate_translator_dispatch(len(send_groups), False)
+                + """
+            default -> throw new IllegalArgumentException("Unknown translator group " + group);
+        };
+    }
+}
+"""
+            )
+
     def generate_invoke_parameter(map, type):
         s = ""
         for key in map:
@@ -647,7 +1010,9 @@ else:
                 + """.parseFrom(invoke.get"""
                 + type.capitalize()
                 + """Data());
-                                String json = JsonFormat.printer().printingEnumsAsInts().print("""
+                                String json = """
+                + generate_printer(map[key])
+                + """.print("""
                 + type
                 + """Data);
                                 JsonFormat.parser().ignoringUnknownFields().merge(json, new_"""
@@ -785,6 +1150,7 @@ import io.netty.buffer.ByteBuf;
 import io.netty.buffer.Unpooled;
 import org.reflections.Reflections;
 
+import java.lang.management.ManagementFactory;
 import java.util.HashMap;
 import java.util.Map;
 
@@ -793,15 +1159,35 @@ public final class PacketHandler {
     public static final Map<Integer, emu.protoshift.net.packet.PacketHandler> oldHandlers = new HashMap<>();
 
     public static void init() {
+        long start = System.nanoTime();
+"""
+            + (
+                """
+        Translators.register(newHandlers, oldHandlers);
+"""
+                if args.group > 0
+                else """
         Reflections reflections = new Reflections("emu.protoshift.server.packet");
 
         for (var obj : reflections.getSubTypesOf(emu.protoshift.net.packet.PacketHandler.class)) {
             registerPacketHandler(obj);
         }
-
+"""
+            )
+            + """
         // Debug
         ProtoShift.getLogger().info("Registered newHandlers " + newHandlers.size() + " " + emu.protoshift.net.packet.PacketHandler.class.getSimpleName() + "s");
         ProtoShift.getLogger().info("Registered oldHandlers " + oldHandlers.size() + " " + emu.protoshift.net.packet.PacketHandler.class.getSimpleName() + "s");
+        ProtoShift.getLogger().info("Handlers registered in " + (System.nanoTime() - start) / 1000000 + " ms, "
+                + ManagementFactory.getClassLoadingMXBean().getLoadedClassCount() + " classes loaded, metaspace " + getMetaspaceUsed() / 1024 + " KB");
+    }
+
+    private static long getMetaspaceUsed() {
+        for (var pool : ManagementFactory.getMemoryPoolMXBeans()) {
+            if (pool.getName().equals("Metaspace"))
+                return pool.getUsage().getUsed();
+        }
+        return 0;
     }
 
     public static void registerPacketHandler(Class<? extends emu.protoshift.net.packet.PacketHandler> handlerClass) {
@@ -876,15 +1262,35 @@ public final class PacketHandler {
         if (Configuration.DEBUG_MODE_INFO == Configuration.DebugMode.ALL) {
             ProtoShift.getLogger().debug(Utils.bytesToHex(payload));
         }
-
-        emu.protoshift.net.packet.PacketHandler handler = (opcode.type == 1 ? newHandlers.get(opcode.value) : oldHandlers.get(opcode.value));
-
+        if (Configuration.PROFILE.enabled)
+            OpcodeProfile.record(opcode);
+        if (Configuration.CAPTURE.enabled)
+            PacketCapture.begin(session, opcode, header, payload);
+
+        // A loaded schema diff serves the opcodes it covers ahead of the generated translators
+        emu.protoshift.net.packet.PacketHandler handler = Configuration.SCHEMA_DIFF.enabled ? SchemaDiff.get(opcode) : null;
+        if (handler == null)
+            handler = (opcode.type == 1 ? newHandlers.get(opcode.value) : oldHandlers.get(opcode.value));
+        // Opcodes without a generated translator go through the generic one
+        if (handler == null)
+            handler = GenericTranslator.get(opcode);
+
+        // Logging in and rewritten payloads depend on the session, they are never served from the cache
+        boolean cacheable = Configuration.TRANSLATION_CACHE.enabled && session.getState() == GameSession.SessionState.ACTIVE;
         try {
             var new_payload = Handle.preHandle(session, opcode, payload);
 
             if (handler != null) {
+                if (Configuration.SHADOW.enabled)
+                    ShadowValidator.sample(opcode, handler, new_payload);
                 try {
-                    handler.handle(session, header, new_payload, encryptType);
+                    if (cacheable && new_payload == payload && TranslationCache.isCacheable(opcode, payload)) {
+                        var translated = TranslationCache.translate(opcode, handler, payload);
+                        var packet = new BasePacket(header, translated.getOpcode(), encryptType);
+                        packet.setData(translated.getData());
+                        session.send(packet);
+                    } else
+                        handler.handle(session, header, new_payload, encryptType);
                 } catch (Exception ex) {
                     ex.printStackTrace();
                 }
@@ -894,6 +1300,9 @@ public final class PacketHandler {
         } catch (IllegalStateException ignored) {
             ProtoShift.getLogger()
                     .error("Unhandled packet (" + opcode.value + ", " + opcode.type + "): " + PacketOpcodesUtil.getOpcodeName(opcode) + ", server is inactive!");
+        } finally {
+            if (Configuration.CAPTURE.enabled)
+                PacketCapture.end();
         }
     }
 }
@@ -984,6 +1393,7 @@ import emu.protoshift.server.game.GameSession;
 import emu.protoshift.server.muipserver.Console;
 
 import java.util.Date;
+import java.util.concurrent.CompletableFuture;
 
 public class HandleChat {
     public static void onPrivateChatReq(GameSession session, byte[] payload) {
@@ -993,7 +1403,7 @@ public class HandleChat {
             if (req.getTargetUid() == Configuration.CONSOLE.consoleUid) {
                 session.setOnHandleConsoleCmd(true);
 
-                String response = "";
+                CompletableFuture<String> response = CompletableFuture.completedFuture("");
 
                 var packet = new BasePacket(new byte[0], new PacketOpcodes(PacketOpcodes.newOpcodes.PrivateChatNotify, 1), BasePacket.EncryptType.ENCRYPT_KEY);
                 switch (req.getContentCase()) {
@@ -1021,27 +1431,33 @@ public class HandleChat {
                         response = switch (req.getIcon()) {
                             case 1 -> Console.exec(session.getUid(), "point 3 all");
                             case 2 -> Console.exec(session.getUid(), "point 5 all");
-                            default -> "This icon don't have any command";
+                            default -> CompletableFuture.completedFuture("This icon don't have any command");
                         };
                     }
                 }
                 session.send(packet);
 
-                packet.setData(PrivateChatNotifyOuterClass.PrivateChatNotify.newBuilder()
-                        .setChatInfo(emu.protoshift.net.newproto.ChatInfoOuterClass.ChatInfo.newBuilder()
-                                .setTime((int) new Date().getTime())
-                                .setToUid(session.getUid())
-                                .setUid(Configuration.CONSOLE.consoleUid)
-                                .setText(response)
-                                .build())
-                        .build());
-                session.send(packet);
+                // Answered once the muipserver responds, the packet thread doesn't wait for it
+                response.thenAccept(text -> reply(session, text));
             }
         } catch (Exception e) {
             e.printStackTrace();
         }
     }
 
+    private static void reply(GameSession session, String text) {
+        var packet = new BasePacket(new byte[0], new PacketOpcodes(PacketOpcodes.newOpcodes.PrivateChatNotify, 1), BasePacket.EncryptType.ENCRYPT_KEY);
+        packet.setData(PrivateChatNotifyOuterClass.PrivateChatNotify.newBuilder()
+                .setChatInfo(emu.protoshift.net.newproto.ChatInfoOuterClass.ChatInfo.newBuilder()
+                        .setTime((int) new Date().getTime())
+                        .setToUid(session.getUid())
+                        .setUid(Configuration.CONSOLE.consoleUid)
+                        .setText(text)
+                        .build())
+                .build());
+        session.send(packet);
+    }
+
     public static void onPullPrivateChatReq(GameSession session, byte[] payload) {
         ProtoShift.getLogger().debug("PullPrivateChatReq injected");
         try {
@@ -1230,6 +1646,8 @@ public class HandleLogin {
                     encrypt_seed = ByteBuffer.wrap(cipher.doFinal(seed_bytes_encrypted)).getLong() ^ session.getClientSeed();
                 }
 
+                // Read by tools/capture to decrypt captures of the session
+                ProtoShift.getLogger().debug("Session key seed of uid " + rsp.getUid() + ": " + encrypt_seed);
                 byte[] encrypt_key = Crypto.generateKey(encrypt_seed);
 
                 session.setUid(rsp.getUid());
@@ -1289,35 +1707,164 @@ public class HandleTime {
             """package emu.protoshift.server.packet.injecter;
 
 import emu.protoshift.ProtoShift;
-import emu.protoshift.net.newproto.UnionCmdNotifyOuterClass;
+import emu.protoshift.config.Configuration;
 
 import emu.protoshift.net.packet.BasePacket;
-
-import com.google.protobuf.ByteString;
+import emu.protoshift.net.packet.GenericTranslator;
 import emu.protoshift.net.packet.PacketOpcodes;
+import emu.protoshift.net.packet.SchemaDiff;
 import emu.protoshift.server.game.GameSession;
 
+import com.google.protobuf.CodedInputStream;
+import com.google.protobuf.CodedOutputStream;
+import com.google.protobuf.WireFormat;
+
+import java.io.IOException;
+import java.util.Arrays;
+import java.util.BitSet;
 
 import static emu.protoshift.server.packet.PacketHandler.newHandlers;
 
 
 public class HandleUnionCmd {
+    // Field numbers of UnionCmdNotify.cmd_list, UnionCmd.message_id and UnionCmd.body
+    private static final int CMD_LIST = """
+            + str(union_cmd_list)
+            + """;
+    private static final int MESSAGE_ID = """
+            + str(union_message_id)
+            + """;
+    private static final int BODY = """
+            + str(union_body)
+            + """;
+
+    private static final int CMD_LIST_TAG = CMD_LIST << 3 | WireFormat.WIRETYPE_LENGTH_DELIMITED;
+    private static final int MESSAGE_ID_TAG = MESSAGE_ID << 3 | WireFormat.WIRETYPE_VARINT;
+    private static final int BODY_TAG = BODY << 3 | WireFormat.WIRETYPE_LENGTH_DELIMITED;
+
+    // Sub commands with the same id and message in both versions
+    private static final BitSet PASSTHROUGH = new BitSet();
+
+    private static void passthrough(int newOpcode, int oldOpcode) {
+        if (newOpcode == oldOpcode)
+            PASSTHROUGH.set(newOpcode);
+    }
+
+    static {"""
+            + generate_passthrough_list()
+            + """
+    }
+
     public static byte[] onUnionCmdNotify(GameSession session, byte[] payload) {
         ProtoShift.getLogger().info("UnionCmdNotify injected");
-        var req = UnionCmdNotifyOuterClass.UnionCmdNotify.newBuilder();
+        // Rewritten cmd_list entries, everything between them is copied untouched
+        int count = 0;
+        int[] starts = new int[16];
+        int[] ends = new int[16];
+        BasePacket[] cmds = new BasePacket[16];
         try {
-            req.mergeFrom(payload);
-            for (var cmd : req.getCmdListBuilderList()) {
-
-                BasePacket new_packet = newHandlers.get(cmd.getMessageId()).
-                        handle(Handle.preHandle(session, new PacketOpcodes(cmd.getMessageId(), 1), cmd.getBody().toByteArray()));
-                cmd.setMessageId(new_packet.getOpcode().value);
-                cmd.setBody(ByteString.copyFrom(new_packet.getData()));
+            var input = CodedInputStream.newInstance(payload);
+            while (!input.isAtEnd()) {
+                int start = input.getTotalBytesRead();
+                int tag = input.readTag();
+                if (tag != CMD_LIST_TAG) {
+                    input.skipField(tag);
+                    continue;
+                }
+                int length = input.readRawVarint32();
+                int offset = input.getTotalBytesRead();
+                input.skipRawBytes(length);
+
+                var cmd = rewriteCmd(session, payload, offset, length);
+                if (cmd == null)
+                    continue;
+                if (count == cmds.length) {
+                    starts = Arrays.copyOf(starts, count << 1);
+                    ends = Arrays.copyOf(ends, count << 1);
+                    cmds = Arrays.copyOf(cmds, count << 1);
+                }
+                starts[count] = start;
+                ends[count] = offset + length;
+                cmds[count++] = cmd;
             }
+            return count == 0 ? payload : rebuild(payload, count, starts, ends, cmds);
         } catch (Exception e) {
             e.printStackTrace();
         }
-        return req.build().toByteArray();
+        return payload;
+    }
+
+    private static BasePacket rewriteCmd(GameSession session, byte[] payload, int offset, int length) throws IOException {
+        var input = CodedInputStream.newInstance(payload, offset, length);
+        int messageId = 0;
+        int bodyOffset = offset;
+        int bodyLength = 0;
+        while (!input.isAtEnd()) {
+            int tag = input.readTag();
+            if (tag == MESSAGE_ID_TAG)
+                messageId = input.readUInt32();
+            else if (tag == BODY_TAG) {
+                bodyLength = input.readRawVarint32();
+                bodyOffset = offset + input.getTotalBytesRead();
+                input.skipRawBytes(bodyLength);
+            } else input.skipField(tag);
+        }
+
+        var opcode = new PacketOpcodes(messageId, 1);
+        // Same id and message in both versions, only the injecter hooks may change it
+        if (PASSTHROUGH.get(messageId)) {
+            byte[] body = Arrays.copyOfRange(payload, bodyOffset, bodyOffset + bodyLength);
+            byte[] new_body = Handle.preHandle(session, opcode, body);
+            if (new_body == body)
+                return null;
+            var packet = new BasePacket(new byte[0], new PacketOpcodes(messageId, 2), BasePacket.EncryptType.NONE);
+            packet.setData(new_body);
+            return packet;
+        }
+
+        emu.protoshift.net.packet.PacketHandler handler = Configuration.SCHEMA_DIFF.enabled ? SchemaDiff.get(opcode) : null;
+        if (handler == null)
+            handler = newHandlers.get(messageId);
+        if (handler == null)
+            handler = GenericTranslator.get(opcode);
+        if (handler == null) {
+            ProtoShift.getLogger().debug("UnionCmd " + messageId + " don't have handler, passthrough");
+            return null;
+        }
+
+        byte[] new_body = Handle.preHandle(session, opcode, Arrays.copyOfRange(payload, bodyOffset, bodyOffset + bodyLength));
+        try {
+            return handler.handle(new_body);
+        } catch (Exception e) {
+            e.printStackTrace();
+            return null;
+        }
+    }
+
+    private static byte[] rebuild(byte[] payload, int count, int[] starts, int[] ends, BasePacket[] cmds) throws IOException {
+        int size = payload.length;
+        int[] cmdSizes = new int[count];
+        for (int i = 0; i < count; i++) {
+            cmdSizes[i] = CodedOutputStream.computeUInt32Size(MESSAGE_ID, cmds[i].getOpcode().value)
+                    + CodedOutputStream.computeByteArraySize(BODY, cmds[i].getData());
+            size += CodedOutputStream.computeTagSize(CMD_LIST) + CodedOutputStream.computeUInt32SizeNoTag(cmdSizes[i])
+                    + cmdSizes[i] - (ends[i] - starts[i]);
+        }
+
+        byte[] result = new byte[size];
+        var output = CodedOutputStream.newInstance(result);
+        int position = 0;
+        for (int i = 0; i < count; i++) {
+            output.writeRawBytes(payload, position, starts[i] - position);
+            output.writeTag(CMD_LIST, WireFormat.WIRETYPE_LENGTH_DELIMITED);
+            output.writeUInt32NoTag(cmdSizes[i]);
+            output.writeUInt32(MESSAGE_ID, cmds[i].getOpcode().value);
+            output.writeByteArray(BODY, cmds[i].getData());
+            position = ends[i];
+        }
+        output.writeRawBytes(payload, position, payload.length - position);
+        output.checkNoSpaceLeft();
+        return result;
     }
 }
 """
@@ -1,224 +1,537 @@
 from cmdIdList import oldcmdList, newcmdList
 from packetList import AbilityInvokeMap, CombatTypeMap
-
-from os import listdir, mkdir
-from os.path import exists
-import json
+from protoSchema import new_schema, load_file, short_name, same_wire, same_wire_renamed, enum_table
+from packetDirection import RECV, SEND, load_override, load_profile, get_direction, traffic
+from messageMatch import load_message_map
+from schemaModel import name_convert_to_camel, load_dir
+from jmhModule import select_benchmarks, write_jmh_module
+
+from os import listdir, makedirs
+from os.path import join
+import argparse
 import re
 
-PROTOJSON_NEW_DIR = '..\\proto2json\\output\\new\\'
-PROTOJSON_OLD_DIR = '..\\proto2json\\output\\old\\'
-OUTPUT_RECV_DIR = '..\\..\\src\\main\\java\\emu\\protoshift\\server\\packet\\recv\\'
-OUTPUT_SEND_DIR = '..\\..\\src\\main\\java\\emu\\protoshift\\server\\packet\\send\\'
-
-OUTPUT_INJECTER_DIR = '..\\..\\src\\main\\java\\emu\\protoshift\\server\\packet\\injecter\\'
+parser = argparse.ArgumentParser()
+parser.add_argument('--direction-override', default='direction_override.json',
+                    help='json of {"Name": "recv" | "send" | "both"} overriding the inferred directions')
+parser.add_argument('--message-map', default='message_map.json',
+                    help='reviewed pairs of opcodes renamed between versions, written by messageMatch.py')
+parser.add_argument('--profile', help='opcode traffic profile exported by the proxy')
+parser.add_argument('--trim', action='store_true',
+                    help='only emit translators for opcodes seen in the profile, the rest use GenericTranslator')
+parser.add_argument('--jmh', action='store_true', help='also emit a JMH module in bench/ benchmarking every translator')
+parser.add_argument('--jmh-top', type=int, default=0,
+                    help='only benchmark the N opcodes with the most traffic in the profile')
+parser.add_argument('--shadow', action='store_true',
+                    help='emit the handlers into emu.protoshift.server.shadow, checked against the JSON ones by ShadowValidator')
+args = parser.parse_args()
+if args.trim and args.profile is None:
+    parser.error('--trim needs --profile')
+if args.jmh_top and args.profile is None:
+    parser.error('--jmh-top needs --profile')
+if args.jmh and args.shadow:
+    parser.error('--jmh benchmarks the primary handlers, not shadow ones')
+
+OUTPUT_PACKET_DIR = join('..', '..', 'src', 'main', 'java', 'emu', 'protoshift', 'server', 'packet', '')
+# Outside server.packet, which PacketHandler.init scans for handlers
+OUTPUT_SHADOW_DIR = join('..', '..', 'src', 'main', 'java', 'emu', 'protoshift', 'server', 'shadow', '')
+PACKAGE = 'emu.protoshift.server.shadow' if args.shadow else 'emu.protoshift.server.packet'
+
+PROTOJSON_NEW_DIR = join('..', 'proto2json', 'output', 'new', '')
+PROTOJSON_OLD_DIR = join('..', 'proto2json', 'output', 'old', '')
+OUTPUT_RECV_DIR = join(OUTPUT_SHADOW_DIR if args.shadow else OUTPUT_PACKET_DIR, 'recv', '')
+OUTPUT_SEND_DIR = join(OUTPUT_SHADOW_DIR if args.shadow else OUTPUT_PACKET_DIR, 'send', '')
+
+OUTPUT_INJECTER_DIR = join(OUTPUT_PACKET_DIR, 'injecter', '')
+
+# HotSpot never compiles methods over HugeMethodLimit, and only inlines callees up to FreqInlineSize
+HUGE_METHOD_LIMIT = 8000
+INLINE_LIMIT = 325
+FIELD_GROUP_LIMIT = 2000
 
 oldobject_map = {}
 newobject_map = {}
+oldenum_map = {}
+newenum_map = {}
 enum_list = []
+enum_tables = {}
+helper_methods = {}
+object_chains = {}
+# Handlers share one converter class per message type, the injecters keep private helpers
+shared_converters = False
+
+newschema = new_schema(PROTOJSON_NEW_DIR)
+oldschema = new_schema(PROTOJSON_OLD_DIR)
+wire_memo = {}
+
+
+def find_field(key, parameter):
+    # Fields of both versions are paired by name and type, numbers may differ
+    for other in parameter:
+        if other.name == key.name and other.type == key.type:
+            return other
+    return None
+
+
+def class_name(name, isold):
+    dir = oldobject_map[name].dir if isold else newobject_map[name].dir
+    node = dir.split('.')
+    return 'emu.protoshift.net.' + ('oldproto' if isold else 'newproto') + \
+        '.'+node[1]+'OuterClass.'+'.'.join(node[1:])
+
+
+def is_raw(type):
+    # Nested types encoded identically in both versions skip the field by field conversion.
+    # Top-level fields of the packet are copied from the payload bytes (raw_fields), deeper
+    # ones are re-serialized from the parsed message and merged as unknown fields
+    name = short_name(type)
+    if name not in oldobject_map or name not in newobject_map:
+        return False
+    # Nested types live in the file of their top-level message
+    load_file(oldschema, oldobject_map[name].dir.split('.')[1])
+    load_file(newschema, newobject_map[name].dir.split('.')[1])
+    return same_wire(name, oldschema, newschema, wire_memo)
+
+
+def is_enum_changed(type):
+    name = short_name(type)
+    return oldenum_map.get(name) is not None and newenum_map.get(name) is not None and \
+        enum_table(newenum_map[name], oldenum_map[name]) is not None
+
+
+def generate_enum_table(method, table):
+    # Dense tables are indexed by value, sparse ones only switch on the values that moved
+    constant = re.sub(r'([a-z0-9])([A-Z])', r'\1_\2', method).upper()
+    low = min(table)
+    high = max(table)
+    if high - low < 4 * len(table) + 64:
+        index = 'value' if low == 0 else 'value - ' + \
+            str(low) if low > 0 else 'value + '+str(-low)
+        return '''
+    private static final int[] '''+constant+''' = {'''+', '.join(str(table.get(value, value)) for value in range(low, high + 1))+'''};
+
+    public static int '''+method+'''(int value) {
+        int index = '''+index+''';
+        return index >= 0 && index < '''+constant+'''.length ? '''+constant+'''[index] : value;
+    }
+'''
+    return '''
+    public static int '''+method+'''(int value) {
+        return switch (value) {'''+''.join('''
+            case '''+str(value)+''' -> '''+str(table[value])+''';''' for value in sorted(table) if table[value] != value)+'''
+            default -> value;
+        };
+    }
+'''
 
 
-def name_convert_to_camel(name: str) -> str:
-    result = name.capitalize()
-    result = re.sub(r'[0-9]([a-z])', lambda x: x.group()
-                    [0] + x.group()[1].upper(), result)
-    result = re.sub(r'(_[0-9])', lambda x: x.group()[1], result)
-    result = re.sub(r'(_[a-z])', lambda x: x.group()[1].upper(), result)
-    return result
+def convert_enum(type, isrecv, value):
+    # Renumbered enums go through a lookup in EnumTables, unchanged ones are copied as is
+    if not is_enum_changed(type):
+        return value
+    name = short_name(type)
+    method = name[0].lower()+name[1:]+('ToOld' if isrecv else 'ToNew')
+    if method not in enum_tables:
+        enum_tables[method] = generate_enum_table(method, enum_table(
+            newenum_map[name], oldenum_map[name]) if isrecv else enum_table(oldenum_map[name], newenum_map[name]))
+    return 'EnumTables.'+method+'('+value+')'
+
+
+def generate_field_parameter(srckey, dstkey, isrecv, datafrom):
+    if srckey.type == 'classic':
+        return '.set'+dstkey.name+'('+datafrom+'.get'+srckey.name+'())'
+    if srckey.type in enum_list:
+        return '.set'+dstkey.name+'Value('+convert_enum(srckey.type, isrecv, datafrom+'.get'+srckey.name+'Value()')+')'
+    if is_raw(srckey.type):
+        return '.mergeUnknownFields(ProtoUtils.rawField('+str(dstkey.number)+', '+datafrom+'.has' + \
+            srckey.name+'(), '+datafrom+'.get'+srckey.name+'()))'
+    if srckey.type in oldobject_map and srckey.type in newobject_map:
+        return '.set'+dstkey.name+'('+generate_object_value(
+            srckey.type, isrecv, datafrom+'.get'+srckey.name+'()')+')'
+    return None
 
 
-def analysis_field(name, json, map):
-    if 'MessageName' in json:
-        map[json['MessageName']] = {
-            'dir': (map[name]['dir'] if name != 'root' else 'root') + '.'+json['MessageName'],
-            'classic': [],
-            'repeated': [],
-            'map': [],
-            'oneof': []
-        }
-        if json['MessageBody'] is not None:
-            for key in json['MessageBody']:
-                analysis_field(json['MessageName'], key, map)
-        return
-    if 'EnumName' in json:
-        enum_list.append(json['EnumName'])
-        return
-    if 'OneofName' in json:
-        # idk whether it would work
-        map[name+'.'+json['OneofName']] = {
-            'classic': [],
-            'repeated': [],
-            'map': []
-        }
-        map[name]['oneof'].append(name+'.'+json['OneofName'])
-        if json['OneofFields'] != None:
-            for key in json['OneofFields']:
-                analysis_field(name+'.'+json['OneofName'], key, map)
-        return
-    if 'Type' in json:
-        if json['Type'] in ['double', 'float', 'int32', 'int64', 'uint32', 'uint64', 'sint32', 'sint64', 'fixed32', 'fixed64', 'sfixed32', 'sfixed64', 'bool', 'string', 'bytes']:
-            if 'IsRepeated' in json:
-                if json['IsRepeated']:
-                    map[name]['repeated'].append(
-                        {'Name': name_convert_to_camel(json['FieldName']), 'Type': 'classic'})
-                    return
-            if 'FieldName' in json:
-                map[name]['classic'].append(
-                    {'Name': name_convert_to_camel(json['FieldName']), 'Type': 'classic'})
-                return
-            if 'MapName' in json:
-                map[name]['map'].append(
-                    {'Name': name_convert_to_camel(json['MapName']), 'Type': 'classic'})
-                return
-        else:
-            if 'IsRepeated' in json:
-                if json['IsRepeated']:
-                    map[name]['repeated'].append(
-                        {'Name': name_convert_to_camel(json['FieldName']), 'Type': json['Type']})
-                    return
-            if 'FieldName' in json:
-                map[name]['classic'].append(
-                    {'Name': name_convert_to_camel(json['FieldName']), 'Type': json['Type']})
-                return
-            if 'MapName' in json:
-                map[name]['map'].append(
-                    {'Name': name_convert_to_camel(json['MapName']), 'Type': json['Type']})
-                return
-    else:
-        return
+def generate_classic_parameter(oldparameter, newparameter, isrecv, datafrom):
+    codes = []
+    for key in oldparameter:
+        other = find_field(key, newparameter)
+        code = generate_field_parameter(
+            other if isrecv else key, key if isrecv else other, isrecv, datafrom) if other else None
+        codes.append(code if code else '// '+key.name)
+
+    return codes
+
+
+def estimate_bytecode(code):
+    # Rough javac output: invocations, local loads and constants dominate the generated code
+    return 4 * len(re.findall(r'\w\s*\(', code)) + \
+        2 * len(re.findall(r'\b(?:data|req|rsp|item|entry|builder|payload|value)\b', code)) + \
+        5 * len(re.findall(r'\b\d+\b', code))
+
+
+def generate_field_groups(name, isrecv, codes, helpers):
+    # A long run of fields is moved into helpers of bounded size, in field order
+    groups = [[]]
+    size = 0
+    for code in codes:
+        if groups[-1] and size + estimate_bytecode(code) > FIELD_GROUP_LIMIT:
+            groups.append([])
+            size = 0
+        groups[-1].append(code)
+        size += estimate_bytecode(code)
+    for index, group in enumerate(groups):
+        helper = helper_name(name, isrecv, 'Fields'+str(index))
+        helpers.append(helper)
+        if helper in helper_methods:
+            continue
+        generate_helper_method(name, isrecv, helper, ''.join(
+            '\n        '+(code if code.startswith('//') else 'builder'+code.replace('@@', 'data')+';') for code in group))
 
 
-def analysis_json(json, map):
-    for i in json['ProtoBody']:
-        analysis_field('root', i, map)
+def converter_class(name, isrecv):
+    dir = oldobject_map[name].dir if isrecv else newobject_map[name].dir
+    return ''.join(dir.split('.')[1:]) + 'Converter'
 
 
-def generate_classic_parameter(oldparameter, newparameter, isrecv, datafrom):
-    s = ''
-    for key in oldparameter:
-        if key in newparameter:
-            if key['Type'] == 'classic':
-                s += '\n                    .set' + \
-                    key['Name']+'('+datafrom+'.get'+key['Name']+'())'
-            elif key['Type'] in enum_list:
-                s += '\n                    .set' + \
-                    key['Name']+'Value('+datafrom+'.get'+key['Name']+'Value())'
-            else:
-                if key['Type'] in oldobject_map and key['Type'] in newobject_map:
-                    s += '\n                    .set'+key['Name']+'('+generate_object_parameter(
-                        key['Type'], oldobject_map[key['Type']], newobject_map[key['Type']], isrecv, datafrom+'.get'+key['Name']+'()')+')'
-                else:
-                    s += '\n                    // '+key['Name']
-        else:
-            s += '\n                    // '+key['Name']
+def converter_name(name, isrecv):
+    if shared_converters:
+        return converter_class(name, isrecv)+'.convert'
+    dir = oldobject_map[name].dir if isrecv else newobject_map[name].dir
+    return 'convert' + ''.join(dir.split('.')[1:])
 
-    return s
+
+def method_declaration():
+    return 'static' if shared_converters else 'private static'
 
 
-def generate_repeated_parameter(oldparameter, newparameter, isrecv, datafrom):
+def generate_object_value(name, isrecv, datafrom, inline=True):
+    # Small nested types are built inline, larger or recursive ones get a converter of their own
+    converter = converter_name(name, isrecv)
+    key = (name, isrecv)
+    if key not in object_chains:
+        object_chains[key] = None
+        object_chains[key] = generate_object_parameter(
+            name, oldobject_map[name], newobject_map[name], isrecv, '@@')
+    chain = object_chains[key]
+    if chain is not None and inline and converter+'(' not in chain and estimate_bytecode(chain) <= INLINE_LIMIT:
+        return chain.replace('@@', datafrom)
+    if chain is not None and converter not in helper_methods:
+        helper_methods[converter] = '''
+    '''+method_declaration()+''' '''+class_name(name, isrecv)+''' '''+converter.split('.')[-1]+'''('''+class_name(name, not isrecv)+''' data) {
+        return '''+chain.replace('@@', 'data')+''';
+    }
+'''
+    return converter+'('+datafrom+')'
+
+
+def helper_name(name, isrecv, field):
+    if shared_converters:
+        return converter_class(name, isrecv)+'.copy'+field
+    dir = oldobject_map[name].dir if isrecv else newobject_map[name].dir
+    return 'copy' + ''.join(dir.split('.')[1:]) + field
+
+
+def generate_helper_method(name, isrecv, helper, body):
+    helper_methods[helper] = '''
+    '''+method_declaration()+''' '''+class_name(name, isrecv)+'''.Builder '''+helper.split('.')[-1]+'''('''+class_name(name, isrecv)+'''.Builder builder, '''+class_name(name, not isrecv)+''' data) {'''+body+'''
+        return builder;
+    }
+'''
+
+
+def is_packed(key, newparameter):
+    # Packed scalars keeping their number and type can be copied as raw bytes
+    other = find_field(key, newparameter)
+    return other is not None and other.number == key.number and (
+        key.scalar not in [None, 'string', 'bytes'] and other.scalar == key.scalar or
+        key.type in enum_list and not is_enum_changed(key.type))
+
+
+def raw_fields(parameter, newparameter, isrecv):
+    # Unchanged message fields of the packet are copied from the payload bytes, renumbered if needed
+    pairs = []
+    for key in parameter:
+        other = find_field(key, newparameter)
+        if other and key.type not in ['classic'] + enum_list and is_raw(key.type):
+            pairs.append((other.number, key.number) if isrecv else (key.number, other.number))
+    return pairs
+
+
+def generate_repeated_parameter(name, oldparameter, newparameter, isrecv, datafrom, helpers):
     s = ''
     for key in oldparameter:
-        if key in newparameter:
-            if key['Type'] == 'classic':
-                s += '\n                    .addAll' + \
-                    key['Name']+'('+datafrom+'.get'+key['Name']+'List())'
-            elif key['Type'] in enum_list:
-                s += '\n                    .addAll' + \
-                    key['Name']+'Value('+datafrom+'.get' + \
-                    key['Name']+'ValueList())'
-            else:
-                if key['Type'] in oldobject_map and key['Type'] in newobject_map:
-                    s += '\n                        .addAll' + \
-                        key['Name']+'(new LinkedList<>() {{'
-                    s += '\n                            '+datafrom+'.get'+key['Name']+'List().forEach(i -> add('+generate_object_parameter(
-                        key['Type'], oldobject_map[key['Type']], newobject_map[key['Type']], isrecv, 'i')+'));'
-                    s += '\n                    }})'
-                else:
-                    s += '\n                    // '+key['Name']
+        if not find_field(key, newparameter) or key.type != 'classic' and key.type not in enum_list and (
+                key.type not in oldobject_map or key.type not in newobject_map):
+            s += '\n                    // '+key.name
+            continue
+        if key.type not in ['classic'] + enum_list and is_raw(key.type):
+            other = find_field(key, newparameter)
+            s += '\n                    .mergeUnknownFields(ProtoUtils.rawFields(' + \
+                str(key.number if isrecv else other.number)+', '+datafrom+'.get'+key.name+'List()))'
+            continue
+        helper = helper_name(name, isrecv, key.name)
+        helpers.append(helper)
+        if helper in helper_methods:
+            continue
+        helper_methods[helper] = ''
+
+        # Indexed getters keep scalars and enums unboxed
+        if key.type == 'classic':
+            body = '''
+        for (int i = 0, n = data.get'''+key.name+'''Count(); i < n; i++)
+            builder.add'''+key.name+'''(data.get'''+key.name+'''(i));'''
+        elif key.type in enum_list:
+            body = '''
+        for (int i = 0, n = data.get'''+key.name+'''Count(); i < n; i++)
+            builder.add'''+key.name+'''Value('''+convert_enum(key.type, isrecv, 'data.get'+key.name+'Value(i)')+''');'''
         else:
-            s += '\n                    // '+key['Name']
+            body = '''
+        for (var item : data.get'''+key.name+'''List())
+            builder.add'''+key.name+'''('''+generate_object_value(key.type, isrecv, 'item')+''');'''
+        generate_helper_method(name, isrecv, helper, body)
 
     return s
 
 
-def generate_map_parameter(oldparameter, newparameter, isrecv, datafrom):
+def generate_map_parameter(name, oldparameter, newparameter, isrecv, datafrom, helpers):
     s = ''
     for key in oldparameter:
-        if key in newparameter:
-            if key['Type'] == 'classic':
+        if find_field(key, newparameter):
+            if key.type == 'classic':
                 s += '\n                    .putAll' + \
-                    key['Name']+'('+datafrom+'.get'+key['Name']+'Map())'
-            elif key['Type'] in enum_list:
+                    key.name+'('+datafrom+'.get'+key.name+'Map())'
+            elif key.type in enum_list and is_enum_changed(key.type):
+                helper = helper_name(name, isrecv, key.name)
+                helpers.append(helper)
+                if helper in helper_methods:
+                    continue
+                generate_helper_method(name, isrecv, helper, '''
+        for (var entry : data.get'''+key.name+'''ValueMap().entrySet())
+            builder.put'''+key.name+'''Value(entry.getKey(), '''+convert_enum(key.type, isrecv, 'entry.getValue()')+''');''')
+            elif key.type in enum_list:
                 s += '\n                    .putAll' + \
-                    key['Name']+'Value('+datafrom+'.get' + \
-                    key['Name']+'ValueMap())'
+                    key.name+'Value('+datafrom+'.get' + \
+                    key.name+'ValueMap())'
             else:
-                if key['Type'] in oldobject_map and key['Type'] in newobject_map:
-                    s += '\n                        .putAll' + \
-                        key['Name']+'(new HashMap<>() {{'
-                    s += '\n                            '+datafrom+'.get'+key['Name']+'Map().forEach((key, value) -> put(key, '+generate_object_parameter(
-                        key['Type'], oldobject_map[key['Type']], newobject_map[key['Type']], isrecv, 'value')+'));'
-                    s += '\n                    }})'
+                if key.type in oldobject_map and key.type in newobject_map:
+                    helper = helper_name(name, isrecv, key.name)
+                    helpers.append(helper)
+                    if helper in helper_methods:
+                        continue
+                    helper_methods[helper] = ''
+                    generate_helper_method(name, isrecv, helper, '''
+        for (var entry : data.get'''+key.name+'''Map().entrySet())
+            builder.put'''+key.name+'''(entry.getKey(), '''+generate_object_value(key.type, isrecv, 'entry.getValue()')+''');''')
                 else:
-                    s += '\n                    // '+key['Name']
+                    s += '\n                    // '+key.name
         else:
-            s += '\n                    // '+key['Name']
+            s += '\n                    // '+key.name
 
     return s
 
 
-def generate_oneof_parameter(oldparameter, newparameter, isrecv, datafrom):
-    s = ''
-    # Temp comment it because all key were different
-    for key1, key2 in zip(oldparameter, newparameter):
-        s += generate_classic_parameter(
-            oldobject_map[key1]['classic'], newobject_map[key2]['classic'], isrecv, datafrom)
-        s += generate_repeated_parameter(
-            oldobject_map[key1]['repeated'], newobject_map[key2]['repeated'], isrecv, datafrom)
-        s += generate_map_parameter(
-            oldobject_map[key1]['map'], newobject_map[key2]['map'], isrecv, datafrom)
-    return s
-
-
-def generate_object_parameter(name, oldparameter, newparameter, isrecv, datafrom):
-    dir = oldobject_map[name]['dir'] if isrecv else newobject_map[name]['dir']
-    node = dir.split('.', 3)
-    s = 'emu.protoshift.net.' + \
-        ('oldproto' if isrecv else 'newproto') + \
-        '.'+node[1]+'OuterClass.'+node[1] + \
-        ('.'+node[2] if len(node) == 3 else '')+'.newBuilder()'
-    s += generate_classic_parameter(
-        oldparameter['classic'], newparameter['classic'], isrecv, datafrom)
+def match_oneof(oldparameter, newparameter):
+    # Groups are paired by oneof name, then by the alternatives they share
+    pairs = []
+    rest = list(newparameter)
+    for key1 in oldparameter:
+        key2 = next(
+            (key for key in rest if newobject_map[key].oneof == oldobject_map[key1].oneof), None)
+        if key2 is None:
+            names = [key.name for key in oldobject_map[key1].classic]
+            numbers = [key.number for key in oldobject_map[key1].classic]
+            shared = {key: len([other for other in newobject_map[key].classic
+                                if other.name in names or other.number in numbers]) for key in rest}
+            key2 = max(rest, key=lambda key: shared[key], default=None)
+            if key2 is not None and shared[key2] == 0:
+                key2 = None
+        if key2 is not None:
+            rest.remove(key2)
+            pairs.append((key1, key2))
+    return pairs
+
+
+def match_alternative(srcparameter, dstparameter):
+    # Alternatives are paired by name first, then by field number
+    pairs = []
+    rest = list(dstparameter)
+    for key in srcparameter:
+        other = find_field(key, rest)
+        if other:
+            rest.remove(other)
+            pairs.append((key, other))
+    for key in srcparameter:
+        if any(key is pair[0] for pair in pairs):
+            continue
+        other = next((other for other in rest if other.number ==
+                     key.number and other.type == key.type), None)
+        if other:
+            rest.remove(other)
+            pairs.append((key, other))
+    return pairs
+
+
+def generate_oneof_parameter(name, oldparameter, newparameter, isrecv, helpers):
+    for key1, key2 in match_oneof(oldparameter, newparameter):
+        srcgroup = newobject_map[key2] if isrecv else oldobject_map[key1]
+        dstgroup = oldobject_map[key1] if isrecv else newobject_map[key2]
+        helper = helper_name(name, isrecv, name_convert_to_camel(dstgroup.oneof))
+        helpers.append(helper)
+        if helper in helper_methods:
+            continue
+        helper_methods[helper] = ''
+
+        s = ''
+        for srckey, dstkey in match_alternative(srcgroup.classic, dstgroup.classic):
+            code = generate_field_parameter(srckey, dstkey, isrecv, 'data')
+            if code:
+                s += '\n            case '+srckey.field.upper()+' -> builder'+code+';'
+        generate_helper_method(name, isrecv, helper, '''
+        switch (data.get'''+name_convert_to_camel(srcgroup.oneof)+'''Case()) {'''+s+'''
+            default -> {
+            }
+        }''')
+
+
+def generate_object_parameter(name, oldparameter, newparameter, isrecv, datafrom, packed=None):
+    helpers = []
+    classic = oldparameter.classic
+    repeated = oldparameter.repeated
+    if packed is not None:
+        packed += [(key.number, key.number) for key in repeated if is_packed(key, newparameter.repeated)]
+        packed += raw_fields(classic, newparameter.classic, isrecv)
+        packed += raw_fields(repeated, newparameter.repeated, isrecv)
+        numbers = [pair[0 if not isrecv else 1] for pair in packed]
+        classic = [key for key in classic if key.number not in numbers]
+        repeated = [key for key in repeated if key.number not in numbers]
+    s = class_name(name, isrecv)+'.newBuilder()'
+    codes = generate_classic_parameter(
+        classic, newparameter.classic, isrecv, '@@')
+    if estimate_bytecode(''.join(codes)) > FIELD_GROUP_LIMIT:
+        generate_field_groups(name, isrecv, codes, helpers)
+    else:
+        s += ''.join('\n                    '+code.replace('@@', datafrom) for code in codes)
     s += generate_repeated_parameter(
-        oldparameter['repeated'], newparameter['repeated'], isrecv, datafrom)
-    s += generate_map_parameter(oldparameter['map'],
-                                newparameter['map'], isrecv, datafrom)
-    s += generate_oneof_parameter(oldparameter['oneof'],
-                                  newparameter['oneof'], isrecv, datafrom)
+        name, repeated, newparameter.repeated, isrecv, datafrom, helpers)
+    s += generate_map_parameter(name, oldparameter.map,
+                                newparameter.map, isrecv, datafrom, helpers)
+    generate_oneof_parameter(name, oldparameter.oneof,
+                             newparameter.oneof, isrecv, helpers)
+    # Repeated, map and oneof fields are copied by static helpers taking the builder
+    for helper in helpers:
+        s = helper+'('+s+', '+datafrom+')'
     s += '\n                .build()'
     return s
 
 
-if (not exists(OUTPUT_RECV_DIR)):
-    mkdir(OUTPUT_RECV_DIR)
-if (not exists(OUTPUT_SEND_DIR)):
-    mkdir(OUTPUT_SEND_DIR)
+def generate_packet_data(name, isrecv, datafrom):
+    packed = []
+    s = generate_object_parameter(
+        name, oldobject_map[name], newobject_map[name], isrecv, datafrom, packed)
+    if not packed:
+        return s
+    if all(src == dst for src, dst in packed):
+        return 'ProtoUtils.appendFields('+s+'.toByteArray(), payload'+''.join(', '+str(src) for src, dst in packed)+')'
+    return 'ProtoUtils.appendFields('+s+'.toByteArray(), payload, new int[]{' + \
+        ', '.join(str(src) for src, dst in packed)+'}, new int[]{'+', '.join(str(dst) for src, dst in packed)+'})'
+
+
+def generate_packet_body(name, isrecv):
+    # An unchanged packet only needs its opcode replaced
+    if name in renamed or is_raw(name):
+        return '''
+            this.setData(payload);'''
+    datafrom = 'req' if isrecv else 'rsp'
+    return '''
+            var '''+datafrom+''' = emu.protoshift.net.'''+('newproto' if isrecv else 'oldproto')+'''.'''+name+'''OuterClass.'''+name+'''.parseFrom(payload);
+            this.setData('''+generate_packet_data(name, isrecv, datafrom)+''');'''
+
+
+def generate_helper_methods():
+    return ''.join(helper_methods.values())
+
+
+def reset_methods(shared=False):
+    global shared_converters
+    shared_converters = shared
+    helper_methods.clear()
+    object_chains.clear()
+
+
+def write_converters(direction, output_dir):
+    # One class per message type holds its converter and copy helpers, for all handlers of the direction
+    classes = {}
+    for method in sorted(helper_methods):
+        owner, _ = method.split('.')
+        classes.setdefault(owner, {})[method] = helper_methods[method]
+    for owner, methods in classes.items():
+        report_methods(direction+'.'+owner, methods)
+        with open(output_dir+owner+'.java', 'w', encoding='utf-8') as file:
+            file.write(
+'''package '''+PACKAGE+'''.'''+direction+''';
 
-for i in listdir(PROTOJSON_NEW_DIR):
-    newjson = json.load(open(PROTOJSON_NEW_DIR + i, 'r', encoding='utf-8'))
-    analysis_json(newjson, newobject_map)
+import '''+PACKAGE+'''.EnumTables;
 
-for i in listdir(PROTOJSON_OLD_DIR):
-    oldjson = json.load(open(PROTOJSON_OLD_DIR + i, 'r', encoding='utf-8'))
-    analysis_json(oldjson, oldobject_map)
+import emu.protoshift.utils.ProtoUtils;
 
-for i in oldcmdList:
-    if i in newcmdList:
-        if i not in oldobject_map or i not in newobject_map:
-            continue
+final class '''+owner+''' {'''+''.join(methods.values())+'''}
+'''
+            )
+
+
+def report_methods(file, methods):
+    # Whatever is still over the limit stays interpreted, so it is worth a look
+    for method in methods:
+        size = estimate_bytecode(methods[method])
+        if size > HUGE_METHOD_LIMIT:
+            print('WARNING: '+file+'.'+method+' is about ' +
+                  str(size)+' bytes of bytecode, over '+str(HUGE_METHOD_LIMIT))
+
+
+makedirs(OUTPUT_RECV_DIR, exist_ok=True)
+makedirs(OUTPUT_SEND_DIR, exist_ok=True)
+
+load_dir(PROTOJSON_NEW_DIR, listdir(PROTOJSON_NEW_DIR), newobject_map, newenum_map, enum_list)
+load_dir(PROTOJSON_OLD_DIR, listdir(PROTOJSON_OLD_DIR), oldobject_map, oldenum_map, enum_list)
+
+override = load_override(args.direction_override)
+profile = load_profile(args.profile)
+handler_list = [i for i in oldcmdList if i in newcmdList and i in oldobject_map and i in newobject_map]
+
+# Opcodes renamed between the versions, paired by messageMatch.py and reviewed.
+# Only those whose message kept its encoding are forwarded, converting two
+# differently named messages field by field is left to protojson2java.py
+renamed = {}
+for i, old in load_message_map(args.message_map, newcmdList, oldcmdList).items():
+    if i not in newobject_map or old not in oldobject_map:
+        continue
+    load_file(newschema, i)
+    load_file(oldschema, old)
+    if same_wire_renamed(i, old, oldschema, newschema, wire_memo):
+        renamed[i] = old
+        handler_list.append(i)
+    else:
+        print('WARNING: '+old+' was renamed to '+i+' and changed its encoding, not translated')
+
+
+def old_name(name):
+    return renamed.get(name, name)
+
+
+# Only the directions the message can travel in get a handler
+recv_list = []
+send_list = []
+reset_methods(True)
+for i in handler_list:
+    if RECV in get_direction(i, override, profile, old_name(i)) and (not args.trim or traffic(profile, RECV, i)):
+        recv_list.append(i)
+        body = generate_packet_body(i, True)
+        report_methods('recv.Handler'+i, {'Packet': body})
         with open(OUTPUT_RECV_DIR+'Handler'+i+'.java', 'w', encoding='utf-8') as file:
             file.write(
-'''package emu.protoshift.server.packet.recv;
+'''package '''+PACKAGE+'''.recv;
+
+import com.google.protobuf.InvalidProtocolBufferException;
 
 import emu.protoshift.net.packet.BasePacket;
 import emu.protoshift.net.packet.Opcodes;
@@ -227,88 +540,111 @@ import emu.protoshift.net.packet.PacketOpcodes;
 
 import emu.protoshift.server.game.GameSession;
 
-import java.util.LinkedList;
-import java.util.HashMap;
+import '''+PACKAGE+'''.EnumTables;
+
+import emu.protoshift.utils.ProtoUtils;
 
 @Opcodes(value = PacketOpcodes.newOpcodes.'''+i+''', type = 1)
 public class Handler'''+i+''' extends PacketHandler {
     public static class Packet extends BasePacket {
 
-        public Packet(byte[] header, boolean isUseDispatchKey, emu.protoshift.net.newproto.'''+i+'''OuterClass.'''+i+''' req) {
-            super(header, new PacketOpcodes(PacketOpcodes.oldOpcodes.'''+i+''', 2), isUseDispatchKey);
-
-            this.setData('''+generate_object_parameter(i, oldobject_map[i], newobject_map[i], True, 'req')+''');
+        public Packet(byte[] header, EncryptType encryptType, byte[] payload) throws InvalidProtocolBufferException {
+            super(header, new PacketOpcodes(PacketOpcodes.oldOpcodes.'''+old_name(i)+''', 2), encryptType);
+'''+body+'''
         }
     }
 
     @Override
-    public BasePacket Packet(byte[] payload) throws Exception {
-        return new Packet(new byte[0], false, emu.protoshift.net.newproto.'''+i+'''OuterClass.'''+i+'''.parseFrom(payload));
+    public BasePacket handle(byte[] payload) throws Exception {
+        return new Packet(new byte[0], BasePacket.EncryptType.NONE, payload);
     }
 
     @Override
-    public void handle(GameSession session, byte[] header, byte[] payload, boolean isUseDispatchKey) throws Exception {
-        emu.protoshift.net.newproto.'''+i+'''OuterClass.'''+i+''' req = emu.protoshift.net.newproto.'''+i+'''OuterClass.'''+i+'''.parseFrom(payload);
-        // Auto template
-        session.send(new Packet(header, isUseDispatchKey, req));
+    public void handle(GameSession session, byte[] header, byte[] payload, BasePacket.EncryptType encryptType) throws Exception {
+        session.send(new Packet(header, encryptType, payload));
     }
-
 }
 '''
             )
+
+write_converters('recv', OUTPUT_RECV_DIR)
+
+reset_methods(True)
+for i in handler_list:
+    if SEND in get_direction(i, override, profile, old_name(i)) and (not args.trim or traffic(profile, SEND, i, old_name(i))):
+        send_list.append(i)
+        body = generate_packet_body(i, False)
+        report_methods('send.Handler'+i, {'Packet': body})
         with open(OUTPUT_SEND_DIR+'Handler'+i+'.java', 'w', encoding='utf-8') as file:
             file.write(
-'''package emu.protoshift.server.packet.send;
+'''package '''+PACKAGE+'''.send;
+
+import com.google.protobuf.InvalidProtocolBufferException;
 
 import emu.protoshift.net.packet.BasePacket;
 import emu.protoshift.net.packet.Opcodes;
 import emu.protoshift.net.packet.PacketHandler;
 import emu.protoshift.net.packet.PacketOpcodes;
+
 import emu.protoshift.server.game.GameSession;
 
-import java.util.LinkedList;
-import java.util.HashMap;
+import '''+PACKAGE+'''.EnumTables;
+
+import emu.protoshift.utils.ProtoUtils;
 
-@Opcodes(value = PacketOpcodes.oldOpcodes.'''+i+''',type = 2)
+@Opcodes(value = PacketOpcodes.oldOpcodes.'''+old_name(i)+''', type = 2)
 public class Handler'''+i+''' extends PacketHandler {
     public static class Packet extends BasePacket {
 
-        public Packet(byte[] header, boolean isUseDispatchKey, emu.protoshift.net.oldproto.'''+i+'''OuterClass.'''+i+''' rsp) {
-            super(header, new PacketOpcodes(PacketOpcodes.newOpcodes.'''+i+''', 1), isUseDispatchKey);
-
-            this.setData('''+generate_object_parameter(i, oldobject_map[i], newobject_map[i], False, 'rsp')+''');
+        public Packet(byte[] header, EncryptType encryptType, byte[] payload) throws InvalidProtocolBufferException {
+            super(header, new PacketOpcodes(PacketOpcodes.newOpcodes.'''+i+''', 1), encryptType);
+'''+body+'''
         }
     }
 
     @Override
-    public BasePacket Packet(byte[] payload) throws Exception {
-        return new Packet(new byte[0], false, emu.protoshift.net.oldproto.'''+i+'''OuterClass.'''+i+'''.parseFrom(payload));
+    public BasePacket handle(byte[] payload) throws Exception {
+        return new Packet(new byte[0], BasePacket.EncryptType.NONE, payload);
     }
 
     @Override
-    public void handle(GameSession session, byte[] header, byte[] payload, boolean isUseDispatchKey) throws Exception {
-        emu.protoshift.net.oldproto.'''+i+'''OuterClass.'''+i+''' rsp = emu.protoshift.net.oldproto.'''+i+'''OuterClass.'''+i+'''.parseFrom(payload);
-        session.send(new Packet(header, isUseDispatchKey, rsp));
+    public void handle(GameSession session, byte[] header, byte[] payload, BasePacket.EncryptType encryptType) throws Exception {
+        session.send(new Packet(header, encryptType, payload));
     }
-
 }
 '''
             )
 
+write_converters('send', OUTPUT_SEND_DIR)
+
+if args.jmh:
+    write_jmh_module('TypedTranslatorBenchmark', 'Typed field by field translation, as protojson2javaex.py generates it',
+                     select_benchmarks(recv_list, send_list, old_name, profile, args.jmh_top))
+
 def generate_invoke_parameter(map, type):
     s=''
     for key in map:
         if map[key] not in oldobject_map or map[key] not in newobject_map:
             continue
+        if is_raw(map[key]):
+            s+='''
+                    case '''+key+''' -> {
+                    }'''
+            continue
         s+='''
                     case '''+key+''' -> {
                         var '''+type+'''Data = emu.protoshift.net.newproto.'''+map[key]+'''OuterClass.'''+map[key]+'''.parseFrom(invoke.get'''+type.capitalize()+'''Data());
-                        invoke.set'''+type.capitalize()+'''Data('''+generate_object_parameter(map[key], oldobject_map[map[key]], newobject_map[map[key]], True, type+'Data')+'''.toByteString());
+                        invoke.set'''+type.capitalize()+'''Data('''+generate_object_value(map[key], True, type+'Data', False)+'''.toByteString());
                     }'''
     return s
 
-with open(OUTPUT_INJECTER_DIR+'HandleAbility.java', 'w', encoding='utf-8') as file:
-    file.write(
+# The primary JSON handlers keep their own injecters, a shadow build only adds handlers
+if not args.shadow:
+    reset_methods()
+    invokes = generate_invoke_parameter(AbilityInvokeMap, 'ability')
+    report_methods('injecter.HandleAbility', {'handleAbilityInvokes': invokes, **helper_methods})
+    with open(OUTPUT_INJECTER_DIR+'HandleAbility.java', 'w', encoding='utf-8') as file:
+        file.write(
 '''package emu.protoshift.server.packet.injecter;
 
 import emu.protoshift.ProtoShift;
@@ -317,14 +653,17 @@ import emu.protoshift.net.newproto.AbilityInvocationsNotifyOuterClass;
 import emu.protoshift.net.newproto.AbilityInvokeEntryOuterClass;
 import emu.protoshift.net.newproto.ClientAbilityChangeNotifyOuterClass;
 
-import java.util.LinkedList;
+import emu.protoshift.server.packet.EnumTables;
+
+import emu.protoshift.utils.ProtoUtils;
+
 import java.util.List;
 
 public class HandleAbility {
     private static void handleAbilityInvokes(List<AbilityInvokeEntryOuterClass.AbilityInvokeEntry.Builder> invokes) {
         try {
             for (var invoke : invokes) {
-                switch (invoke.getArgumentType()) {'''+generate_invoke_parameter(AbilityInvokeMap,'ability')+'''
+                switch (invoke.getArgumentType()) {'''+invokes+'''
                     default -> ProtoShift.getLogger().error("Unknown ability type: " + invoke.getArgumentType());
                 }
             }
@@ -356,12 +695,15 @@ public class HandleAbility {
         }
         return req.build().toByteArray();
     }
-}
+'''+generate_helper_methods()+'''}
 '''
-            )
-    
-with open(OUTPUT_INJECTER_DIR+'HandleCombat.java', 'w', encoding='utf-8') as file:
-    file.write(
+                )
+
+    reset_methods()
+    invokes = generate_invoke_parameter(CombatTypeMap, 'combat')
+    report_methods('injecter.HandleCombat', {'handleCombatInvokes': invokes, **helper_methods})
+    with open(OUTPUT_INJECTER_DIR+'HandleCombat.java', 'w', encoding='utf-8') as file:
+        file.write(
 '''package emu.protoshift.server.packet.injecter;
 
 import emu.protoshift.ProtoShift;
@@ -369,14 +711,17 @@ import emu.protoshift.ProtoShift;
 import emu.protoshift.net.newproto.CombatInvocationsNotifyOuterClass;
 import emu.protoshift.net.newproto.CombatInvokeEntryOuterClass;
 
-import java.util.LinkedList;
+import emu.protoshift.server.packet.EnumTables;
+
+import emu.protoshift.utils.ProtoUtils;
+
 import java.util.List;
 
 public class HandleCombat {
     private static void handleCombatInvokes(List<CombatInvokeEntryOuterClass.CombatInvokeEntry.Builder> invokes) {
         try {
             for (var invoke : invokes) {
-                switch (invoke.getArgumentType()) {'''+generate_invoke_parameter(CombatTypeMap, 'combat')+'''
+                switch (invoke.getArgumentType()) {'''+invokes+'''
                     default -> ProtoShift.getLogger().error("Unknown ability type: " + invoke.getArgumentType());
                 }
             }
@@ -396,6 +741,14 @@ public class HandleCombat {
         }
         return req.build().toByteArray();
     }
-}
+'''+generate_helper_methods()+'''}
 '''
-            )
\ No newline at end of file
+                )
+
+with open((OUTPUT_SHADOW_DIR if args.shadow else OUTPUT_PACKET_DIR)+'EnumTables.java', 'w', encoding='utf-8') as file:
+    file.write(
+'''package '''+PACKAGE+''';
+
+public final class EnumTables {'''+''.join(enum_tables[method] for method in sorted(enum_tables))+'''}
+'''
+            )
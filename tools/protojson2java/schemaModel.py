@@ -0,0 +1,109 @@
+import json
+import re
+from functools import lru_cache
+from sys import intern
+
+from protoSchema import SCALAR_TYPES
+from stageProfile import stage
+
+# Messages, fields and enums of a full dump number in the hundreds of thousands, so they
+# are slotted objects sharing interned names instead of dicts of their own
+
+
+class Field:
+    __slots__ = ("name", "type", "field", "number", "scalar")
+
+    def __init__(self, name, type, field, number, scalar):
+        self.name = name  # CamelCase, as in the generated accessors
+        self.type = type  # "classic" for scalars, else the type as written in the proto
+        self.field = field  # as written in the proto
+        self.number = number
+        self.scalar = scalar  # the scalar type, None for messages and enums
+
+
+class Message:
+    __slots__ = ("dir", "classic", "repeated", "map", "oneof")
+
+    def __init__(self, dir):
+        self.dir = dir  # "root.Outer.Inner"
+        self.classic = []
+        self.repeated = []
+        self.map = []
+        self.oneof = []  # keys of the Oneof entries in the same map
+
+
+class Oneof:
+    __slots__ = ("oneof", "classic", "repeated", "map")
+
+    def __init__(self, oneof):
+        self.oneof = oneof
+        self.classic = []
+        self.repeated = []
+        self.map = []
+
+
+@lru_cache(maxsize=None)
+def name_convert_to_camel(name: str) -> str:
+    result = name.capitalize()
+    result = re.sub(r'[0-9]([a-z])', lambda x: x.group()
+                    [0] + x.group()[1].upper(), result)
+    result = re.sub(r'(_[0-9])', lambda x: x.group()[1], result)
+    result = re.sub(r'(_[a-z])', lambda x: x.group()[1].upper(), result)
+    return intern(result)
+
+
+def new_field(json, name_key):
+    type = intern(json['Type'])
+    scalar = type if type in SCALAR_TYPES else None
+    field = intern(json[name_key])
+    return Field(name_convert_to_camel(field), 'classic' if scalar else type,
+                 field, int(json['FieldNumber']), scalar)
+
+
+def analysis_field(name, json, map, enums, enum_list):
+    if 'MessageName' in json:
+        message_name = intern(json['MessageName'])
+        map[message_name] = Message(
+            intern((map[name].dir if name != 'root' else 'root') + '.' + message_name))
+        for key in json['MessageBody'] or []:
+            analysis_field(message_name, key, map, enums, enum_list)
+        return
+    if 'EnumName' in json:
+        enum_name = intern(json['EnumName'])
+        enum_list.append(enum_name)
+        values = {intern(value['Ident']): int(value['Number'])
+                  for value in json['EnumBody'] or [] if 'Ident' in value}
+        # Enums are keyed by short name like messages, when messages nest different enums of the
+        # same name a field's type can't tell which one it means, None keeps their numbers as is
+        enums[enum_name] = values if enums.get(enum_name, values) == values else None
+        return
+    if 'OneofName' in json:
+        # idk whether it would work
+        group = intern(name + '.' + json['OneofName'])
+        map[group] = Oneof(intern(json['OneofName']))
+        map[name].oneof.append(group)
+        for key in json['OneofFields'] or []:
+            analysis_field(group, key, map, enums, enum_list)
+        return
+    if 'Type' in json:
+        if json.get('IsRepeated'):
+            map[name].repeated.append(new_field(json, 'FieldName'))
+        elif 'FieldName' in json:
+            map[name].classic.append(new_field(json, 'FieldName'))
+        elif 'MapName' in json:
+            map[name].map.append(new_field(json, 'MapName'))
+
+
+def analysis_json(json, map, enums, enum_list):
+    for i in json['ProtoBody']:
+        analysis_field('root', i, map, enums, enum_list)
+
+
+def load_dir(dir, files, map, enums, enum_list):
+    # One proto2json file is held at a time, its tree is dropped once analysed
+    for file in files:
+        with stage('load'), open(dir + file, 'r', encoding='utf-8') as f:
+            tree = json.load(f)
+        with stage('analyse'):
+            analysis_json(tree, map, enums, enum_list)
+        del tree
@@ -0,0 +1,50 @@
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+# Off unless a benchmark enables it, then time and peak traced memory are charged
+# to the innermost open stage, and to "render" outside of any
+enabled = False
+stages = {}
+stack = []
+last = 0.0
+
+
+def switch():
+    global last
+    now = time.perf_counter()
+    entry = stages.setdefault(stack[-1] if stack else "render", {"seconds": 0.0, "calls": 0, "peak": 0})
+    entry["seconds"] += now - last
+    if tracemalloc.is_tracing():
+        entry["peak"] = max(entry["peak"], tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+    last = now
+
+
+@contextmanager
+def stage(name):
+    if not enabled:
+        yield
+        return
+    switch()
+    stack.append(name)
+    stages.setdefault(name, {"seconds": 0.0, "calls": 0, "peak": 0})["calls"] += 1
+    try:
+        yield
+    finally:
+        switch()
+        stack.pop()
+
+
+def enable(memory=True):
+    # Tracing memory slows the generators down a few times over
+    global enabled, last
+    enabled = True
+    if memory:
+        tracemalloc.start()
+    last = time.perf_counter()
+
+
+def report():
+    switch()
+    return {name: dict(entry, seconds=round(entry["seconds"], 6)) for name, entry in stages.items()}
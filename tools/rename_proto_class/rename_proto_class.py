@@ -1,39 +1,44 @@
 import os
 import sys
+from concurrent.futures import ProcessPoolExecutor
 
-if sys.argv[1] == sys.argv[2]:
-    for file in os.listdir(fr'../../proto/{sys.argv[1]}/proto'):
-        with open(f'../../proto/{sys.argv[1]}/proto/{file}', 'r') as f:
-            temp = ''
-            for line in f.readlines():
-                if 'java_package' in line:
-                    temp += "option java_package = \"emu.protoshift.net.proto\";\r"
-                else:
-                    temp += line
-                    
-        with open(f'../../proto/{sys.argv[1]}/proto/{file}', 'w') as out:
-            out.write(temp)
-else:
-    for file in os.listdir(fr'../../proto/{sys.argv[1]}/proto'):
-        with open(f'../../proto/{sys.argv[1]}/proto/{file}', 'r') as f:
-            temp = ''
-            for line in f.readlines():
-                if 'java_package' in line:
-                    temp += "option java_package = \"emu.protoshift.net.newproto\";\r"
-                else:
-                    temp += line
-                    
-        with open(f'../../proto/{sys.argv[1]}/proto/{file}', 'w') as out:
-            out.write(temp)
-
-    for file in os.listdir(fr'../../proto/{sys.argv[2]}/proto'):
-        with open(f'../../proto/{sys.argv[2]}/proto/{file}', 'r') as f:
-            temp = ''
-            for line in f.readlines():
-                if 'java_package' in line:
-                    temp += "option java_package = \"emu.protoshift.net.oldproto\";\r"
-                else:
-                    temp += line
-                    
-        with open(f'../../proto/{sys.argv[2]}/proto/{file}', 'w') as out:
-            out.write(temp)
+
+def rename(path, package):
+    # Returns whether the file was rewritten, files already in the package keep their mtime
+    option = f'option java_package = "{package}";'
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        lines = f.readlines()
+
+    changed = False
+    for i, line in enumerate(lines):
+        if 'java_package' in line:
+            content = line.rstrip('\r\n')
+            if content != option:
+                lines[i] = option + line[len(content):]
+                changed = True
+
+    if changed:
+        with open(path, 'w', encoding='utf-8', newline='') as out:
+            out.write(''.join(lines))
+    return changed
+
+
+def rename_all(jobs):
+    paths, packages = [], []
+    for proto_dir, package in jobs:
+        for file in os.listdir(proto_dir):
+            paths.append(os.path.join(proto_dir, file))
+            packages.append(package)
+    with ProcessPoolExecutor() as executor:
+        changed = sum(executor.map(rename, paths, packages, chunksize=64))
+    print(f'{changed} of {len(paths)} protos renamed')
+
+
+if __name__ == '__main__':
+    if sys.argv[1] == sys.argv[2]:
+        rename_all([(os.path.join('..', '..', 'proto', sys.argv[1], 'proto'), 'emu.protoshift.net.proto')])
+    else:
+        rename_all([
+            (os.path.join('..', '..', 'proto', sys.argv[1], 'proto'), 'emu.protoshift.net.newproto'),
+            (os.path.join('..', '..', 'proto', sys.argv[2], 'proto'), 'emu.protoshift.net.oldproto'),
+        ])
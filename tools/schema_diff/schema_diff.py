@@ -0,0 +1,166 @@
+"""
+Compile the translation between two protocol versions into a table SchemaDiffTranslator
+interprets, so a proto change is a data deploy instead of regenerating the translators.
+
+    python schema_diff.py <new version> <old version> [--output ../../schema_diff.bin]
+
+Opcodes are paired by name and the reviewed renames of message_map.json, fields the way
+protojson2javaex.py pairs them, as capture_translate.py does offline. Layout, little endian:
+
+    "PSSCHDIF" u32 format
+    u32 enum tables, each u32 n, n * (i32 from, i32 to), sorted, only renumbered values
+    u32 plans, each u8 identity, and unless identity u32 n, n * field
+        field: u32 source number, u32 target number, u8 action, u32 argument
+        action 0 copies, 1 remaps the enum table, 2 and 3 translate with the plan
+        (a message, a map entry)
+    u32 opcodes, each u8 type (1 new to old, 2 old to new), u16 source, u16 target, u32 plan
+
+Fields of the source without a counterpart are dropped, plans of types encoded alike in both
+versions are identities and copied whole.
+"""
+
+import argparse
+import os
+import struct
+import sys
+
+sys.path.insert(0, os.path.join("..", "capture"))
+sys.path.insert(0, os.path.join("..", "protojson2java"))
+from capture_decoder import PROTOJSON_DIR, read_cmdid  # noqa: E402
+from capture_translate import COPY, ENUM, IDENTITY, MESSAGE, MESSAGE_MAP, Opcodes  # noqa: E402
+from messageMatch import load_message_map  # noqa: E402
+from protoSchema import new_schema  # noqa: E402
+
+MAGIC = b"PSSCHDIF"
+FORMAT = 1
+HEADER = struct.Struct("<8sI")
+COUNT = struct.Struct("<I")
+ENUM_VALUE = struct.Struct("<ii")
+FIELD = struct.Struct("<IIBI")
+OPCODE = struct.Struct("<BHHI")
+
+
+class Side:
+    def __init__(self, version, side):
+        self.names = read_cmdid(version)
+        self.schema = new_schema(os.path.join(PROTOJSON_DIR, side, ""))
+
+
+def signed(value):
+    return value - (1 << 32) if value >= 1 << 31 else value
+
+
+class Table:
+    # Plans and enum tables numbered in the order they are reached from the opcodes
+
+    def __init__(self):
+        self.plans = []
+        self.plan_index = {}
+        self.enums = []
+        self.enum_index = {}
+        self.counters = {"remapped": 0, "enums": 0, "messages": 0}
+
+    def add_plan(self, plan, translator):
+        key = IDENTITY if plan is IDENTITY else id(plan)
+        if key in self.plan_index:
+            return self.plan_index[key]
+        index = self.plan_index[key] = len(self.plans)
+        entry = [plan, None]
+        self.plans.append(entry)
+        if plan is IDENTITY:
+            return index
+
+        # Numbered before the fields, recursive types point back at it
+        fields = []
+        for number, (action, tags, argument) in sorted(plan.items()):
+            target = self.tag_number(tags[0])
+            if action == COPY:
+                value = 0
+            elif action == ENUM:
+                value = self.add_enum(argument)
+            elif action == MESSAGE:
+                value = self.add_plan(translator.plans[argument], translator)
+            else:
+                value = self.add_plan(argument, translator)
+            fields.append((number, target, action, value))
+            self.counters["remapped"] += number != target
+        entry[1] = fields
+        return index
+
+    @staticmethod
+    def tag_number(tag):
+        value = shift = 0
+        for byte in tag:
+            value |= (byte & 0x7F) << shift
+            shift += 7
+        return value >> 3
+
+    def add_enum(self, table):
+        if id(table) in self.enum_index:
+            return self.enum_index[id(table)]
+        index = self.enum_index[id(table)] = len(self.enums)
+        self.enums.append(sorted((signed(value & 0xFFFFFFFF), signed(other & 0xFFFFFFFF))
+                                 for value, other in table.items() if value != other))
+        self.counters["enums"] += 1
+        return index
+
+    def write(self, f, opcodes):
+        f.write(HEADER.pack(MAGIC, FORMAT))
+        f.write(COUNT.pack(len(self.enums)))
+        for values in self.enums:
+            f.write(COUNT.pack(len(values)))
+            f.write(b"".join(ENUM_VALUE.pack(value, other) for value, other in values))
+        f.write(COUNT.pack(len(self.plans)))
+        for plan, fields in self.plans:
+            if plan is IDENTITY:
+                f.write(b"\x01")
+                continue
+            f.write(b"\x00" + COUNT.pack(len(fields)))
+            f.write(b"".join(FIELD.pack(*field) for field in fields))
+        f.write(COUNT.pack(len(opcodes)))
+        f.write(b"".join(OPCODE.pack(*opcode) for opcode in opcodes))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("new_version")
+    parser.add_argument("old_version")
+    parser.add_argument("--output", default=os.path.join("..", "..", "schema_diff.bin"))
+    parser.add_argument("--message-map", default=MESSAGE_MAP, help="reviewed renames, written by messageMatch.py")
+    args = parser.parse_args()
+
+    new = Side(args.new_version, "new")
+    old = Side(args.old_version, "old")
+    if not new.names or not old.names:
+        print("cmdid.csv, cmdid.json or packetIds.json not found")
+        exit(1)
+    renames = load_message_map(args.message_map, new.names.values(), old.names.values())
+
+    table = Table()
+    opcodes = []
+    unmatched = 0
+    # Plans are told apart by id, their translators stay alive until the table is written
+    translators = []
+    # Type as in PacketOpcodes, packets of the new version (1) are translated to the old one
+    for type, src, dst, names in ((1, new, old, renames), (2, old, new, {o: n for n, o in renames.items()})):
+        pairs = Opcodes(src, dst, names)
+        translators.append(pairs.translator)
+        for opcode in sorted(src.names):
+            entry = pairs.get(opcode)
+            if entry is None:
+                unmatched += 1
+                continue
+            target, plan = entry
+            opcodes.append((type, opcode, target, table.add_plan(plan, pairs.translator)))
+            table.counters["messages"] += plan is not IDENTITY
+
+    with open(args.output, "wb") as f:
+        table.write(f, opcodes)
+    print(str(len(opcodes)) + " opcodes (" + str(table.counters["messages"]) + " translated, "
+          + str(unmatched) + " without a counterpart), " + str(len(table.plans)) + " plans, "
+          + str(table.counters["enums"]) + " enum tables, " + str(table.counters["remapped"])
+          + " fields renumbered, " + str(os.path.getsize(args.output)) + " bytes in " + args.output)
+
+
+if __name__ == "__main__":
+    main()